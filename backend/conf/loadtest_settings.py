@@ -0,0 +1,13 @@
+# Settings for the server started by the loadtest command: the app settings
+# with a throw away state database, so the assistants and threads of the fake
+# openai server never end up in the real one
+from .settings import *
+
+DATABASES = {
+    "default": {
+        **DATABASES["default"],
+        "ENGINE": "conf.sqlite",
+        "NAME": os.environ.get("LOADTEST_STATE_DB", ".loadtest.statedb"),
+        "OPTIONS": {"timeout": 20},
+    },
+}
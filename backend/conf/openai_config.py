@@ -1,19 +1,158 @@
-from openai import OpenAI
-
+from openai import OpenAI, AsyncOpenAI
+from typing import Dict
+import httpx
+import importlib.util
+import logging
 import os
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
 
+#
+# OpenAI Config
+#
+# One sync and one async client per process, shared by all actors, the
+# event handlers and the management commands so they share a tuned
+# connection pool instead of paying for new TLS handshakes. Pool and
+# timeout settings come from the environment:
+#   OPENAI_MAX_CONNECTIONS    - connections in the pool (100)
+#   OPENAI_MAX_KEEPALIVE      - idle connections kept open (20)
+#   OPENAI_KEEPALIVE_EXPIRY   - seconds an idle connection is kept (30)
+#   OPENAI_HTTP2              - use http/2, needs the h2 package (false)
+#   OPENAI_CONNECT_TIMEOUT    - seconds to connect (5)
+#   OPENAI_POOL_TIMEOUT       - seconds to wait for a free connection (10)
+#   OPENAI_TIMEOUT            - seconds to wait for a response (60)
+#   OPENAI_STREAM_TIMEOUT     - seconds between events of a run stream (120)
+#   OPENAI_FILE_TIMEOUT       - seconds for file uploads and downloads (120)
+#   OPENAI_MAX_RETRIES        - retries of failed requests (2)
+#
 class OpenAIConfig:
 
+    def __init__(self) -> None:
+        self.max_connections = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100))
+        self.max_keepalive = int(os.environ.get("OPENAI_MAX_KEEPALIVE", 20))
+        self.keepalive_expiry = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 30))
+        self.http2 = os.environ.get("OPENAI_HTTP2", "false").lower() == "true"
+        self.connect_timeout = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 5))
+        self.pool_timeout = float(os.environ.get("OPENAI_POOL_TIMEOUT", 10))
+        self.read_timeout = float(os.environ.get("OPENAI_TIMEOUT", 60))
+        self.stream_read_timeout = float(os.environ.get("OPENAI_STREAM_TIMEOUT", 120))
+        self.file_read_timeout = float(os.environ.get("OPENAI_FILE_TIMEOUT", 120))
+        self.max_retries = int(os.environ.get("OPENAI_MAX_RETRIES", 2))
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            LOGGER.warning("OPENAI_HTTP2 is set but the h2 package is not installed, using http/1.1")
+            self.http2 = False
+
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+        self._requests = {'sync': PoolCounters(), 'async': PoolCounters()}
+
     def client(self):
-        return OpenAI(
-            api_key=os.environ.get(
-                "OPENAI_API_KEY", 
-                "<your OpenAI API key is not set as env var>"
-            ),
-        )
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    counters = self._requests['sync']
+                    self._client = OpenAI(
+                        api_key=self._api_key(),
+                        max_retries=self.max_retries,
+                        timeout=self.timeout(),
+                        http_client=httpx.Client(
+                            limits=self._limits(),
+                            http2=self.http2,
+                            timeout=self.timeout(),
+                            event_hooks={'request': [counters.on_request]},
+                        ),
+                    )
+        return self._client
+
+    # used by the async streaming path, only safe to share when running under ASGI
+    def async_client(self):
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    counters = self._requests['async']
+                    self._async_client = AsyncOpenAI(
+                        api_key=self._api_key(),
+                        max_retries=self.max_retries,
+                        timeout=self.timeout(),
+                        http_client=httpx.AsyncClient(
+                            limits=self._limits(),
+                            http2=self.http2,
+                            timeout=self.timeout(),
+                            event_hooks={'request': [counters.aon_request]},
+                        ),
+                    )
+        return self._async_client
 
     def deployment(self):
         return os.environ.get(
             "OPENAI_MODEL",
             "<your OpenAI model deployment is not set as env var>",
         )
+
+    # per operation timeouts, passed as timeout= to the openai calls
+    def timeout(self, operation: str = 'default') -> httpx.Timeout:
+        read_timeout = {
+            'stream': self.stream_read_timeout,
+            'file': self.file_read_timeout,
+        }.get(operation, self.read_timeout)
+        return httpx.Timeout(read_timeout, connect=self.connect_timeout, pool=self.pool_timeout)
+
+    # connections in the pools and requests sent, for the metrics
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        stats = {}
+        for name, client in [('sync', self._client), ('async', self._async_client)]:
+            if client is None:
+                continue
+            stats[name] = {
+                'max_connections': self.max_connections,
+                **self._requests[name].snapshot(),
+                **self._connection_stats(client),
+            }
+        return stats
+
+    def _connection_stats(self, client) -> Dict[str, int]:
+        # httpx does not expose its pool, so this looks at the httpcore pool underneath
+        try:
+            connections = list(client._client._transport._pool.connections)
+        except AttributeError:
+            return {}
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            'connections': len(connections),
+            'idle_connections': idle,
+            'active_connections': len(connections) - idle,
+        }
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _api_key(self) -> str:
+        return os.environ.get(
+            "OPENAI_API_KEY",
+            "<your OpenAI API key is not set as env var>"
+        )
+
+
+class PoolCounters:
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def on_request(self, request) -> None:
+        with self._lock:
+            self.requests += 1
+
+    async def aon_request(self, request) -> None:
+        self.on_request(request)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {'requests': self.requests}
@@ -42,6 +42,7 @@ CORS_ALLOW_HEADERS     = ['*']
 CORS_ALLOW_METHODS     = ['*']
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_PRIVATE_NETWORK = True
+CORS_EXPOSE_HEADERS    = ['thread_id', 'actor']
 CSRF_TRUSTED_ORIGINS = [
     "http://127.0.0.1:3000", 
     "http://127.0.0.1", 
@@ -67,6 +68,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'genscene.middleware.TimingMiddleware',
     ## "django.middleware.csrf.CsrfViewMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -99,20 +101,33 @@ WSGI_APPLICATION = "conf.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
-# TODO: change the hard coded database settings to use the environment variables
+# The state database keeps the threads, messages and assistants. The default sqlite
+# file (WAL, see conf/sqlite) is fine for one worker, several workers should share a
+# postgres (django.db.backends.postgresql) or mysql (django.db.backends.mysql) database
+STATE_DB_ENGINE = os.environ.get("STATE_DB_ENGINE", "conf.sqlite")
+if "sqlite" in STATE_DB_ENGINE:
+    # seconds a write waits for the lock held by another request
+    STATE_DB_OPTIONS = {"timeout": int(os.environ.get("STATE_DB_TIMEOUT", 20))}
+elif "mysql" in STATE_DB_ENGINE:
+    STATE_DB_OPTIONS = {"charset": "utf8mb4", "isolation_level": "read committed"}
+else:
+    STATE_DB_OPTIONS = {}
+
 DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": ".statedb",
+    'default': {
+        "ENGINE": STATE_DB_ENGINE,
+        "NAME": os.environ.get("STATE_DB_NAME", ".statedb"),
+        "USER": os.environ.get("STATE_DB_USER", ""),
+        "PASSWORD": os.environ.get("STATE_DB_PASSWORD", ""),
+        "HOST": os.environ.get("STATE_DB_HOST", ""),
+        "PORT": os.environ.get("STATE_DB_PORT", ""),
+        # seconds a connection is kept for the next request, 0 (the default) closes it
+        # after each request. Only raise it for WSGI workers, under ASGI kept connections
+        # are never closed and pile up
+        "CONN_MAX_AGE": int(os.environ.get("STATE_DB_CONN_MAX_AGE", 0)),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": STATE_DB_OPTIONS,
     },
-    # 'default': {
-    #     "ENGINE": os.environ.get("STATE_DB_ENGINE", "Engine for the STATE db"),
-    #     "NAME": os.environ.get("STATE_DB_NAME", "Name for the STATE db"),
-    #     "USER": os.environ.get("STATE_DB_USER", "User for the STATE db"),
-    #     "PASSWORD": os.environ.get("STATE_DB_PASSWORD", "Password for the STATE db"),
-    #     "HOST": os.environ.get("STATE_DB_HOST", "Host for the STATE db"),
-    #     "PORT": os.environ.get("STATE_DB_PORT", "Port for the STATE db"),
-    # },
     # 'database_db': {
     #     "ENGINE": os.environ.get("DATABASE_DB_ENGINE", "Engine for the Database Example db"),
     #     "NAME": os.environ.get("DATABASE_DB_NAME", "Name for the Database Example db"),
@@ -155,6 +170,49 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Image cache for code interpreter images, set a size to 0 to disable that tier
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", BASE_DIR / ".imagecache")
+IMAGE_CACHE_MEMORY_BYTES = int(os.environ.get("IMAGE_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+IMAGE_CACHE_DISK_BYTES = int(os.environ.get("IMAGE_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+
+# Seconds a worker trusts its cached assistant ids before checking the state database
+# for an invalidation (manage.py sync_actors --invalidate) made by another worker
+ASSISTANT_REGISTRY_CHECK = int(os.environ.get("ASSISTANT_REGISTRY_CHECK", 30))
+
+# Seconds a worker waits for another worker syncing the same actor (mysql and postgres)
+ACTOR_LOCK_TIMEOUT = int(os.environ.get("ACTOR_LOCK_TIMEOUT", 60))
+
+# Max number of threads whose messages are fetched from openai at the same time
+THREAD_HYDRATION_WORKERS = int(os.environ.get("THREAD_HYDRATION_WORKERS", 4))
+
+# Max number of parallel openai calls when an actor syncs its resource files
+FILE_SYNC_WORKERS = int(os.environ.get("FILE_SYNC_WORKERS", 4))
+
+# Tool calls requested together by a run are executed in parallel, each with a timeout in seconds
+TOOL_CALL_WORKERS = int(os.environ.get("TOOL_CALL_WORKERS", 4))
+TOOL_CALL_TIMEOUT = int(os.environ.get("TOOL_CALL_TIMEOUT", 60))
+
+# Seconds the local copy of a thread's messages is trusted before checking openai for new ones
+MESSAGE_STORE_TTL = int(os.environ.get("MESSAGE_STORE_TTL", 300))
+
+# Where runs publish their streamed answers: memory:// keeps them in this process,
+# a redis:// url shares them so any worker can resume a stream (needs the redis package)
+STREAM_BROKER_URL = os.environ.get("STREAM_BROKER_URL", "memory://")
+# Seconds a finished stream can still be resumed
+STREAM_RETENTION = int(os.environ.get("STREAM_RETENTION", 300))
+# Events kept per run for replay, older ones are dropped
+STREAM_MAX_EVENTS = int(os.environ.get("STREAM_MAX_EVENTS", 2000))
+# Bytes an in-memory stream may hold and what to do past that: block (wait for
+# slow subscribers, then coalesce), coalesce (merge old text deltas) or drop
+STREAM_MAX_BYTES = int(os.environ.get("STREAM_MAX_BYTES", 1024 * 1024))
+STREAM_OVERFLOW_POLICY = os.environ.get("STREAM_OVERFLOW_POLICY", "coalesce")
+STREAM_BLOCK_TIMEOUT = int(os.environ.get("STREAM_BLOCK_TIMEOUT", 5))
+# A run nobody has listened to for this many seconds is cancelled in openai
+STREAM_CANCEL_GRACE = int(os.environ.get("STREAM_CANCEL_GRACE", 30))
+# Seconds of silence before a keep-alive is written to a stream, also bounds how
+# long a disconnected client goes unnoticed
+STREAM_HEARTBEAT = int(os.environ.get("STREAM_HEARTBEAT", 15))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -0,0 +1,22 @@
+from django.db.backends.sqlite3 import base
+
+
+#
+# SQLite Database Wrapper
+#
+# The sqlite backend tuned for the state database. WAL lets readers go on
+# while a request writes, and transactions take the write lock when they
+# begin (BEGIN IMMEDIATE) so concurrent select_for_update blocks wait for the
+# busy timeout instead of failing with "database is locked" when a read turns
+# into a write
+#
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
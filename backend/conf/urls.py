@@ -16,11 +16,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from genscene.views import MetricsView
 
 
 urlpatterns = [
     path("admin/", admin.site.urls),
-    path("api/", include("genscene.urls", namespace="genscene"))
+    path("api/", include("genscene.urls", namespace="genscene")),
+    path("metrics", MetricsView.as_view(), name='metrics'),
 ]
 
 
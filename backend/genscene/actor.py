@@ -1,8 +1,10 @@
 import time
 import io
 from abc import ABC, abstractmethod
-from django.db import transaction
-from typing import Dict, List, Any
+from django.conf import settings
+from django.db import connections, transaction
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Any, Tuple
 from typing_extensions import override
 import base64
 import json
@@ -11,14 +13,24 @@ import json
 from openai.types.beta.threads.runs.run_step import RunStep
 from .user_thread import UserThread
 from .return_message import ReturnItem
-from openai import OpenAI, AssistantEventHandler
-from queue import Queue
+from .assistant_registry import ASSISTANT_REGISTRY
+from .actor_lock import ACTOR_LOCKS
+from openai import OpenAI, AsyncOpenAI, AssistantEventHandler, NotFoundError
+from asgiref.sync import sync_to_async
+from .streaming import FlushPolicy, stream_events, astream_events
+from .stream_broker import get_stream_broker, StreamPublisher, AsyncStreamPublisher
+from .run_monitor import RunMonitor
+from .metrics import span, RunTimer
+import asyncio
 import logging
 import threading
 import hashlib
 
 LOGGER = logging.getLogger(__name__)
 
+# runs streaming on the event loop, they outlive the request that started them
+RUN_TASKS = set()
+
 
 #
 # Abstract Actor
@@ -30,13 +42,14 @@ LOGGER = logging.getLogger(__name__)
 class Actor(ABC):
 
     openai_client: OpenAI
+    async_openai_client: AsyncOpenAI
     openai_model: str
-    asst_lock = threading.Lock()
-    file_lock = threading.Lock()
 
-    def __init__(self, openai_client, openai_model ) -> None:
+    def __init__(self, openai_client, openai_model, async_openai_client=None) -> None:
         self.openai_client = openai_client
         self.openai_model  = openai_model
+        self.async_openai_client = async_openai_client
+        self.file_hashes: Dict[str, Tuple[bytes, str]] = {}
 
     @abstractmethod
     def get_name(self) -> str:
@@ -71,106 +84,161 @@ class Actor(ABC):
         hex_digest = hash_object.hexdigest()
         return str(int(hex_digest, 16))
 
+    # hashes of the resource files are kept per file name so unchanged
+    # content is compared instead of hashed again on every sync
+    def hash_file (self, name: str, value: bytes) -> str:
+        memo = self.file_hashes.get(name)
+        if memo is not None and (memo[0] is value or memo[0] == value):
+            return memo[1]
+        hash = self.hash_value(value=value)
+        self.file_hashes[name] = (value, hash)
+        return hash
+
+    def _upload_file (self, name: str, value: bytes) -> str:
+        assistant_file = self.openai_client.files.create(
+            file=(name, value,),
+            purpose="assistants",
+            timeout=settings.OPENAI_CONFIG.timeout('file'),
+        )
+        LOGGER.debug(f"Actor[{self.get_name()}] uploaded file {name}: {assistant_file.id}")
+        return assistant_file.id
+
+    # a file that is already gone in openai counts as deleted
+    def _delete_file (self, file_id: str) -> None:
+        try:
+            self.openai_client.files.delete(file_id, timeout=settings.OPENAI_CONFIG.timeout('file'))
+        except NotFoundError:
+            LOGGER.info(f"Actor[{self.get_name()}] file {file_id} was already deleted")
+
     # TODO: support non code files later
     def get_tools_resources(self) -> Dict[str, Any]:
         from .models import File
-        self.file_lock.acquire()
-        try:
-            
-            code_files: Dict[str: io.BytesIO] = self.get_code_resource_files()
-
-            new_file_hashes  = {name: self.hash_value(value=file_bytes.getvalue()) 
-                                for name, file_bytes in code_files.items()}
-
-            curr_files = {file.name: file 
-                          for file in File.objects.filter(actor_name=self.get_name())}
-
-            # this will add or update the file in the database
-            file_ids = []
-            for name, hash in new_file_hashes.items():
-                if name not in curr_files or curr_files[name].hash != hash:
+        with ACTOR_LOCKS.write(self.get_name()):
+            try:
+                code_files: Dict[str: io.BytesIO] = self.get_code_resource_files()
+                code_file_values = {name: file_bytes.getvalue() for name, file_bytes in code_files.items()}
+
+                new_file_hashes  = {name: self.hash_file(name=name, value=value) 
+                                    for name, value in code_file_values.items()}
+                self.file_hashes = {name: memo for name, memo in self.file_hashes.items() 
+                                    if name in new_file_hashes}
+
+                curr_files = {file.name: file 
+                              for file in File.objects.filter(actor_name=self.get_name())}
+
+                # new or changed files are uploaded, replaced or removed files deleted
+                upload_names = [name for name, hash in new_file_hashes.items()
+                                if name not in curr_files or curr_files[name].hash != hash]
+                delete_files = [file for name, file in curr_files.items()
+                                if name not in new_file_hashes or name in upload_names]
+
+                # the openai calls run in parallel, the database is only touched from this thread
+                file_ids = {name: curr_files[name].file_id for name in new_file_hashes if name not in upload_names}
+                errors = []
+                if len(upload_names) + len(delete_files) > 0:
+                    with ThreadPoolExecutor(max_workers=settings.FILE_SYNC_WORKERS) as executor:
+                        uploads = {name: executor.submit(self._upload_file, name, code_file_values[name]) 
+                                   for name in upload_names}
+                        deletes = {file.name: executor.submit(self._delete_file, file.file_id) 
+                                   for file in delete_files}
+
+                    # every call that went through is recorded, even when others failed,
+                    # so the next sync neither deletes a file twice nor loses an upload
+                    for name, future in uploads.items():
+                        try:
+                            file_ids[name] = future.result()
+                        except Exception as e:
+                            errors.append(e)
+                    for file in delete_files:
+                        try:
+                            deletes[file.name].result()
+                        except Exception as e:
+                            errors.append(e)
+                            if file.name in file_ids:
+                                LOGGER.error(f"Actor[{self.get_name()}] replaced file {file.name} but could not delete {file.file_id}: {e}")
+                            continue
+                        # a replaced file whose upload failed loses its row, it is uploaded again next time
+                        if file.name not in file_ids:
+                            file.delete()
+
+                # replaced files keep their row (one per actor and name), only removed ones are deleted
+                for name in upload_names:
+                    if name in file_ids:
+                        File.objects.update_or_create(
+                            actor_name=self.get_name(),
+                            name=name,
+                            defaults={
+                                'file_id': file_ids[name],
+                                'hash': new_file_hashes[name],
+                            },
+                        )
+                if len(errors) > 0:
+                    raise errors[0]
+                LOGGER.info(f"Actor[{self.get_name()}] uploaded {len(upload_names)} and deleted {len(delete_files)} files")
+
+                file_ids = sorted(file_ids.values())
+                return {
+                    "code_interpreter": {
+                        "file_ids": file_ids
+                    }
+                }
+        
+            except Exception as e:
+                raise Exception(e)
 
-                    # delete old file id 
-                    if name in curr_files:
-                        self.openai_client.files.delete(curr_files[name].file_id)
-                        curr_files[name].delete()
 
-                    # create new file id
-                    assistant_file = self.openai_client.files.create(
-                        file=(name, code_files[name].getvalue(),),
-                        purpose="assistants",
+    # get the assistant id from the registry, only syncing the first time
+    # or after the registry entry for this actor was invalidated
+    def get_assistant_id(self):
+        assistant_id = ASSISTANT_REGISTRY.lookup(self.get_name())
+        if assistant_id is not None:
+            return assistant_id
+        with span('sync', actor=self.get_name()):
+            return self._sync_assistant_id()
+
+    def invalidate(self):
+        ASSISTANT_REGISTRY.invalidate(self.get_name())
+
+    # try to get the assistant id from the django default database,
+    # the actor's write lock makes sure only one thread/process syncs it
+    def _sync_assistant_id(self):
+        from .models import Assistant
+        with ACTOR_LOCKS.write(self.get_name()):
+            try:
+                # another request may have synced while we waited for the lock
+                assistant_id = ASSISTANT_REGISTRY.lookup(self.get_name())
+                if assistant_id is not None:
+                    return assistant_id
+
+                instructions = self.get_instructions()
+                description = self.get_description()
+                tools = self.get_tools()
+                tools_resources = self.get_tools_resources()
+                hash = self.hash_value(value=f"{instructions}{description}{tools}{tools_resources}")
+                LOGGER.debug(f"Actor[{self.get_name()}] hash: {hash}") 
+                LOGGER.debug(f"Actor[{self.get_name()}] tools resources: {tools_resources}")
+
+                # the row is only written once the assistant exists in openai
+                db_assistant = Assistant.objects.filter(actor_name=self.get_name()).first()
+                if db_assistant is None or db_assistant.assistant_id is None:
+                    openai_assistant = self.openai_client.beta.assistants.create(
+                        name=f"{self.get_name().title()} Assistant",
+                        instructions=instructions,
+                        tools=tools,
+                        tool_resources=tools_resources,
+                        model=self.openai_model,
                     )
-
-                    # create or update the file in the database
-                    db_file, created = File.objects.get_or_create(
+                    db_assistant, created = Assistant.objects.update_or_create(
                         actor_name=self.get_name(),
-                        name=name,
                         defaults={
-                            'file_id': assistant_file.id,
-                            'hash': hash
+                            'assistant_id': openai_assistant.id,
+                            'instructions': instructions,
+                            'description': description,
+                            'hash': hash,
                         }
                     )
-
-                    file_ids.append(db_file.file_id)
-
-                else:
-                    file_ids.append(curr_files[name].file_id)
-
-            # need to delete any files that are not in the new list
-            for name, file in curr_files.items():
-                if name not in new_file_hashes:
-                    self.openai_client.files.delete(file.file_id)
-                    file.delete()
-
-            file_ids.sort()
-            return {
-                "code_interpreter": {
-                    "file_ids": file_ids
-                }
-            }
-        
-        except Exception as e:
-            raise Exception(e)
-        finally:
-            self.file_lock.release()
-
-
-    # try to get the assistant id from the django default database
-    def get_assistant_id(self):
-        from .models import Assistant
-        self.asst_lock.acquire()
-        try:
-
-            instructions = self.get_instructions()
-            description = self.get_description()
-            tools = self.get_tools()
-            tools_resources = self.get_tools_resources()
-            hash = self.hash_value(value=f"{instructions}{description}{tools}{tools_resources}")
-            LOGGER.debug(f"Actor[{self.get_name()}] hash: {hash}") 
-            LOGGER.debug(f"Actor[{self.get_name()}] tools resources: {tools_resources}")
-
-            db_assistant, created = Assistant.objects.get_or_create(
-                actor_name=self.get_name(),
-                defaults={
-                    'instructions': self.get_instructions(),
-                    'description': self.get_description(),
-                    'hash': hash,
-                    'assistant_id': None,
-                }
-            )
-            if created:
-                openai_assistant = self.openai_client.beta.assistants.create(
-                    name=f"{self.get_name().title()} Assistant",
-                    instructions=instructions,
-                    tools=tools,
-                    tool_resources=tools_resources,
-                    model=self.openai_model,
-                )
-                db_assistant.assistant_id = openai_assistant.id
-                db_assistant.save()
-                LOGGER.info(f"Actor[{self.get_name()}] created new assistant in openai: {db_assistant.assistant_id}")
-            else:
-                if db_assistant.hash != hash:
+                    LOGGER.info(f"Actor[{self.get_name()}] created new assistant in openai: {db_assistant.assistant_id}")
+                elif db_assistant.hash != hash:
                     self.openai_client.beta.assistants.update(
                         assistant_id=db_assistant.assistant_id,
                         name=f"{self.get_name().title()} Assistant",
@@ -179,63 +247,71 @@ class Actor(ABC):
                         tool_resources=tools_resources,
                         model=self.openai_model,
                     ) 
+                    db_assistant.instructions = instructions
+                    db_assistant.description = description
                     db_assistant.hash = hash
                     db_assistant.save()                       
                     LOGGER.info(f"Actor[{self.get_name()}] updated assistant in openai: {db_assistant.assistant_id}")
                 else:
                     LOGGER.debug(f"Actor[{self.get_name()}] using existing assistant: {db_assistant.assistant_id}")
-            return db_assistant.assistant_id
-        except Exception as e:
-            raise Exception(e)
-        finally:
-            self.asst_lock.release()
-
-    def sync (self):
+                ASSISTANT_REGISTRY.register(self.get_name(), db_assistant.assistant_id, db_assistant.version)
+                return db_assistant.assistant_id
+            except Exception as e:
+                raise Exception(e)
+
+    def sync (self, force=False):
+        if force:
+            self.invalidate()
         assistant_id = self.get_assistant_id()
         return self
 
+    # the write lock is reentrant so getting (or syncing) the assistant id
+    # while holding it is safe
     def delete (self):
-        self.asst_lock.acquire()
-        try:
-            from .models import Assistant
-            assistant_id = self.get_assistant_id()
-            existing_asst = Assistant.objects.select_for_update().filter(
-                assistant_id=assistant_id, 
-            )
-            if existing_asst.exists():
-                self.openai_client.beta.assistants.delete(assistant_id)
-                existing_asst.delete()
-
-                # delete all files associated with this actor
-                from .models import File
-                files = File.objects.filter(actor_name=self.get_name())
-                for file in files:
-                    self.openai_client.files.delete(file.file_id)
-                    file.delete()
-
-                return True
-            else:
-                raise Exception(f"Assistant: could not delete assistant")    
-        except Exception as e:
-            raise Exception(e)
-        finally:
-            self.asst_lock.release()    
+        from .models import Assistant, File
+        with ACTOR_LOCKS.write(self.get_name()):
+            try:
+                assistant_id = self.get_assistant_id()
+                existing_asst = Assistant.objects.filter(
+                    assistant_id=assistant_id, 
+                )
+                if existing_asst.exists():
+                    self.openai_client.beta.assistants.delete(assistant_id)
+                    existing_asst.delete()
+                    self.invalidate()
+
+                    # delete all files associated with this actor
+                    files = File.objects.filter(actor_name=self.get_name())
+                    for file in files:
+                        self.openai_client.files.delete(file.file_id)
+                        file.delete()
+                    self.file_hashes = {}
+
+                    return True
+                else:
+                    raise Exception(f"Assistant: could not delete assistant")    
+            except Exception as e:
+                raise Exception(e)
 
 
-    def _create_message (self, input, user_thread):
+    def _thread_name (self, input):
         thread_name = input
         if (len(thread_name) > 20):
             thread_name = f"{thread_name[:20]} ..."
+        return thread_name
 
-        user_thread.set_name(thread_name)
-        thread_id = user_thread.get_thread_id()
-
-        msg = self.openai_client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=input,
-        )
-        return msg
+    def _create_message (self, input, user_thread):
+        with span('message_create', actor=self.get_name()):
+            user_thread.set_name(self._thread_name(input))
+            thread_id = user_thread.get_thread_id()
+
+            msg = self.openai_client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=input,
+            )
+            UserThread.store_message(msg)
+            return msg
 
     # Get the responses using the assistant for the given user
     # def get_responses (self, input, user_thread):
@@ -244,38 +320,151 @@ class Actor(ABC):
     #     return self.wait_for_response(message=msg, user_thread=user_thread)
 
 
-    def stream_responses (self, input, user_thread, instructions="", buffer_size:int = 1):
-        LOGGER.info(f"Actor[{self.get_name()}] streaming responses for input: {input} with buffer size: {buffer_size}")
-        message_queue = Queue()
+    # Start the run and return a subscriber to its stream. The run itself is
+    # consumed by a background thread publishing to the stream broker, so it
+    # keeps going when the client goes away and can be resumed by thread id
+    def stream_responses (self, input, user_thread, instructions="", buffer_size:int = None, flush_policy: FlushPolicy = None):
+        if flush_policy is None:
+            flush_policy = FlushPolicy() if buffer_size is None else FlushPolicy(max_tokens=buffer_size)
+        LOGGER.info(f"Actor[{self.get_name()}] streaming responses for input: {input} with flush policy: {flush_policy}")
+        self.start_run(input=input, user_thread=user_thread, instructions=instructions)
+        return stream_events(get_stream_broker(), user_thread.get_thread_id(), offset=0, flush_policy=flush_policy)
+
+    def start_run (self, input, user_thread, instructions=""):
         msg = self._create_message(input=input, user_thread=user_thread)
+        assistant_id = self.get_assistant_id()
+        get_stream_broker().start(msg.thread_id)
+        stream_thread: threading.Thread = threading.Thread(
+            target=self._run_stream,
+            args=(msg.thread_id, assistant_id, instructions, RunTimer(self.get_name())),
+            daemon=True,
+        )
+        stream_thread.start()
+        return msg
+
+    # the run is cancelled when nobody has been subscribed to its stream for
+    # STREAM_CANCEL_GRACE seconds
+    def _run_stream (self, thread_id, assistant_id, instructions, timer):
         from .actor_event_handler import ActorEventHandler
+        broker = get_stream_broker()
+        publisher = StreamPublisher(broker, thread_id)
         handler = ActorEventHandler(
             openai_client=self.openai_client,
-            thread_id=user_thread.get_thread_id(), 
-            message_queue=message_queue,
-            actor=self
+            thread_id=thread_id,
+            message_queue=publisher,
+            actor=self,
+            timer=timer,
         )
-        with self.openai_client.beta.threads.runs.stream(
-            thread_id=msg.thread_id,
-            assistant_id=self.get_assistant_id(),
-            instructions=instructions, # get additional instructions from the actor here
-            event_handler=handler,
-        ) as openai_stream:
-            stream_thread: threading.Thread = threading.Thread(target=openai_stream.until_done)
-            stream_thread.start()
-            streaming = True
-            while streaming:
-                try:
-                    message = message_queue.get()
-                    if message is not None:
-                        yield message
-                    else: 
-                        streaming = False       
-                except EOFError:
-                    streaming = False 
-            message_queue.task_done()   
-            stream_thread.join()
-        LOGGER.info(f"Actor[{self.get_name()}] streaming complete") 
+        monitor = RunMonitor(broker, thread_id, settings.STREAM_CANCEL_GRACE,
+                             cancel=lambda: self._cancel_run(thread_id, handler))
+        monitor.start()
+        status = 'completed'
+        try:
+            with self.openai_client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                instructions=instructions, # get additional instructions from the actor here
+                event_handler=handler,
+                timeout=settings.OPENAI_CONFIG.timeout('stream'),
+            ) as openai_stream:
+                openai_stream.until_done()
+            LOGGER.info(f"Actor[{self.get_name()}] streaming complete")
+        except Exception as e:
+            if monitor.abandoned:
+                LOGGER.info(f"Actor[{self.get_name()}] abandoned run for thread {thread_id} ended: {e}")
+            else:
+                status = 'failed'
+                LOGGER.error(f"Actor[{self.get_name()}] streaming failed for thread {thread_id}: {e}")
+        finally:
+            monitor.stop()
+            timer.end('abandoned' if monitor.abandoned else status)
+            # subscribers always see the end of the stream, even when the run failed
+            publisher.put(None)
+            connections.close_all()
+
+    def _cancel_run (self, thread_id, handler):
+        run = handler.current_run
+        if run is None:
+            LOGGER.info(f"Actor[{self.get_name()}] no run to cancel for thread {thread_id}")
+            return
+        self.openai_client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+        LOGGER.info(f"Actor[{self.get_name()}] cancelled run {run.id} for thread {thread_id}")
+
+    async def _acreate_message (self, input, user_thread):
+        with span('message_create', actor=self.get_name()):
+            await sync_to_async(user_thread.set_name)(self._thread_name(input))
+            msg = await self.async_openai_client.beta.threads.messages.create(
+                thread_id=user_thread.get_thread_id(),
+                role="user",
+                content=input,
+            )
+            await sync_to_async(UserThread.store_message)(msg)
+            return msg
+
+    # Async version of stream_responses for ASGI deployments. The openai stream
+    # is consumed by a task on the event loop instead of a dedicated thread
+    async def astream_responses (self, input, user_thread, instructions="", buffer_size:int = None, flush_policy: FlushPolicy = None):
+        if self.async_openai_client is None:
+            raise ValueError(f"Actor[{self.get_name()}] has no async openai client")
+        if flush_policy is None:
+            flush_policy = FlushPolicy() if buffer_size is None else FlushPolicy(max_tokens=buffer_size)
+        LOGGER.info(f"Actor[{self.get_name()}] async streaming responses for input: {input} with flush policy: {flush_policy}")
+        await self.astart_run(input=input, user_thread=user_thread, instructions=instructions)
+        return astream_events(get_stream_broker(), user_thread.get_thread_id(), offset=0, flush_policy=flush_policy)
+
+    async def astart_run (self, input, user_thread, instructions=""):
+        msg = await self._acreate_message(input=input, user_thread=user_thread)
+        assistant_id = await sync_to_async(self.get_assistant_id)()
+        await get_stream_broker().astart(msg.thread_id)
+        # keep a reference so the task is not garbage collected while running
+        stream_task = asyncio.create_task(self._arun_stream(msg.thread_id, assistant_id, instructions, RunTimer(self.get_name())))
+        RUN_TASKS.add(stream_task)
+        stream_task.add_done_callback(RUN_TASKS.discard)
+        return msg
+
+    async def _arun_stream (self, thread_id, assistant_id, instructions, timer):
+        from .actor_event_handler import AsyncActorEventHandler
+        broker = get_stream_broker()
+        publisher = AsyncStreamPublisher(broker, thread_id)
+        handler = AsyncActorEventHandler(
+            openai_client=self.async_openai_client,
+            thread_id=thread_id,
+            message_queue=publisher,
+            actor=self,
+            timer=timer,
+        )
+        monitor = RunMonitor(broker, thread_id, settings.STREAM_CANCEL_GRACE,
+                             cancel=lambda: self._acancel_run(thread_id, handler))
+        monitor_task = asyncio.create_task(monitor.awatch())
+        status = 'completed'
+        try:
+            async with self.async_openai_client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                instructions=instructions,
+                event_handler=handler,
+                timeout=settings.OPENAI_CONFIG.timeout('stream'),
+            ) as openai_stream:
+                await openai_stream.until_done()
+            LOGGER.info(f"Actor[{self.get_name()}] async streaming complete")
+        except Exception as e:
+            if monitor.abandoned:
+                LOGGER.info(f"Actor[{self.get_name()}] abandoned run for thread {thread_id} ended: {e}")
+            else:
+                status = 'failed'
+                LOGGER.error(f"Actor[{self.get_name()}] async streaming failed for thread {thread_id}: {e}")
+        finally:
+            monitor_task.cancel()
+            timer.end('abandoned' if monitor.abandoned else status)
+            await publisher.put(None)
+
+    async def _acancel_run (self, thread_id, handler):
+        run = handler.current_run
+        if run is None:
+            LOGGER.info(f"Actor[{self.get_name()}] no run to cancel for thread {thread_id}")
+            return
+        await self.async_openai_client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+        LOGGER.info(f"Actor[{self.get_name()}] cancelled run {run.id} for thread {thread_id}")
 
     def call_function(self, function_name: str, arguments: Dict[str, Any]) -> str:
         if hasattr(self, function_name):
@@ -284,6 +473,54 @@ class Actor(ABC):
         else:
             raise ValueError(f"Unknown method in actor: {function_name}")
 
+    # Run all the tool calls a run is waiting on at the same time. A call that
+    # fails or takes longer than TOOL_CALL_TIMEOUT seconds returns an error
+    # to the assistant instead of failing the whole run
+    def call_functions(self, tool_calls) -> List[Dict[str, str]]:
+        executor = ThreadPoolExecutor(max_workers=max(1, min(len(tool_calls), settings.TOOL_CALL_WORKERS)))
+        try:
+            futures = [executor.submit(self._call_tool, tool_call) for tool_call in tool_calls]
+            wait(futures, timeout=settings.TOOL_CALL_TIMEOUT)
+            return [self._tool_output(tool_call, future) for tool_call, future in zip(tool_calls, futures)]
+        finally:
+            # do not wait for calls that timed out
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def acall_functions(self, tool_calls) -> List[Dict[str, str]]:
+        semaphore = asyncio.Semaphore(settings.TOOL_CALL_WORKERS)
+
+        async def call (tool_call):
+            async with semaphore:
+                try:
+                    output = await asyncio.wait_for(
+                        sync_to_async(self._call_tool, thread_sensitive=False)(tool_call),
+                        timeout=settings.TOOL_CALL_TIMEOUT,
+                    )
+                    return {"tool_call_id": tool_call.id, "output": output}
+                except asyncio.TimeoutError:
+                    return self._tool_error(tool_call, f"timed out after {settings.TOOL_CALL_TIMEOUT} seconds")
+                except Exception as e:
+                    return self._tool_error(tool_call, str(e))
+
+        return list(await asyncio.gather(*[call(tool_call) for tool_call in tool_calls]))
+
+    def _call_tool(self, tool_call) -> str:
+        LOGGER.info(f"Actor[{self.get_name()}] calling function {tool_call.function.name} for {tool_call.id}")
+        with span('tool_call', actor=self.get_name(), tool=tool_call.function.name):
+            return self.call_function(tool_call.function.name, json.loads(tool_call.function.arguments))
+
+    def _tool_output(self, tool_call, future) -> Dict[str, str]:
+        if not future.done():
+            return self._tool_error(tool_call, f"timed out after {settings.TOOL_CALL_TIMEOUT} seconds")
+        try:
+            return {"tool_call_id": tool_call.id, "output": future.result()}
+        except Exception as e:
+            return self._tool_error(tool_call, str(e))
+
+    def _tool_error(self, tool_call, error: str) -> Dict[str, str]:
+        LOGGER.error(f"Actor[{self.get_name()}] function {tool_call.function.name} failed for {tool_call.id}: {error}")
+        return {"tool_call_id": tool_call.id, "output": json.dumps({"error": error})}
+
         
 
 
@@ -1,19 +1,24 @@
 import time
 import io
 from abc import ABC, abstractmethod
+from django.conf import settings
 from django.db import transaction
 from typing import Dict, List, Any
 from typing_extensions import override
 import base64
 import json
 
-from openai.types.beta.threads import ImageFile, Text
+from openai.types.beta.threads import ImageFile, Text, Message
 from openai.types.beta.threads.runs.run_step import RunStep
+from openai.types.beta import AssistantStreamEvent
 from .user_thread import UserThread
 from .return_message import ReturnItem
 from .actor import Actor
-from openai import OpenAI, AssistantEventHandler
-from queue import Queue
+from openai import OpenAI, AsyncOpenAI, AssistantEventHandler, AsyncAssistantEventHandler
+from asgiref.sync import sync_to_async
+from .stream_broker import StreamPublisher, AsyncStreamPublisher
+from .metrics import RunTimer
+import asyncio
 import logging
 import threading
 
@@ -22,14 +27,16 @@ LOGGER = logging.getLogger(__name__)
 class ActorEventHandler(AssistantEventHandler):    
 
     openai_client: OpenAI
-    message_queue: Queue
+    message_queue: StreamPublisher
     thread_id: str
 
-    def __init__(self, openai_client: OpenAI, thread_id: str, message_queue: Queue, actor: Actor) -> None:
+    def __init__(self, openai_client: OpenAI, thread_id: str, message_queue: StreamPublisher, actor: Actor, timer: RunTimer = None) -> None:
         self.openai_client = openai_client
         self.thread_id = thread_id
         self.message_queue = message_queue
         self.actor = actor
+        self.timer = timer
+        self.submitted_tool_calls = set()
         super().__init__()      
 
     @override
@@ -44,64 +51,156 @@ class ActorEventHandler(AssistantEventHandler):
 
     @override
     def on_text_delta(self, delta, snapshot):
-        self.message_queue.put(delta.value)
+        if self.timer is not None:
+            self.timer.delta()
+        self.message_queue.put(ReturnItem.from_text('text', 'assistant', delta.value))
 
     @override
     def on_text_done(self, text: Text) -> None:
-        self.message_queue.put('\n')
+        self.message_queue.put(ReturnItem.from_text('text', 'assistant', '\n'))
 
+    # keep the local message store in step with the thread
+    @override
+    def on_message_done(self, message: Message) -> None:
+        try:
+            UserThread.store_message(message, actor=self.actor.get_name())
+        except Exception as e:
+            LOGGER.error(f"Could not store message {message.id}: {e}")
+
+    # the image endpoint only serves images of stored messages, so the message
+    # is stored before the browser gets the image url
     @override
     def on_image_file_done(self, image_file: ImageFile) -> None:
         LOGGER.info(f"on_image_file_done: {image_file.file_id}")
+        if self.current_message_snapshot is not None:
+            self.on_message_done(self.current_message_snapshot)
         item = ReturnItem.from_image_file(type='image_file', 
                                           role="assistant", 
                                           openai_client=self.openai_client, 
                                           file_id=image_file.file_id)
-        # terminate with a pipe character
-        self.message_queue.put(item.value+'|')
+        self.message_queue.put(item)
     
     @override
     def on_run_step_created(self, run_step: RunStep) -> None:
        self.run_id = run_step.run_id
        self.run_step = run_step
 
-    # @override
-    # def on_tool_call_created(self, tool_call):
-    #     pass
+    # the requires_action event carries the run with all the pending tool
+    # calls, so there is no need to poll the run after each tool call
+    @override
+    def on_event(self, event: AssistantStreamEvent) -> None:
+        if event.event == "thread.run.created" and self.timer is not None:
+            self.timer.created()
+        if event.event == "thread.run.requires_action":
+            self._submit_tool_outputs(event.data)
+
+    # answer every tool call the run is waiting on with a single submission
+    def _submit_tool_outputs(self, run) -> None:
+        tool_calls = [tool_call for tool_call in run.required_action.submit_tool_outputs.tool_calls
+                      if tool_call.id not in self.submitted_tool_calls]
+        if len(tool_calls) == 0:
+            return
+        self.submitted_tool_calls.update(tool_call.id for tool_call in tool_calls)
+        for tool_call in tool_calls:
+            self.message_queue.put(ReturnItem.from_text('tool', 'assistant', tool_call.function.name))
+
+        tool_outputs = self.actor.call_functions(tool_calls)
+        with self.openai_client.beta.threads.runs.submit_tool_outputs_stream(
+            thread_id=self.thread_id,
+            run_id=run.id,
+            tool_outputs=tool_outputs,
+            event_handler=ActorEventHandler(
+                openai_client=self.openai_client,
+                thread_id=self.thread_id,
+                message_queue=self.message_queue,
+                actor=self.actor,
+                timer=self.timer,
+            ),
+            timeout=settings.OPENAI_CONFIG.timeout('stream'),
+        ) as stream:
+            stream.until_done() 
+
+
+class AsyncActorEventHandler(AsyncAssistantEventHandler):
+
+    openai_client: AsyncOpenAI
+    message_queue: AsyncStreamPublisher
+    thread_id: str
+
+    def __init__(self, openai_client: AsyncOpenAI, thread_id: str, message_queue: AsyncStreamPublisher, actor: Actor, timer: RunTimer = None) -> None:
+        self.openai_client = openai_client
+        self.thread_id = thread_id
+        self.message_queue = message_queue
+        self.actor = actor
+        self.timer = timer
+        self.submitted_tool_calls = set()
+        super().__init__()
+
+    @override
+    async def on_end(self) -> None:
+        await self.message_queue.put(None)
+
+    @override
+    async def on_text_delta(self, delta, snapshot):
+        if self.timer is not None:
+            self.timer.delta()
+        await self.message_queue.put(ReturnItem.from_text('text', 'assistant', delta.value))
 
     @override
-    def on_tool_call_done(self, tool_call) -> None:
-
-        current_run = self.openai_client.beta.threads.runs.retrieve(
-           thread_id=self.thread_id,
-           run_id=self.run_id
-        )
-
-        if (current_run.status == "requires_action"):
-          if (tool_call.type == "function"):
-              tool_id = tool_call.id
-              func_name = tool_call.function.name
-              arguments = json.loads(tool_call.function.arguments)
-              # LOGGER.info(f"Calling function > {tool_id} {func_name} {arguments}")
-              output_json = self.actor.call_function(func_name, arguments)
-              with self.openai_client.beta.threads.runs.submit_tool_outputs_stream(
-                   thread_id=self.thread_id,
-                   run_id=self.run_id,
-                   tool_outputs=[{
-                       "tool_call_id": tool_id,
-                       "output": output_json,
-                   }],
-                   event_handler=ActorEventHandler(
-                        openai_client=self.openai_client,
-                        thread_id=self.thread_id,
-                        message_queue=self.message_queue,
-                        actor=self.actor
-                   )
-               ) as stream:
-                 stream.until_done() 
-          else:
-              LOGGER.error(f"Unhandled tool call type: {tool_call.type}")
-        else:
-            LOGGER.debug(f"Run status is not requires_action: {current_run.status}")
+    async def on_text_done(self, text: Text) -> None:
+        await self.message_queue.put(ReturnItem.from_text('text', 'assistant', '\n'))
 
+    @override
+    async def on_message_done(self, message: Message) -> None:
+        try:
+            await sync_to_async(UserThread.store_message)(message, actor=self.actor.get_name())
+        except Exception as e:
+            LOGGER.error(f"Could not store message {message.id}: {e}")
 
+    @override
+    async def on_image_file_done(self, image_file: ImageFile) -> None:
+        LOGGER.info(f"on_image_file_done: {image_file.file_id}")
+        if self.current_message_snapshot is not None:
+            await self.on_message_done(self.current_message_snapshot)
+        item = ReturnItem.from_image_file(type='image_file',
+                                          role="assistant",
+                                          openai_client=self.openai_client,
+                                          file_id=image_file.file_id)
+        await self.message_queue.put(item)
+
+    @override
+    async def on_run_step_created(self, run_step: RunStep) -> None:
+        self.run_id = run_step.run_id
+        self.run_step = run_step
+
+    @override
+    async def on_event(self, event: AssistantStreamEvent) -> None:
+        if event.event == "thread.run.created" and self.timer is not None:
+            self.timer.created()
+        if event.event == "thread.run.requires_action":
+            await self._submit_tool_outputs(event.data)
+
+    async def _submit_tool_outputs(self, run) -> None:
+        tool_calls = [tool_call for tool_call in run.required_action.submit_tool_outputs.tool_calls
+                      if tool_call.id not in self.submitted_tool_calls]
+        if len(tool_calls) == 0:
+            return
+        self.submitted_tool_calls.update(tool_call.id for tool_call in tool_calls)
+        for tool_call in tool_calls:
+            await self.message_queue.put(ReturnItem.from_text('tool', 'assistant', tool_call.function.name))
+
+        tool_outputs = await self.actor.acall_functions(tool_calls)
+        async with self.openai_client.beta.threads.runs.submit_tool_outputs_stream(
+            thread_id=self.thread_id,
+            run_id=run.id,
+            tool_outputs=tool_outputs,
+            event_handler=AsyncActorEventHandler(
+                openai_client=self.openai_client,
+                thread_id=self.thread_id,
+                message_queue=self.message_queue,
+                actor=self.actor,
+                timer=self.timer,
+            ),
+            timeout=settings.OPENAI_CONFIG.timeout('stream'),
+        ) as stream:
+            await stream.until_done()
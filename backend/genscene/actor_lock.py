@@ -0,0 +1,98 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+from typing import Dict
+import hashlib
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+#
+# Actor Lock Manager
+#
+# Serializes the write path of one actor (syncing its assistant and files)
+# without blocking other actors. Reads go through the assistant registry
+# and never take these locks. Inside a process each actor has a reentrant
+# lock, across processes an advisory lock of the state database is held
+# (GET_LOCK on mysql, pg_advisory_lock on postgres, none on sqlite). No
+# transaction is kept open, so the rows written while syncing are committed
+# right away and the openai calls never hold database locks
+#
+class ActorLockManager:
+
+    def __init__(self, timeout: float = 60) -> None:
+        self.timeout = timeout
+        self._locks: Dict[str, threading.RLock] = {}
+        self._guard = threading.Lock()
+        # actor name -> how many times this thread entered write
+        self._local = threading.local()
+
+    def get_lock(self, actor_name: str) -> threading.RLock:
+        lock = self._locks.get(actor_name)
+        if lock is None:
+            with self._guard:
+                lock = self._locks.setdefault(actor_name, threading.RLock())
+        return lock
+
+    @contextmanager
+    def write(self, actor_name: str):
+        with self.get_lock(actor_name):
+            depths = getattr(self._local, 'depths', None)
+            if depths is None:
+                depths = self._local.depths = {}
+            # only the outermost write of a thread takes the database lock
+            if depths.get(actor_name, 0) == 0:
+                self._acquire(actor_name)
+            depths[actor_name] = depths.get(actor_name, 0) + 1
+            try:
+                yield
+            finally:
+                depths[actor_name] -= 1
+                if depths[actor_name] == 0:
+                    self._release(actor_name)
+
+    # the lock belongs to the database session, not to a transaction
+    def _acquire(self, actor_name: str) -> None:
+        if connection.vendor == 'mysql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, %s)", [self._lock_name(actor_name), self.timeout])
+                acquired = cursor.fetchone()[0] == 1
+        elif connection.vendor == 'postgresql':
+            deadline = time.monotonic() + self.timeout
+            with connection.cursor() as cursor:
+                while True:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s)", [self._lock_key(actor_name)])
+                    acquired = cursor.fetchone()[0]
+                    if acquired or time.monotonic() >= deadline:
+                        break
+                    time.sleep(0.1)
+        else:
+            return
+        if not acquired:
+            raise TimeoutError(f"ActorLockManager: could not lock actor[{actor_name}] within {self.timeout} seconds")
+        LOGGER.debug(f"ActorLockManager: locked actor[{actor_name}]")
+
+    def _release(self, actor_name: str) -> None:
+        if connection.vendor == 'mysql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", [self._lock_name(actor_name)])
+        elif connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [self._lock_key(actor_name)])
+        else:
+            return
+        LOGGER.debug(f"ActorLockManager: unlocked actor[{actor_name}]")
+
+    # mysql lock names are at most 64 characters
+    def _lock_name(self, actor_name: str) -> str:
+        return f"genscene.actor.{hashlib.sha256(actor_name.encode()).hexdigest()[:40]}"
+
+    # postgres advisory locks take a signed 64 bit key
+    def _lock_key(self, actor_name: str) -> int:
+        return int.from_bytes(hashlib.sha256(f"genscene.actor.{actor_name}".encode()).digest()[:8], 'big', signed=True)
+
+
+ACTOR_LOCKS = ActorLockManager(timeout=settings.ACTOR_LOCK_TIMEOUT)
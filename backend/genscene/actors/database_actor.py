@@ -6,10 +6,12 @@ import io
 from typing import Dict, Any, List
 import re
 from ..actor import Actor
+from ..query_cache import QueryCache
+from ..metrics import METRICS, Labels
 import json
 import logging
 import yaml
-from sqlalchemy import create_engine, text, MetaData, Table
+from sqlalchemy import create_engine, event, text, MetaData, Table
 
 LOGGER = logging.getLogger(__name__)
 
@@ -23,7 +25,40 @@ class DatabaseActor(Actor):
         db_host = os.getenv('DB_HOST', 'localhost')
         db_port = os.getenv('DB_PORT', '3306')
         db_name = os.getenv('DB_NAME', 'database_name')
-        self.engine = create_engine(f'mysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}')
+        self.engine = create_engine(
+            f'mysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}',
+            pool_size=int(os.getenv('DB_POOL_SIZE', '5')),
+            max_overflow=int(os.getenv('DB_POOL_MAX_OVERFLOW', '10')),
+            pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', '30')),
+            pool_recycle=int(os.getenv('DB_POOL_RECYCLE', '3600')),
+            pool_pre_ping=True,
+        )
+
+        # schema file cache: table name -> (fingerprint, table schema)
+        self.table_schemas: Dict[str, Any] = {}
+        self.schema_fingerprint = None
+        self.schema_json = None
+
+        # limits on what a single tool call can return to the assistant
+        self.query_max_rows = int(os.getenv('DB_QUERY_MAX_ROWS', '1000'))
+        self.query_max_bytes = int(os.getenv('DB_QUERY_MAX_BYTES', '100000'))
+        self.query_timeout_ms = int(os.getenv('DB_QUERY_TIMEOUT_MS', '30000'))
+
+        # opt in cache of select results, keyed on the normalized sql
+        self.query_cache = None
+        if os.getenv('DB_QUERY_CACHE', 'false').lower() == 'true':
+            self.query_cache = QueryCache(
+                ttl=int(os.getenv('DB_QUERY_CACHE_TTL', '300')),
+                max_entries=int(os.getenv('DB_QUERY_CACHE_SIZE', '256')),
+            )
+            METRICS.add_collector(self.query_cache_gauges)
+
+        # mysql aborts any select running longer than max_execution_time (ms)
+        @event.listens_for(self.engine, "connect")
+        def set_statement_timeout(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET SESSION max_execution_time = {self.query_timeout_ms}")
+            cursor.close()
 
         # Test the connection
         try:
@@ -50,6 +85,7 @@ run against the database. You will need to follow these steps:
 1. Read the question and determine the sql query that needs to be run using the schema information in the assistant file
 2. Execute the sql query and retrieve the result set using the function 'execute_sql_query' and passing in the sql query.
 3. Display the result set to the user after translating it into a human readable format.
+   If the result set is marked as truncated, tell the user that only part of it is shown.
 
 '''
     
@@ -58,42 +94,75 @@ run against the database. You will need to follow these steps:
     def get_description(self):
         return "An example tool to interact with your database using natural language"
 
+    # cheap per table fingerprints from information_schema, a table is only
+    # reflected again when its fingerprint changes. Views are left out like
+    # they are by MetaData.reflect
+    TABLE_FINGERPRINT_SQL = """
+        SELECT t.TABLE_NAME, COUNT(c.COLUMN_NAME), t.CREATE_TIME, t.UPDATE_TIME
+        FROM information_schema.TABLES t
+        LEFT JOIN information_schema.COLUMNS c
+          ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME
+        WHERE t.TABLE_SCHEMA = DATABASE() AND t.TABLE_TYPE = 'BASE TABLE'
+        GROUP BY t.TABLE_NAME, t.CREATE_TIME, t.UPDATE_TIME
+    """
+
+    def get_table_fingerprints(self) -> Dict[str, str]:
+        with self.engine.connect() as connection:
+            result = connection.execute(text(self.TABLE_FINGERPRINT_SQL))
+            return {row[0]: f"{row[0]}:{row[1]}:{row[2]}:{row[3]}" for row in result}
+
+    def get_column_type(self, column) -> str:
+        column_type = str(column.type)
+        if any(key in column_type for key in ['VARCHAR', 'ENUM', 'TEXT']):
+            column_type = 'string'
+        elif any(key in column_type for key in ['INT', 'FLOAT', 'DECIMAL']):
+            column_type = 'number'
+        elif any(key in column_type for key in ['DATETIME', 'DATE', 'TIMESTAMP']):
+            column_type = 'datetime'
+        return column_type
+
     def get_code_resource_files(self) -> Dict[str, io.BytesIO]:
         try:
-            metadata = MetaData()
-            metadata.reflect(bind=self.engine)
-            for table_name, table in metadata.tables.items():
+            fingerprints = self.get_table_fingerprints()
+            schema_fingerprint = self.hash_value(json.dumps(fingerprints, sort_keys=True))
+            if schema_fingerprint != self.schema_fingerprint:
+
+                # only reflect the tables that are new or changed
+                changed_tables = [table_name for table_name, fingerprint in fingerprints.items()
+                                  if self.table_schemas.get(table_name, (None,))[0] != fingerprint]
+                if len(changed_tables) > 0:
+                    metadata = MetaData()
+                    metadata.reflect(bind=self.engine, only=changed_tables)
+                    for table_name, table in metadata.tables.items():
+                        columns = [{'name': column.name, 'type': self.get_column_type(column)} 
+                                   for column in table.columns]
+                        self.table_schemas[table_name] = (fingerprints[table_name], {'columns': columns})
+                LOGGER.info(f"DatabaseActor: reflected {len(changed_tables)} of {len(fingerprints)} tables")
+                removed_tables = [table_name for table_name in self.table_schemas if table_name not in fingerprints]
+                self.invalidate_query_cache(changed_tables + removed_tables)
+
+                self.table_schemas = {table_name: table_schema for table_name, table_schema in self.table_schemas.items()
+                                      if table_name in fingerprints}
                 schema = {
-                    'tables': {
-                        table_name: {
-                            'columns': []
-                        }
-                    }
+                    'tables': {table_name: self.table_schemas[table_name][1] 
+                               for table_name in sorted(self.table_schemas.keys())}
                 }
-                for column in table.columns:
-                    column_type = str(column.type)
-                    if any(key in column_type for key in ['VARCHAR', 'ENUM', 'TEXT']):
-                        column_type = 'string'
-                    elif any(key in column_type for key in ['INT', 'FLOAT', 'DECIMAL']):
-                        column_type = 'number'
-                    elif any(key in column_type for key in ['DATETIME', 'DATE', 'TIMESTAMP']):
-                        column_type = 'datetime'
-                    col_info = {
-                        'name': column.name,
-                        'type': column_type,
-                    }
-                    schema['tables'][table_name]['columns'].append(col_info)
-
-            LOGGER.debug(f"DatabaseActor: generated schema: {schema}")
-            table_json = json.dumps(schema, default=str)
-            bytes_buffer = io.BytesIO(table_json.encode('utf-8'))
+                LOGGER.debug(f"DatabaseActor: generated schema: {schema}")
+                self.schema_json = json.dumps(schema, default=str).encode('utf-8')
+                self.schema_fingerprint = schema_fingerprint
+
+            bytes_buffer = io.BytesIO(self.schema_json)
             bytes_buffer.seek(0)
             return {'database schema': bytes_buffer}  
 
+        # keep the last schema when the database cannot be read, an empty
+        # result would delete the schema file from the assistant
         except Exception as e:
-            LOGGER.error(f"DatabaseActor: error executing sql query: {sql_query}")
+            LOGGER.error(f"DatabaseActor: error generating the database schema: {e}")
             traceback.print_exc()
-            return '{}'
+            if self.schema_json is None:
+                return {}
+            return {'database schema': io.BytesIO(self.schema_json)}
     
     # overriden
     def get_tools(self) -> List[Any]:
@@ -103,7 +172,7 @@ run against the database. You will need to follow these steps:
                 "type": "function",
                 "function": {
                     "name": "execute_sql_query",
-                    "description": "Retrieve the result set from a sql query run against a database.",
+                    "description": "Retrieve the result set from a sql query run against a database. Large result sets are cut off and marked as truncated.",
                     "parameters": {
                         "type": "object",
                         "properties": {"sql_query": {"type": "string", "description": "the sql query to execute"}},
@@ -113,13 +182,50 @@ run against the database. You will need to follow these steps:
             },
         ]
 
+    # Rows are streamed from a server side cursor and collected until the row
+    # or byte budget is used up, so the tool output stays bounded however
+    # big the table is. The result says if (and why) it was truncated
     def execute_sql_query(self, sql_query):
         LOGGER.info(f"DatabaseActor: executing sql query: {sql_query}")
+        normalized_sql = QueryCache.normalize(sql_query)
+        cacheable = self.query_cache is not None and QueryCache.is_cacheable(normalized_sql)
+        if cacheable:
+            cached_json = self.query_cache.get(normalized_sql)
+            if cached_json is not None:
+                LOGGER.info(f"DatabaseActor: query cache hit {self.query_cache.stats()}")
+                return cached_json
         try:
             with self.engine.connect() as connection:
-                result = connection.execute(text(sql_query))
-                result_dict = [dict(row._mapping) for row in result]
-                result_json = json.dumps(result_dict, default=str)
+                result = connection.execution_options(stream_results=True).execute(text(sql_query))
+                rows_json = []
+                size = 0
+                truncated_reason = None
+                if result.returns_rows:
+                    for row in result:
+                        if len(rows_json) >= self.query_max_rows:
+                            truncated_reason = 'max_rows'
+                            break
+                        row_json = json.dumps(dict(row._mapping), default=str)
+                        if size + len(row_json) > self.query_max_bytes:
+                            truncated_reason = 'max_bytes'
+                            break
+                        rows_json.append(row_json)
+                        size += len(row_json) + 1
+
+                if truncated_reason is not None:
+                    # closing a server side cursor reads the rest of the rows,
+                    # drop the connection instead so the pool opens a fresh one
+                    LOGGER.info(f"DatabaseActor: truncated result at {len(rows_json)} rows ({truncated_reason})")
+                    connection.invalidate()
+
+                result_json = (f'{{"rows": [{",".join(rows_json)}], "row_count": {len(rows_json)}, '
+                               f'"truncated": {json.dumps(truncated_reason is not None)}, '
+                               f'"truncated_reason": {json.dumps(truncated_reason)}}}')
+                if cacheable:
+                    self.query_cache.put(normalized_sql, result_json)
+                elif not QueryCache.is_cacheable(normalized_sql):
+                    # anything other than a select may have changed the tables it names
+                    self.invalidate_query_cache(list(QueryCache.get_tables(normalized_sql)) or None)
                 return result_json
             
         except Exception as e:
@@ -127,6 +233,13 @@ run against the database. You will need to follow these steps:
             traceback.print_exc()
             return '{}'
 
+    # query cache hits, misses, evictions and size for the /metrics endpoint
+    def query_cache_gauges(self) -> Dict[str, Dict[Labels, float]]:
+        labels = (('actor', self.get_name()),)
+        return {f"genscene_query_cache_{name}": {labels: value}
+                for name, value in self.query_cache.stats().items()}
 
-
-
+    # hook for anything that changes the data behind cached queries
+    def invalidate_query_cache(self, tables: List[str] | None = None):
+        if self.query_cache is not None and (tables is None or len(tables) > 0):
+            self.query_cache.invalidate(tables)
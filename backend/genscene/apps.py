@@ -4,6 +4,7 @@ from .actors.home_actor import HomeActor
 from .actors.database_actor import DatabaseActor
 # from .database_actor import DatabaseActor
 from .actor import Actor
+from .assistant_registry import ASSISTANT_REGISTRY
 from typing import List
 import logging
 import os
@@ -21,6 +22,7 @@ class GensceneConfig(AppConfig):
 
         openai_config = settings.OPENAI_CONFIG
         self.client = openai_config.client()
+        self.async_client = openai_config.async_client()
         self.deployment = openai_config.deployment()
         LOGGER.info(f"Created the openai client: {self.client} and deployment: {self.deployment}")
 
@@ -36,7 +38,7 @@ class GensceneConfig(AppConfig):
 
         self.actors = {}
         for actor_class in actor_classes:
-            actor = actor_class(self.client, self.deployment)
+            actor = actor_class(self.client, self.deployment, async_openai_client=self.async_client)
             self.actors[actor.get_name()] = actor
             LOGGER.info(f"Created actor: {actor.get_name()}")
 
@@ -44,6 +46,9 @@ class GensceneConfig(AppConfig):
 
     def get_client (self):
         return self.client
+
+    def get_async_client (self):
+        return self.async_client
     
     def get_deployment (self):
         return self.deployment
@@ -51,9 +56,17 @@ class GensceneConfig(AppConfig):
     def get_actors (self) -> List[Actor]:
         return [self.get_actor(actor_name) for actor_name in self.actors.keys()]
 
+    # the assistant is only synced the first time an actor is used
+    # or after it has been invalidated, otherwise this is a dict lookup
+    # (checked against the state database every ASSISTANT_REGISTRY_CHECK seconds)
     def get_actor (self, actor_name) -> Actor:
         return self.actors[actor_name].sync()
 
+    # call after an actor's instructions, tools or resources (e.g. a database
+    # schema) changed, every worker syncs it again on its next use
+    def invalidate_actors (self, actor_name=None):
+        ASSISTANT_REGISTRY.invalidate(actor_name)
+
 
 
 
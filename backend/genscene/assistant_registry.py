@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.db.models import F
+from typing import Dict, NamedTuple
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RegistryEntry(NamedTuple):
+    assistant_id: str
+    version: int
+    checked_at: float
+
+
+#
+# Assistant Registry
+#
+# Keeps the assistant id for each actor once it has been synced with the
+# state database and openai, together with the version of the actor's
+# Assistant row it was synced at. Within check_interval seconds a lookup is a
+# dict read, after that the row is read again and a changed version (bumped
+# by invalidate in any worker) or assistant id means the actor is synced again.
+#
+class AssistantRegistry:
+
+    def __init__(self, check_interval: float = 30) -> None:
+        self.check_interval = check_interval
+        self._entries: Dict[str, RegistryEntry] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, actor_name: str) -> str | None:
+        entry = self._entries.get(actor_name)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.checked_at < self.check_interval:
+            return entry.assistant_id
+        return self._check(actor_name, entry)
+
+    def register(self, actor_name: str, assistant_id: str, version: int) -> None:
+        with self._lock:
+            self._entries[actor_name] = RegistryEntry(assistant_id, version, time.monotonic())
+            LOGGER.debug(f"AssistantRegistry: registered actor[{actor_name}] at version {version}")
+
+    # drop one actor (or all of them when no name is given) so the next lookup
+    # syncs again, in this worker right away and in the others at their next check
+    def invalidate(self, actor_name: str | None = None) -> None:
+        from .models import Assistant
+        with self._lock:
+            if actor_name is None:
+                self._entries = {}
+            else:
+                self._entries.pop(actor_name, None)
+        assistants = Assistant.objects.all()
+        if actor_name is not None:
+            assistants = assistants.filter(actor_name=actor_name)
+        assistants.update(version=F('version') + 1)
+        LOGGER.info(f"AssistantRegistry: invalidated actor[{actor_name or '*'}]")
+
+    def _check(self, actor_name: str, entry: RegistryEntry) -> str | None:
+        from .models import Assistant
+        current = Assistant.objects.filter(actor_name=actor_name).values_list('assistant_id', 'version').first()
+        with self._lock:
+            if current != (entry.assistant_id, entry.version):
+                LOGGER.info(f"AssistantRegistry: actor[{actor_name}] changed in the state database")
+                if self._entries.get(actor_name) is entry:
+                    self._entries.pop(actor_name)
+                return None
+            self._entries[actor_name] = entry._replace(checked_at=time.monotonic())
+            return entry.assistant_id
+
+
+ASSISTANT_REGISTRY = AssistantRegistry(check_interval=settings.ASSISTANT_REGISTRY_CHECK)
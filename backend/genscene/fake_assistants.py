@@ -0,0 +1,422 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List
+from urllib.parse import urlparse, parse_qs
+import base64
+import itertools
+import json
+import logging
+import re
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# 1x1 png returned for every file download
+FAKE_IMAGE = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+
+#
+# Fake Run Profile
+#
+# What a run of the fake assistants server answers with: a number of text
+# deltas at a token rate after a first token delay, optionally preceded by
+# tool calls (the run then requires action until the outputs are submitted)
+# and images
+#
+class FakeRunProfile(BaseModel):
+
+    tokens: int = Field(default=50, ge=1)
+    tokens_per_second: float = Field(default=50, ge=0)
+    first_token_ms: int = Field(default=200, ge=0)
+    tool_calls: int = Field(default=0, ge=0)
+    # the database actor's function, the home actor has none
+    tool_name: str = "execute_sql_query"
+    tool_arguments: str = '{"sql_query": "select 1"}'
+    images: int = Field(default=0, ge=0)
+
+    def token_delay(self) -> float:
+        if self.tokens_per_second == 0:
+            return 0.0
+        return 1 / self.tokens_per_second
+
+
+#
+# Fake Assistants
+#
+# In memory stand-in for the parts of the OpenAI Assistants API the actors
+# use: assistants, files, threads, messages and streamed runs (including
+# tool outputs and cancel). Point a server at it with OPENAI_BASE_URL
+#
+class FakeAssistants:
+
+    def __init__(self, profile: FakeRunProfile) -> None:
+        self.profile = profile
+        self.messages: Dict[str, List[Dict[str, Any]]] = {}
+        self.runs: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def new_id(self, prefix: str) -> str:
+        return f"{prefix}_fake{next(self._ids)}"
+
+    def create_thread(self) -> Dict[str, Any]:
+        thread_id = self.new_id('thread')
+        with self._lock:
+            self.messages[thread_id] = []
+        return {'id': thread_id, 'object': 'thread', 'created_at': int(time.time()),
+                'metadata': {}, 'tool_resources': None}
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self.messages.pop(thread_id, None)
+
+    def add_message(self, thread_id: str, role: str, content: List[Dict[str, Any]]) -> Dict[str, Any]:
+        message = {
+            'id': self.new_id('msg'),
+            'object': 'thread.message',
+            'created_at': int(time.time()),
+            'thread_id': thread_id,
+            'role': role,
+            'content': content,
+            'assistant_id': None,
+            'run_id': None,
+            'attachments': [],
+            'metadata': {},
+            'status': 'completed',
+            'incomplete_details': None,
+            'completed_at': int(time.time()),
+            'incomplete_at': None,
+        }
+        with self._lock:
+            self.messages.setdefault(thread_id, []).append(message)
+        return message
+
+    def list_messages(self, thread_id: str, order: str = 'desc', after: str = None, limit: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            messages = list(self.messages.get(thread_id, []))
+        if order == 'desc':
+            messages.reverse()
+        if after is not None:
+            ids = [message['id'] for message in messages]
+            messages = messages[ids.index(after) + 1:] if after in ids else []
+        page = messages[:limit]
+        return {
+            'object': 'list',
+            'data': page,
+            'first_id': page[0]['id'] if len(page) > 0 else None,
+            'last_id': page[-1]['id'] if len(page) > 0 else None,
+            'has_more': len(messages) > limit,
+        }
+
+    def create_run(self, thread_id: str, assistant_id: str) -> Dict[str, Any]:
+        run = {
+            'id': self.new_id('run'),
+            'object': 'thread.run',
+            'created_at': int(time.time()),
+            'thread_id': thread_id,
+            'assistant_id': assistant_id,
+            'status': 'queued',
+            'required_action': None,
+            'last_error': None,
+            'expires_at': None,
+            'started_at': None,
+            'cancelled_at': None,
+            'failed_at': None,
+            'completed_at': None,
+            'incomplete_details': None,
+            'model': 'fake',
+            'instructions': '',
+            'tools': [],
+            'metadata': {},
+            'usage': None,
+            'temperature': None,
+            'top_p': None,
+            'max_prompt_tokens': None,
+            'max_completion_tokens': None,
+            'truncation_strategy': {'type': 'auto', 'last_messages': None},
+            'tool_choice': 'auto',
+            'response_format': 'auto',
+        }
+        with self._lock:
+            self.runs[run['id']] = run
+        return run
+
+    def cancel_run(self, run_id: str) -> Dict[str, Any]:
+        with self._lock:
+            run = self.runs[run_id]
+            run['status'] = 'cancelled'
+            run['cancelled_at'] = int(time.time())
+            return dict(run)
+
+    def cancelled(self, run: Dict[str, Any]) -> bool:
+        with self._lock:
+            return run['status'] == 'cancelled'
+
+    # events of a run, tool calls come first and end the stream with requires_action
+    def run_events(self, run: Dict[str, Any], tool_outputs: bool = False):
+        if not tool_outputs:
+            yield 'thread.run.created', run
+        run['status'] = 'in_progress'
+        run['required_action'] = None
+        run['started_at'] = run['started_at'] or int(time.time())
+        yield 'thread.run.in_progress', run
+
+        if not tool_outputs and self.profile.tool_calls > 0:
+            tool_calls = [{'id': self.new_id('call'), 'type': 'function',
+                           'function': {'name': self.profile.tool_name, 'arguments': self.profile.tool_arguments}}
+                          for _ in range(self.profile.tool_calls)]
+            yield 'thread.run.step.created', self._step(run, 'tool_calls', {'tool_calls': [
+                {**tool_call, 'function': {**tool_call['function'], 'output': None}} for tool_call in tool_calls
+            ]})
+            run['status'] = 'requires_action'
+            run['required_action'] = {'type': 'submit_tool_outputs',
+                                      'submit_tool_outputs': {'tool_calls': tool_calls}}
+            yield 'thread.run.requires_action', run
+            return
+
+        message = {
+            'id': self.new_id('msg'),
+            'object': 'thread.message',
+            'created_at': int(time.time()),
+            'thread_id': run['thread_id'],
+            'role': 'assistant',
+            'content': [],
+            'assistant_id': run['assistant_id'],
+            'run_id': run['id'],
+            'attachments': [],
+            'metadata': {},
+            'status': 'in_progress',
+            'incomplete_details': None,
+            'completed_at': None,
+            'incomplete_at': None,
+        }
+        step = self._step(run, 'message_creation', {'message_creation': {'message_id': message['id']}})
+        yield 'thread.run.step.created', step
+        yield 'thread.message.created', message
+
+        time.sleep(self.profile.first_token_ms / 1000)
+        content = []
+        for index in range(self.profile.images):
+            image = {'file_id': self.new_id('file')}
+            content.append({'type': 'image_file', 'image_file': image})
+            yield 'thread.message.delta', self._delta(message, index, {'type': 'image_file', 'image_file': image})
+
+        text = []
+        for token in range(self.profile.tokens):
+            if self.cancelled(run):
+                yield 'thread.run.cancelled', run
+                return
+            if token > 0:
+                time.sleep(self.profile.token_delay())
+            value = f"token{token} "
+            text.append(value)
+            yield 'thread.message.delta', self._delta(message, len(content), {'type': 'text', 'text': {'value': value}})
+
+        content.append({'type': 'text', 'text': {'value': ''.join(text), 'annotations': []}})
+        message.update(content=content, status='completed', completed_at=int(time.time()))
+        with self._lock:
+            self.messages.setdefault(run['thread_id'], []).append(message)
+        yield 'thread.message.completed', message
+        step['status'] = 'completed'
+        yield 'thread.run.step.completed', step
+        run['status'] = 'completed'
+        run['completed_at'] = int(time.time())
+        yield 'thread.run.completed', run
+
+    def _step(self, run: Dict[str, Any], type: str, details: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'id': self.new_id('step'),
+            'object': 'thread.run.step',
+            'created_at': int(time.time()),
+            'run_id': run['id'],
+            'assistant_id': run['assistant_id'],
+            'thread_id': run['thread_id'],
+            'type': type,
+            'status': 'in_progress',
+            'step_details': {'type': type, **details},
+            'cancelled_at': None,
+            'completed_at': None,
+            'expired_at': None,
+            'failed_at': None,
+            'last_error': None,
+            'metadata': None,
+            'usage': None,
+        }
+
+    def _delta(self, message: Dict[str, Any], index: int, content: Dict[str, Any]) -> Dict[str, Any]:
+        return {'id': message['id'], 'object': 'thread.message.delta',
+                'delta': {'content': [{'index': index, **content}]}}
+
+
+class FakeAssistantsHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    ROUTES = [
+        ('POST', r'/v1/assistants', 'create_assistant'),
+        ('POST', r'/v1/assistants/(?P<id>[^/]+)', 'update_assistant'),
+        ('DELETE', r'/v1/assistants/(?P<id>[^/]+)', 'delete_object'),
+        ('POST', r'/v1/files', 'create_file'),
+        ('DELETE', r'/v1/files/(?P<id>[^/]+)', 'delete_object'),
+        ('GET', r'/v1/files/(?P<id>[^/]+)/content', 'file_content'),
+        ('POST', r'/v1/threads', 'create_thread'),
+        ('DELETE', r'/v1/threads/(?P<id>[^/]+)', 'delete_thread'),
+        ('POST', r'/v1/threads/(?P<thread_id>[^/]+)/messages', 'create_message'),
+        ('GET', r'/v1/threads/(?P<thread_id>[^/]+)/messages', 'list_messages'),
+        ('POST', r'/v1/threads/(?P<thread_id>[^/]+)/runs', 'create_run'),
+        ('POST', r'/v1/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)/submit_tool_outputs', 'submit_tool_outputs'),
+        ('POST', r'/v1/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)/cancel', 'cancel_run'),
+    ]
+
+    @property
+    def fake(self) -> FakeAssistants:
+        return self.server.fake
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        LOGGER.debug(f"FakeAssistants: {format % args}")
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else b''
+        for route_method, pattern, name in self.ROUTES:
+            match = re.fullmatch(pattern, url.path)
+            if route_method == method and match is not None:
+                data = {}
+                if self.headers.get('Content-Type', '').startswith('application/json') and len(body) > 0:
+                    data = json.loads(body)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                try:
+                    getattr(self, name)(data=data, query=query, **match.groupdict())
+                except (BrokenPipeError, ConnectionResetError):
+                    LOGGER.debug(f"FakeAssistants: client went away during {method} {url.path}")
+                return
+        self._json({'error': {'message': f"no fake for {method} {url.path}", 'type': 'invalid_request_error'}}, status=404)
+
+    def create_assistant(self, data, query, id=None):
+        self._json({
+            'id': id or self.fake.new_id('asst'),
+            'object': 'assistant',
+            'created_at': int(time.time()),
+            'name': data.get('name'),
+            'description': data.get('description'),
+            'model': data.get('model', 'fake'),
+            'instructions': data.get('instructions'),
+            'tools': data.get('tools', []),
+            'tool_resources': data.get('tool_resources'),
+            'metadata': {},
+        })
+
+    def update_assistant(self, data, query, id):
+        self.create_assistant(data, query, id=id)
+
+    def delete_object(self, data, query, id):
+        self._json({'id': id, 'object': 'deleted', 'deleted': True})
+
+    def create_file(self, data, query):
+        self._json({'id': self.fake.new_id('file'), 'object': 'file', 'bytes': 0,
+                    'created_at': int(time.time()), 'filename': 'file',
+                    'purpose': 'assistants', 'status': 'processed'})
+
+    def file_content(self, data, query, id):
+        self._send(200, 'image/png', FAKE_IMAGE)
+
+    def create_thread(self, data, query):
+        self._json(self.fake.create_thread())
+
+    def delete_thread(self, data, query, id):
+        self.fake.delete_thread(id)
+        self._json({'id': id, 'object': 'thread.deleted', 'deleted': True})
+
+    def create_message(self, data, query, thread_id):
+        content = [{'type': 'text', 'text': {'value': data.get('content', ''), 'annotations': []}}]
+        self._json(self.fake.add_message(thread_id, data.get('role', 'user'), content))
+
+    def list_messages(self, data, query, thread_id):
+        self._json(self.fake.list_messages(thread_id, order=query.get('order', 'desc'),
+                                           after=query.get('after'), limit=int(query.get('limit', 20))))
+
+    def create_run(self, data, query, thread_id):
+        run = self.fake.create_run(thread_id, data.get('assistant_id'))
+        self._stream(self.fake.run_events(run))
+
+    def submit_tool_outputs(self, data, query, thread_id, run_id):
+        self._stream(self.fake.run_events(self.fake.runs[run_id], tool_outputs=True))
+
+    def cancel_run(self, data, query, thread_id, run_id):
+        self._json(self.fake.cancel_run(run_id))
+
+    def _json(self, data: Dict[str, Any], status: int = 200):
+        self._send(status, 'application/json', json.dumps(data).encode())
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # server sent events in chunked encoding so the connection can be kept alive
+    def _stream(self, events):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event, data in events:
+            self._chunk(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+        self._chunk(b"event: done\ndata: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+#
+# Fake Assistants Server
+#
+# Serves FakeAssistants from a background thread, port 0 picks a free port.
+# The base url to use as OPENAI_BASE_URL is in url once started
+#
+class FakeAssistantsServer:
+
+    def __init__(self, profile: FakeRunProfile = None, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.fake = FakeAssistants(profile or FakeRunProfile())
+        self.httpd = ThreadingHTTPServer((host, port), FakeAssistantsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self.fake
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> 'FakeAssistantsServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        LOGGER.info(f"FakeAssistants: serving on {self.url} with {self.fake.profile}")
+        return self
+
+    def serve_forever(self) -> None:
+        LOGGER.info(f"FakeAssistants: serving on {self.url} with {self.fake.profile}")
+        self.httpd.serve_forever()
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
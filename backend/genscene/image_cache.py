@@ -0,0 +1,173 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict
+import logging
+import os
+import re
+import tempfile
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+
+#
+# Image Cache
+#
+# Images generated by the code interpreter never change once they have an
+# openai file id, so the bytes are cached by file id. A small LRU is kept in
+# memory and a larger LRU on disk so restarts do not download them again.
+# Either bound can be set to 0 to turn that tier off
+#
+class ImageCache:
+
+    def __init__(self, cache_dir: str | Path | None, memory_bytes: int, disk_bytes: int) -> None:
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.cache_dir = Path(cache_dir) if (cache_dir and disk_bytes > 0) else None
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_size = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_size = 0
+        self._fetches: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        if self.cache_dir is not None:
+            self._load_disk_index()
+
+    def get(self, file_id: str) -> bytes | None:
+        key = self._key(file_id)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        data = self._read_disk(key)
+        if data is not None:
+            with self._lock:
+                self._put_memory(key, data)
+        return data
+
+    def put(self, file_id: str, data: bytes) -> None:
+        key = self._key(file_id)
+        with self._lock:
+            self._put_memory(key, data)
+        self._write_disk(key, data)
+
+    # concurrent misses for the same file id share one fetch, the first caller
+    # downloads and the others wait for its result (or its error)
+    def get_or_fetch(self, file_id: str, fetch: Callable[[], bytes]) -> bytes:
+        data = self.get(file_id)
+        if data is not None:
+            return data
+        key = self._key(file_id)
+        with self._lock:
+            future = self._fetches.get(key)
+            waiting = future is not None
+            if not waiting:
+                future = self._fetches[key] = Future()
+        if waiting:
+            return future.result()
+
+        try:
+            # another fetch may have finished between the get and taking the lock
+            data = self.get(file_id)
+            if data is None:
+                LOGGER.debug(f"ImageCache: miss for {file_id}")
+                data = fetch()
+                self.put(file_id, data)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._fetches.pop(key, None)
+
+    # file ids are used as file names so only keep safe characters
+    def _key(self, file_id: str) -> str:
+        return re.sub(r'[^A-Za-z0-9_-]', '_', file_id)
+
+    # must be called with the lock held
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _load_disk_index(self) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entries = [path for path in self.cache_dir.iterdir() if path.is_file() and not path.name.startswith('.')]
+        entries.sort(key=lambda path: path.stat().st_mtime)
+        for path in entries:
+            size = path.stat().st_size
+            self._disk[path.name] = size
+            self._disk_size += size
+        LOGGER.info(f"ImageCache: loaded {len(self._disk)} images ({self._disk_size} bytes) from {self.cache_dir}")
+
+    def _read_disk(self, key: str) -> bytes | None:
+        if self.cache_dir is None:
+            return None
+        with self._lock:
+            if key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+        path = self.cache_dir / key
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            with self._lock:
+                self._disk_size -= self._disk.pop(key, 0)
+            return None
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        if self.cache_dir is None or len(data) > self.disk_bytes:
+            return
+        try:
+            # write to a temp file first so readers never see a partial image
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, prefix='.')
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_name, self.cache_dir / key)
+        except OSError as e:
+            LOGGER.error(f"ImageCache: could not write {key} to disk: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            self._disk_size -= self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._disk_size += len(data)
+            while self._disk_size > self.disk_bytes:
+                name, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(name)
+        for name in evicted:
+            try:
+                (self.cache_dir / name).unlink()
+            except FileNotFoundError:
+                pass
+
+
+_image_cache: ImageCache | None = None
+_image_cache_lock = threading.Lock()
+
+def get_image_cache() -> ImageCache:
+    global _image_cache
+    if _image_cache is None:
+        from django.conf import settings
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageCache(
+                    cache_dir=settings.IMAGE_CACHE_DIR,
+                    memory_bytes=settings.IMAGE_CACHE_MEMORY_BYTES,
+                    disk_bytes=settings.IMAGE_CACHE_DISK_BYTES,
+                )
+    return _image_cache
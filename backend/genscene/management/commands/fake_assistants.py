@@ -0,0 +1,45 @@
+import logging
+from django.core.management.base import BaseCommand
+
+from genscene.fake_assistants import FakeAssistantsServer, FakeRunProfile
+
+LOGGER = logging.getLogger(__name__)
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--tokens', type=int, default=50, help='Text deltas per answer')
+    parser.add_argument('--token-rate', type=float, default=50, help='Text deltas per second, 0 for no delay')
+    parser.add_argument('--first-token-ms', type=int, default=200, help='Delay before the first delta')
+    parser.add_argument('--tool-calls', type=int, default=0, help='Tool calls requested before answering')
+    parser.add_argument('--tool-name', default='execute_sql_query',
+                        help='Actor function the tool calls ask for (the default is the database actor\'s)')
+    parser.add_argument('--tool-arguments', default='{"sql_query": "select 1"}', help='JSON arguments of the tool calls')
+    parser.add_argument('--images', type=int, default=0, help='Images in each answer')
+
+
+def profile_from_options(options) -> FakeRunProfile:
+    return FakeRunProfile(
+        tokens=options['tokens'],
+        tokens_per_second=options['token_rate'],
+        first_token_ms=options['first_token_ms'],
+        tool_calls=options['tool_calls'],
+        tool_name=options['tool_name'],
+        tool_arguments=options['tool_arguments'],
+        images=options['images'],
+    )
+
+
+class Command(BaseCommand):
+    help = 'Serve a fake OpenAI Assistants API, point a server at it with OPENAI_BASE_URL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8100)
+        add_profile_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = FakeAssistantsServer(profile_from_options(options), port=options['port'])
+        self.stdout.write(f"export OPENAI_BASE_URL={server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            LOGGER.info("FakeAssistants: stopped")
@@ -0,0 +1,253 @@
+import logging
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from genscene.fake_assistants import FakeAssistantsServer
+from .fake_assistants import add_profile_arguments, profile_from_options
+
+LOGGER = logging.getLogger(__name__)
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+#
+# Load Stats
+#
+# Latencies by name, errors and the number of chat streams open right now,
+# shared by the simulated users
+#
+class LoadStats:
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.active_streams = 0
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def error(self, name: str, e: Exception) -> None:
+        LOGGER.warning(f"LoadTest: {name} failed: {e}")
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def stream_started(self) -> None:
+        with self._lock:
+            self.active_streams += 1
+
+    def stream_ended(self) -> None:
+        with self._lock:
+            self.active_streams -= 1
+
+
+#
+# Process Sampler
+#
+# Samples the resident memory and the thread count of the server process
+# (from /proc, so linux only) together with the number of open chat streams
+#
+class ProcessSampler:
+
+    def __init__(self, pid: int, stats: LoadStats, interval: float = 0.1) -> None:
+        self.pid = pid
+        self.stats = stats
+        self.interval = interval
+        self.baseline = self.sample()
+        self.peak = self.baseline
+        self.peak_streams = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self) -> Dict[str, int] | None:
+        try:
+            with open(f"/proc/{self.pid}/status") as status:
+                fields = dict(line.split(':', 1) for line in status if ':' in line)
+            return {'rss': int(fields['VmRSS'].split()[0]) * 1024, 'threads': int(fields['Threads'])}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def start(self) -> 'ProcessSampler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            sample = self.sample()
+            if sample is None or self.peak is None:
+                continue
+            self.peak = {name: max(value, sample[name]) for name, value in self.peak.items()}
+            self.peak_streams = max(self.peak_streams, self.stats.active_streams)
+
+
+class Command(BaseCommand):
+    help = ('Start the server against a fake OpenAI Assistants API and drive the chat, '
+            'thread list and actor list endpoints with concurrent users')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Concurrent simulated users')
+        parser.add_argument('--iterations', type=int, default=3, help='Chats per user')
+        parser.add_argument('--actor', default=None,
+                            help='Actor to chat with, database when there are tool calls and home otherwise')
+        parser.add_argument('--asgi', action='store_true', help='Serve with uvicorn and use the async chat endpoint')
+        parser.add_argument('--port', type=int, default=8765, help='Port of the server under test')
+        parser.add_argument('--startup-timeout', type=int, default=60)
+        add_profile_arguments(parser)
+
+    def handle(self, *args, **options):
+        # the fake tool calls ask for a function of the database actor
+        if options['actor'] is None:
+            options['actor'] = 'database' if options['tool_calls'] > 0 else 'home'
+        fake = FakeAssistantsServer(profile_from_options(options)).start()
+        workdir = tempfile.mkdtemp(prefix='genscene-loadtest-')
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': 'conf.loadtest_settings',
+            'LOADTEST_STATE_DB': os.path.join(workdir, 'statedb'),
+            'IMAGE_CACHE_DIR': os.path.join(workdir, 'images'),
+            'OPENAI_BASE_URL': fake.url,
+            'OPENAI_API_KEY': 'loadtest',
+        }
+        log = open(os.path.join(workdir, 'server.log'), 'w')
+        server = None
+        succeeded = False
+        try:
+            subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput'],
+                           cwd=settings.BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+            server = subprocess.Popen(self._server_command(options), cwd=settings.BASE_DIR, env=env,
+                                      stdout=log, stderr=subprocess.STDOUT)
+            base_url = f"http://127.0.0.1:{options['port']}"
+            self._wait_for_server(server, base_url, options['startup_timeout'], log.name)
+
+            stats = LoadStats()
+            sampler = ProcessSampler(server.pid, stats).start()
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=options['users']) as executor:
+                users = [executor.submit(self._user, base_url, user, options, stats)
+                         for user in range(options['users'])]
+                for user in users:
+                    user.result()
+            elapsed = time.monotonic() - started
+            sampler.stop()
+            self._report(options, stats, sampler, elapsed)
+            succeeded = True
+        except subprocess.CalledProcessError:
+            raise CommandError(f"migrating the load test database failed, see {log.name}")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+            fake.stop()
+            log.close()
+            # the server log is kept for the error message to point at
+            if succeeded:
+                shutil.rmtree(workdir, ignore_errors=True)
+            else:
+                self.stderr.write(f"kept the load test files in {workdir}")
+
+    def _server_command(self, options) -> List[str]:
+        if options['asgi']:
+            return [sys.executable, '-m', 'uvicorn', 'conf.asgi:application',
+                    '--port', str(options['port']), '--log-level', 'warning']
+        return [sys.executable, 'manage.py', 'runserver', '--noreload', f"127.0.0.1:{options['port']}"]
+
+    # listing the actors also syncs their assistants, so the users start warm
+    def _wait_for_server(self, server, base_url: str, timeout: int, log_name: str) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"server exited with {server.returncode}, see {log_name}")
+            try:
+                if httpx.get(f"{base_url}/api/actors/", timeout=timeout).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            time.sleep(0.5)
+        raise CommandError(f"server did not start in {timeout}s, see {log_name}")
+
+    def _user(self, base_url: str, user: int, options, stats: LoadStats) -> None:
+        user_id = f"loadtest-{user}"
+        chat_path = '/api/chat/async/' if options['asgi'] else '/api/chat/'
+        with httpx.Client(base_url=base_url, timeout=httpx.Timeout(120, connect=10)) as client:
+            for iteration in range(options['iterations']):
+                self._chat(client, chat_path, user_id, options['actor'], iteration, stats)
+                self._get(client, 'threads', '/api/threads/', {'user': user_id}, stats)
+                self._get(client, 'actors', '/api/actors/', {}, stats)
+
+    # ttft is the time until the first delta event, total until the done event
+    def _chat(self, client: httpx.Client, path: str, user_id: str, actor: str, iteration: int, stats: LoadStats) -> None:
+        started = time.monotonic()
+        first_delta = None
+        stats.stream_started()
+        try:
+            data = {'user': user_id, 'actor': actor, 'input': f"load test question {iteration}"}
+            with client.stream('POST', path, json=data) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if first_delta is None and line == 'event: delta':
+                        first_delta = time.monotonic()
+                    if line == 'event: done':
+                        break
+                else:
+                    raise Exception('stream ended without a done event')
+            if first_delta is not None:
+                stats.add('chat ttft', first_delta - started)
+            stats.add('chat total', time.monotonic() - started)
+        except Exception as e:
+            stats.error('chat', e)
+        finally:
+            stats.stream_ended()
+
+    def _get(self, client: httpx.Client, name: str, path: str, params: Dict[str, str], stats: LoadStats) -> None:
+        started = time.monotonic()
+        try:
+            client.get(path, params=params).raise_for_status()
+            stats.add(name, time.monotonic() - started)
+        except Exception as e:
+            stats.error(name, e)
+
+    def _report(self, options, stats: LoadStats, sampler: ProcessSampler, elapsed: float) -> None:
+        chats = len(stats.latencies.get('chat total', []))
+        self.stdout.write(f"{options['users']} users x {options['iterations']} chats: "
+                          f"{chats} chats in {elapsed:.1f}s ({chats / elapsed:.2f} chats/s)")
+        self.stdout.write(f"{'':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name in ['chat ttft', 'chat total', 'threads', 'actors']:
+            values = stats.latencies.get(name, [])
+            if len(values) == 0:
+                self.stdout.write(f"{name:<12}{0:>8}")
+                continue
+            p50, p95, p99 = (percentile(values, p) * 1000 for p in [50, 95, 99])
+            self.stdout.write(f"{name:<12}{len(values):>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+        self.stdout.write(f"errors: {sum(stats.errors.values())} {stats.errors if stats.errors else ''}")
+
+        if sampler.baseline is None:
+            self.stdout.write("server rss and threads: not available on this platform")
+            return
+        streams = max(1, sampler.peak_streams)
+        rss_per_stream = (sampler.peak['rss'] - sampler.baseline['rss']) / streams
+        threads_per_stream = (sampler.peak['threads'] - sampler.baseline['threads']) / streams
+        self.stdout.write(f"server rss: baseline {sampler.baseline['rss'] / 2**20:.1f}MB, "
+                          f"peak {sampler.peak['rss'] / 2**20:.1f}MB, "
+                          f"{rss_per_stream / 2**10:.0f}KB per stream ({sampler.peak_streams} streams at peak)")
+        self.stdout.write(f"server threads: baseline {sampler.baseline['threads']}, "
+                          f"peak {sampler.peak['threads']}, {threads_per_stream:.1f} per stream")
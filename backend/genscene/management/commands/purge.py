@@ -1,7 +1,7 @@
 import logging
 from django.core.management.base import BaseCommand
 
-from genscene.models import Assistant, File, Thread
+from genscene.models import Assistant, File, Thread, Message, MessageImage
 from django.conf import settings
 from django.db import transaction
 
@@ -45,6 +45,8 @@ class Command(BaseCommand):
             except:
                 LOGGER.error(f"Could not delete thread {thread_id}")
         Thread.objects.all().delete()
+        Message.objects.all().delete()
+        MessageImage.objects.all().delete()
 
         transaction.commit()
         return
\ No newline at end of file
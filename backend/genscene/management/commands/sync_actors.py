@@ -0,0 +1,31 @@
+import logging
+from django.apps import apps as proj_apps
+from django.core.management.base import BaseCommand, CommandError
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Sync the assistants and resource files of the actors with openai, e.g. after a deploy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--actor', action='append', help='Actor to sync (default all), can be repeated')
+        parser.add_argument('--invalidate', action='store_true',
+                            help='Sync even when nothing changed and make every running worker sync again, '
+                                 'e.g. after the instructions or a database schema changed')
+
+    def handle(self, *args, **options):
+        config = proj_apps.get_app_config('genscene')
+        actor_names = options['actor'] or list(config.actors.keys())
+        failed = []
+        for actor_name in actor_names:
+            try:
+                if options['invalidate']:
+                    config.invalidate_actors(actor_name)
+                actor = config.get_actor(actor_name)
+                self.stdout.write(f"{actor_name}: {actor.get_assistant_id()}")
+            except Exception as e:
+                LOGGER.error(f"Could not sync actor {actor_name}: {e}")
+                failed.append(actor_name)
+        if len(failed) > 0:
+            raise CommandError(f"Could not sync actors: {', '.join(failed)}")
@@ -0,0 +1,210 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Tuple
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds, from a fast dict lookup up to a long run
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+
+    def __init__(self, buckets: List[float]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+#
+# Metrics
+#
+# Counters and latency histograms of the chat pipeline, rendered in the
+# prometheus text format by the /metrics endpoint. Gauges are collected at
+# scrape time from the callbacks registered with add_collector
+#
+class Metrics:
+
+    def __init__(self) -> None:
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Dict[str, Dict[Labels, float]]]] = []
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help: str) -> None:
+        self._help[name] = help
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            histogram = self._histograms.setdefault(name, {})
+            if key not in histogram:
+                histogram[key] = Histogram(LATENCY_BUCKETS)
+            histogram[key].observe(value)
+
+    def add_collector(self, collector: Callable[[], Dict[str, Dict[Labels, float]]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+            histograms = {name: {labels: (list(h.buckets), list(h.counts), h.sum, h.count)
+                                 for labels, h in values.items()}
+                          for name, values in self._histograms.items()}
+
+        for name, values in sorted(counters.items()):
+            self._header(lines, name, 'counter')
+            for labels, value in values.items():
+                lines.append(f"{name}{self._format(labels)} {value}")
+
+        for name, values in sorted(histograms.items()):
+            self._header(lines, name, 'histogram')
+            for labels, (buckets, counts, total, count) in values.items():
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{self._format(labels + (('le', str(bound)),))} {bucket_count}")
+                lines.append(f"{name}_bucket{self._format(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{self._format(labels)} {total}")
+                lines.append(f"{name}_count{self._format(labels)} {count}")
+
+        for collector in self._collectors:
+            try:
+                gauges = collector()
+            except Exception as e:
+                LOGGER.error(f"Metrics: collector failed: {e}")
+                continue
+            for name, values in sorted(gauges.items()):
+                self._header(lines, name, 'gauge')
+                for labels, value in values.items():
+                    lines.append(f"{name}{self._format(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines: List[str], name: str, type: str) -> None:
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {type}")
+
+    def _labels(self, labels: Dict[str, str]) -> Labels:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def _format(self, labels: Labels) -> str:
+        if len(labels) == 0:
+            return ''
+        values = ','.join(f'{name}="{self._escape(value)}"' for name, value in labels)
+        return '{' + values + '}'
+
+    def _escape(self, value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+METRICS = Metrics()
+METRICS.describe('genscene_span_seconds', 'Duration of the steps of the chat pipeline')
+METRICS.describe('genscene_ttft_seconds', 'Time from starting a run to its first text delta')
+METRICS.describe('genscene_delta_gap_seconds', 'Time between the text deltas of a run')
+METRICS.describe('genscene_runs_total', 'Runs by how they ended')
+
+
+#
+# Request Timing
+#
+# The spans of the current request, sent back in the Server-Timing header by
+# the timing middleware. Only spans that finish before the response starts
+# (e.g. sync and message create) can be included
+#
+class RequestTiming:
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.spans: List[Tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans.append((name, seconds))
+
+    def header(self) -> str:
+        spans = self.spans + [('total', time.monotonic() - self.started)]
+        return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans)
+
+
+REQUEST_TIMING: ContextVar[RequestTiming | None] = ContextVar('request_timing', default=None)
+
+
+@contextmanager
+def span(name: str, actor: str = '', **labels):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        seconds = time.monotonic() - started
+        METRICS.observe('genscene_span_seconds', seconds, span=name, actor=actor, **labels)
+        timing = REQUEST_TIMING.get()
+        if timing is not None:
+            timing.add(name, seconds)
+
+
+#
+# Run Timer
+#
+# Timing of one run, shared by the event handlers of the run (including the
+# ones for the tool output streams): run start, time to first delta and the
+# gaps between deltas
+#
+class RunTimer:
+
+    def __init__(self, actor: str) -> None:
+        self.actor = actor
+        self.started = time.monotonic()
+        self.run_created = None
+        self.last_delta = None
+
+    def created(self) -> None:
+        if self.run_created is None:
+            self.run_created = time.monotonic()
+            METRICS.observe('genscene_span_seconds', self.run_created - self.started, span='run_start', actor=self.actor)
+
+    def delta(self) -> None:
+        now = time.monotonic()
+        if self.last_delta is None:
+            METRICS.observe('genscene_ttft_seconds', now - self.started, actor=self.actor)
+        else:
+            METRICS.observe('genscene_delta_gap_seconds', now - self.last_delta, actor=self.actor)
+        self.last_delta = now
+
+    def end(self, status: str) -> None:
+        METRICS.observe('genscene_span_seconds', time.monotonic() - self.started, span='stream', actor=self.actor)
+        METRICS.increment('genscene_runs_total', actor=self.actor, status=status)
+
+
+# gauges read at scrape time: stream broker memory and the openai connection pools
+def runtime_gauges() -> Dict[str, Dict[Labels, float]]:
+    from django.conf import settings
+    from .stream_broker import get_stream_broker
+    gauges = {}
+    for name, value in get_stream_broker().stats().items():
+        gauges[f"genscene_stream_broker_{name}"] = {(): value}
+    for client, stats in settings.OPENAI_CONFIG.pool_stats().items():
+        for name, value in stats.items():
+            gauges.setdefault(f"genscene_openai_{name}", {})[(('client', client),)] = value
+    return gauges
+
+
+METRICS.add_collector(runtime_gauges)
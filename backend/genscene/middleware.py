@@ -0,0 +1,42 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from .metrics import REQUEST_TIMING, RequestTiming
+
+
+#
+# Timing Middleware
+#
+# Collects the spans of each request and returns them in the Server-Timing
+# header, e.g. "sync;dur=812.4, message_create;dur=95.2, total;dur=910.3".
+# For a streamed chat the total is the time until the stream starts
+#
+class TimingMiddleware:
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timing = RequestTiming()
+        token = REQUEST_TIMING.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            REQUEST_TIMING.reset(token)
+        response['Server-Timing'] = timing.header()
+        return response
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        token = REQUEST_TIMING.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            REQUEST_TIMING.reset(token)
+        response['Server-Timing'] = timing.header()
+        return response
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genscene', '0003_alter_assistant_hash_alter_file_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('thread_id', models.CharField(db_index=True, max_length=200)),
+                ('message_id', models.CharField(max_length=200, unique=True)),
+                ('role', models.CharField(max_length=20)),
+                ('content', models.TextField()),
+                ('created_at', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='synced_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
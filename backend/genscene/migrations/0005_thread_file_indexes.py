@@ -0,0 +1,54 @@
+# Generated by Django 5.0.3 on 2026-10-17 19:07
+
+from django.db import migrations, models
+
+
+# rows that would break the new unique constraints: the latest file of an
+# actor and name wins, a thread id keeps its first row
+def remove_duplicates(apps, schema_editor):
+    File = apps.get_model('genscene', 'File')
+    Thread = apps.get_model('genscene', 'Thread')
+    kept_files = {}
+    for file in File.objects.order_by('-id'):
+        if (file.actor_name, file.name) in kept_files:
+            file.delete()
+        else:
+            kept_files[(file.actor_name, file.name)] = file.id
+    kept_threads = set()
+    for thread in Thread.objects.order_by('id'):
+        if thread.thread_id in kept_threads:
+            thread.delete()
+        else:
+            kept_threads.add(thread.thread_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genscene', '0004_message_thread_synced_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='thread',
+            name='thread_id',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='assistant',
+            index=models.Index(fields=['assistant_id'], name='assistant_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['user_id', 'current'], name='thread_user_current_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['user_id', '-origin_date'], name='thread_user_origin_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='file',
+            constraint=models.UniqueConstraint(fields=('actor_name', 'name'), name='file_actor_name_unique'),
+        ),
+    ]
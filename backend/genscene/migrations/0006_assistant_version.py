@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-17 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genscene', '0005_thread_file_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assistant',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
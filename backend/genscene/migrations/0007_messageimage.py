@@ -0,0 +1,48 @@
+# Generated by Django 5.0.3 on 2026-10-17 21:12
+
+import json
+import re
+
+from django.db import migrations, models
+
+
+# the image items of the stored messages hold the url of the image endpoint,
+# /api/images/<file_id>/ possibly followed by a query string
+def record_images(apps, schema_editor):
+    Message = apps.get_model('genscene', 'Message')
+    MessageImage = apps.get_model('genscene', 'MessageImage')
+    images = []
+    for message in Message.objects.filter(content__contains='image_file').iterator():
+        try:
+            items = json.loads(message.content)
+        except ValueError:
+            continue
+        for item in items:
+            match = re.search(r'/images/([^/?]+)/', item.get('value', '')) if item.get('type') == 'image_file' else None
+            if match is not None:
+                images.append(MessageImage(file_id=match.group(1), thread_id=message.thread_id,
+                                           message_id=message.message_id))
+    MessageImage.objects.bulk_create(images, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genscene', '0006_assistant_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_id', models.CharField(db_index=True, max_length=200)),
+                ('thread_id', models.CharField(db_index=True, max_length=200)),
+                ('message_id', models.CharField(max_length=200)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('message_id', 'file_id'), name='message_image_unique')],
+            },
+        ),
+        migrations.RunPython(record_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.3 on 2026-10-17 21:40
+
+import json
+from urllib.parse import parse_qs, urlsplit
+
+from django.db import migrations, models
+
+
+# image urls were stored as /api/images/<file_id>/?actor=<name>, the actor
+# moves to the image rows and the stored urls become plain again
+def move_actor_to_images(apps, schema_editor):
+    Message = apps.get_model('genscene', 'Message')
+    MessageImage = apps.get_model('genscene', 'MessageImage')
+    for message in Message.objects.filter(content__contains='?actor=').iterator():
+        try:
+            items = json.loads(message.content)
+        except ValueError:
+            continue
+        for item in items:
+            if item.get('type') != 'image_file' or '?' not in item.get('value', ''):
+                continue
+            url = urlsplit(item['value'])
+            actor = parse_qs(url.query).get('actor', [''])[0]
+            file_id = url.path.rstrip('/').rsplit('/', 1)[-1]
+            MessageImage.objects.filter(message_id=message.message_id, file_id=file_id).update(actor=actor)
+            item['value'] = url.path
+        message.content = json.dumps(items)
+        message.save(update_fields=['content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genscene', '0007_messageimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messageimage',
+            name='actor',
+            field=models.CharField(default='', max_length=200),
+        ),
+        migrations.RunPython(move_actor_to_images, migrations.RunPython.noop),
+    ]
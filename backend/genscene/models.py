@@ -17,6 +17,13 @@ class Assistant(models.Model):
     instructions = models.CharField(max_length=10000)
     description  = models.CharField(max_length=1000)
     hash         = models.TextField()
+    # bumped to make every worker sync the actor again, see AssistantRegistry
+    version      = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['assistant_id'], name='assistant_id_idx'),
+        ]
     
     def __str__(self):
         return "assistant"
@@ -27,20 +34,64 @@ class File(models.Model):
     file_id     = models.CharField(max_length=200, null=True)
     hash        = models.TextField()
 
+    # an actor has one file per name, get_tools_resources looks them up by actor
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['actor_name', 'name'], name='file_actor_name_unique'),
+        ]
+
     def __str__(self):
         return "file"
     
 class Thread(models.Model):
     user_id     = models.CharField(max_length=200)
-    thread_id   = models.CharField(max_length=200)
+    thread_id   = models.CharField(max_length=200, unique=True)
     current     = models.BooleanField(default=True)
     name        = models.CharField(max_length=100)
     # need the origin so that we can sort by date
     origin_date = models.DateTimeField(auto_now_add=True)
+    # last time the local messages were checked against openai
+    synced_at   = models.DateTimeField(null=True)
+
+    # the current thread of a user and the thread list (newest first) are read on every chat
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'current'], name='thread_user_current_idx'),
+            models.Index(fields=['user_id', '-origin_date'], name='thread_user_origin_idx'),
+        ]
 
     def __str__(self):
         return "thread"
 
+# local copy of the messages in an openai thread so history reads do not
+# have to go to openai, content is the json list of ReturnItems
+class Message(models.Model):
+    thread_id   = models.CharField(max_length=200, db_index=True)
+    message_id  = models.CharField(max_length=200, unique=True)
+    role        = models.CharField(max_length=20)
+    content     = models.TextField()
+    created_at  = models.BigIntegerField()
+
+    def __str__(self):
+        return "message"
+
+# the images in the stored messages, so the image endpoint can check who may
+# see a file id with an index lookup instead of searching the message content.
+# The actor that made the image tags the image_fetch span
+class MessageImage(models.Model):
+    file_id     = models.CharField(max_length=200, db_index=True)
+    thread_id   = models.CharField(max_length=200, db_index=True)
+    message_id  = models.CharField(max_length=200)
+    actor       = models.CharField(max_length=200, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message_id', 'file_id'], name='message_image_unique'),
+        ]
+
+    def __str__(self):
+        return "message image"
+
 class ThreadSerializer (serializers.ModelSerializer):
     messages = serializers.SerializerMethodField('get_messages')
 
@@ -48,9 +99,29 @@ class ThreadSerializer (serializers.ModelSerializer):
         model = Thread
         fields = ['name', 'thread_id', 'user_id', 'messages']
 
+    # use the messages hydrated by the view when there are some
     def get_messages (self, obj):
+        hydrated = self.context.get('messages', {})
+        if obj.thread_id in hydrated:
+            return hydrated[obj.thread_id].json()
         user_thread = UserThread(user_id=obj.user_id, thread_id=obj.thread_id)
         return user_thread.get_messages().json()
+
+# query parameters for paging through the messages of a thread
+class MessagePageParamsSerializer (serializers.Serializer):
+    limit  = serializers.IntegerField(required=False, min_value=1, max_value=100, default=20)
+    before = serializers.CharField(required=False, default=None)
+    after  = serializers.CharField(required=False, default=None)
+
+    def validate (self, data):
+        if data['before'] is not None and data['after'] is not None:
+            raise serializers.ValidationError("Only one of before or after can be given.")
+        return data
+
+class ThreadSummarySerializer (serializers.ModelSerializer):
+    class Meta:
+        model = Thread
+        fields = ['name', 'thread_id', 'user_id', 'origin_date']
     
 class AssistantSerializer (serializers.ModelSerializer):
     class Meta:
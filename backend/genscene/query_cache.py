@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from typing import Dict, List, Set, Tuple
+import logging
+import re
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# string literals and quoted identifiers, whitespace, words and everything else
+SQL_TOKEN_PATTERN = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)|(\s+)|([\w$]+)|([^'"`\s\w$]+)""")
+# reserved words are folded to lower case by normalize, they cannot be table
+# names without quotes. Other words are kept, identifiers can be case sensitive
+SQL_KEYWORDS = frozenset("""
+    select from where and or not in is null as on join inner left right outer cross natural
+    using group by order having limit distinct all union intersect except with recursive
+    case when then else end asc desc like between exists true false interval
+    insert into values update set delete replace for lock create alter drop table
+""".split())
+SQL_TABLE_PATTERN = re.compile(r"\b(?:from|join|update|into)\s+((?:`[^`]+`|[\w$]+)(?:\.(?:`[^`]+`|[\w$]+))?)")
+
+
+#
+# Query Cache
+#
+# Read only result cache for the sql generated by the assistant. Queries are
+# keyed on their normalized text so the same question asked with different
+# whitespace or keyword case hits the same entry. Entries expire after the
+# ttl, the least recently used are evicted past max_entries, and entries can
+# be dropped for the tables they read from
+#
+class QueryCache:
+
+    def __init__(self, ttl: int, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, Tuple[float, Set[str], str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # collapse whitespace and lower case the keywords outside of quotes
+    @staticmethod
+    def normalize(sql_query: str) -> str:
+        tokens = []
+        for literal, space, word, other in SQL_TOKEN_PATTERN.findall(sql_query.strip()):
+            if space:
+                tokens.append(' ')
+            elif word and word.lower() in SQL_KEYWORDS:
+                tokens.append(word.lower())
+            else:
+                tokens.append(literal or word or other)
+        return ''.join(tokens).strip().rstrip(';').strip()
+
+    # only single select statements are cached
+    @staticmethod
+    def is_cacheable(normalized_sql: str) -> bool:
+        if not (normalized_sql.startswith('select ') or normalized_sql.startswith('with ')):
+            return False
+        tokens = SQL_TOKEN_PATTERN.findall(normalized_sql)
+        words = {word for literal, space, word, other in tokens if word}
+        return (not any(';' in other for literal, space, word, other in tokens)
+                and not any(word in words for word in ['into', 'update', 'for']))
+
+    # table names are compared in lower case when invalidating
+    @staticmethod
+    def get_tables(normalized_sql: str) -> Set[str]:
+        return {match.replace('`', '').split('.')[-1].lower() for match in SQL_TABLE_PATTERN.findall(normalized_sql)}
+
+    def get(self, normalized_sql: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(normalized_sql)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[normalized_sql]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(normalized_sql)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, normalized_sql: str, result: str) -> None:
+        with self._lock:
+            self._entries[normalized_sql] = (time.monotonic() + self.ttl, self.get_tables(normalized_sql), result)
+            self._entries.move_to_end(normalized_sql)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # drop the entries reading from any of the tables, or everything when no tables are given
+    def invalidate(self, tables: List[str] | None = None) -> int:
+        with self._lock:
+            if tables is None:
+                count = len(self._entries)
+                self._entries = OrderedDict()
+            else:
+                tables = {table.lower() for table in tables}
+                stale = [key for key, entry in self._entries.items() if entry[1] & tables]
+                for key in stale:
+                    del self._entries[key]
+                count = len(stale)
+        if count > 0:
+            LOGGER.info(f"QueryCache: invalidated {count} entries for tables: {tables or '*'}")
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -2,12 +2,16 @@ from pydantic import BaseModel
 import json
 import io
 import base64
-from typing import List
+from typing import List, Optional
 from openai.types.beta.threads import ImageFile
 from openai.types.beta.threads import Text
 from openai.types.beta.threads import Message, MessageContent
 from openai import OpenAI
 import logging
+from django.urls import reverse
+from django.conf import settings
+from .image_cache import get_image_cache
+from .metrics import span
 
 LOGGER = logging.getLogger(__name__)
 
@@ -22,14 +26,19 @@ class ReturnItem(BaseModel):
   def from_text(cls, type: str, role: str, value: str) -> 'ReturnItem':
     return ReturnItem(type=type, role=role, value=value)
 
+  # images are returned as a short url to the image endpoint, the browser
+  # fetches (and caches) the bytes instead of getting them inlined as base64
   @classmethod
   def from_image_file(cls, type: str, role: str, openai_client: OpenAI, file_id: str) -> 'ReturnItem':
-    LOGGER.info(f"Loading image file: {file_id} using openai_client: {openai_client}")
-    response_content = openai_client.files.content(file_id)
-    data_in_bytes = response_content.read()
-    readable_buffer = io.BytesIO(data_in_bytes)
-    img_src = 'data:image/png;base64,' + base64.b64encode(readable_buffer.getvalue()).decode()
-    return ReturnItem(type=type, value=img_src, role=role)
+    return ReturnItem(type=type, value=reverse('genscene:images', args=[file_id]), role=role)
+
+  @staticmethod
+  def load_image_bytes(openai_client: OpenAI, file_id: str, actor: str = '') -> bytes:
+    def fetch():
+      LOGGER.info(f"Loading image file: {file_id} using openai_client: {openai_client}")
+      with span('image_fetch', actor=actor):
+        return openai_client.files.content(file_id, timeout=settings.OPENAI_CONFIG.timeout('file')).read()
+    return get_image_cache().get_or_fetch(file_id, fetch)
 
   @classmethod
   def from_message_content(cls, role: str, openai_client: OpenAI, item: MessageContent) -> 'ReturnItem':
@@ -76,4 +85,11 @@ class ReturnMessage(BaseModel):
     self.items.append(ReturnItem.from_image_file('image_file', role, openai_client, file_id))
 
 
-  
+# One page of a thread's messages in display order (oldest first). first_id and
+# last_id are the cursors for the previous (older) and next (newer) page
+class MessagePage(BaseModel):
+
+  messages: ReturnMessage
+  first_id: Optional[str] = None
+  last_id: Optional[str] = None
+  has_more: bool = False
@@ -0,0 +1,82 @@
+from typing import Any, Callable
+import asyncio
+import logging
+import threading
+import time
+from .stream_broker import StreamBroker
+
+LOGGER = logging.getLogger(__name__)
+
+
+#
+# Run Monitor
+#
+# Watches the subscribers of a running stream. When nobody has been listening
+# for the grace period (long enough for a client to reconnect and resume) the
+# run is abandoned: cancel is called once so the run stops using tokens
+#
+class RunMonitor:
+
+    def __init__(self, broker: StreamBroker, thread_id: str, grace: float, cancel: Callable[[], Any], interval: float = 1.0) -> None:
+        self.broker = broker
+        self.thread_id = thread_id
+        self.grace = grace
+        self.cancel = cancel
+        self.interval = min(interval, grace) if grace > 0 else interval
+        self.abandoned = False
+        self._unsubscribed_since = time.monotonic()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def check(self) -> bool:
+        if self.abandoned:
+            return True
+        try:
+            subscribers = self.broker.subscribers(self.thread_id)
+        except Exception as e:
+            LOGGER.error(f"RunMonitor: could not count subscribers of thread {self.thread_id}: {e}")
+            return False
+        now = time.monotonic()
+        if subscribers > 0:
+            self._unsubscribed_since = now
+            return False
+        if now - self._unsubscribed_since < self.grace:
+            return False
+        self.abandoned = True
+        return True
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            if self.check():
+                self._log_abandoned()
+                try:
+                    self.cancel()
+                except Exception as e:
+                    LOGGER.error(f"RunMonitor: could not cancel the run of thread {self.thread_id}: {e}")
+                return
+
+    # async version for runs on the event loop, cancel is a coroutine function
+    # and the monitor is stopped by cancelling this task
+    async def awatch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            check = await asyncio.to_thread(self.check)
+            if check:
+                self._log_abandoned()
+                try:
+                    await self.cancel()
+                except Exception as e:
+                    LOGGER.error(f"RunMonitor: could not cancel the run of thread {self.thread_id}: {e}")
+                return
+
+    def _log_abandoned(self) -> None:
+        LOGGER.info(f"RunMonitor: no subscribers for thread {self.thread_id} in {self.grace}s, cancelling the run")
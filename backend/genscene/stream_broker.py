@@ -0,0 +1,597 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Dict, List, Tuple
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+import asyncio
+import logging
+import threading
+import time
+from .return_message import ReturnItem
+
+LOGGER = logging.getLogger(__name__)
+
+# (offset, item), an item of None marks the end of the run
+StreamEvent = Tuple[int, ReturnItem | None]
+
+# rough memory used by an event besides its text
+EVENT_OVERHEAD_BYTES = 128
+
+OVERFLOW_POLICIES = ['block', 'coalesce', 'drop']
+
+# share of the limits a stream is trimmed to once it overflowed
+LOW_WATERMARK = 0.75
+
+
+#
+# Stream Broker
+#
+# A run publishes its items to the broker under the thread id and HTTP
+# responses subscribe to it, so the run is no longer tied to the response
+# that started it. Every item gets an increasing offset and a subscriber can
+# start reading from any offset, e.g. after a reconnect or from a second tab.
+# A thread only has one run at a time, starting a new one replaces the old
+# stream but keeps counting offsets from where it ended. Finished streams
+# are kept for the retention period
+#
+class StreamBroker(ABC):
+
+    # whether publish can wait on slow subscribers
+    may_block = False
+
+    @abstractmethod
+    def start(self, thread_id: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def publish(self, thread_id: str, item: ReturnItem | None) -> int:
+        raise NotImplementedError
+
+    # events after the offset, waits up to timeout seconds (forever when None)
+    # for one to arrive. Reading past the end of a finished stream returns its
+    # end event. Raises KeyError when the thread has no stream
+    @abstractmethod
+    def read(self, thread_id: str, offset: int, timeout: float | None = None, subscriber: int | None = None) -> List[StreamEvent]:
+        raise NotImplementedError
+
+    async def aread(self, thread_id: str, offset: int, timeout: float | None = None, subscriber: int | None = None) -> List[StreamEvent]:
+        return await sync_to_async(self.read, thread_sensitive=False)(thread_id, offset, timeout, subscriber)
+
+    # the async versions below are for runs and subscribers on the event loop,
+    # brokers doing network i/o override them so the loop is never blocked
+    async def astart(self, thread_id: str) -> None:
+        self.start(thread_id)
+
+    # a publish that can block waits in a thread, not on the event loop
+    async def apublish(self, thread_id: str, item: ReturnItem | None) -> int:
+        if self.may_block:
+            return await asyncio.to_thread(self.publish, thread_id, item)
+        return self.publish(thread_id, item)
+
+    async def asubscribe(self, thread_id: str) -> int | None:
+        return self.subscribe(thread_id)
+
+    async def aunsubscribe(self, thread_id: str, subscriber: int | None = None) -> None:
+        self.unsubscribe(thread_id, subscriber)
+
+    def close(self, thread_id: str) -> int:
+        return self.publish(thread_id, None)
+
+    # subscribers are counted per thread so the run can be cancelled once
+    # nobody is listening anymore. The returned id is passed to read so the
+    # broker knows how far each subscriber got
+    @abstractmethod
+    def subscribe(self, thread_id: str) -> int | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def unsubscribe(self, thread_id: str, subscriber: int | None = None) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def subscribers(self, thread_id: str) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+def _event_bytes(item: ReturnItem | None) -> int:
+    return EVENT_OVERHEAD_BYTES + (0 if item is None else len(item.value))
+
+
+def _gap_item() -> ReturnItem:
+    return ReturnItem.from_text('gap', 'assistant', '')
+
+
+class _MemoryStream:
+
+    def __init__(self, next_offset: int = 1) -> None:
+        self.condition = threading.Condition()
+        self.events: deque[StreamEvent] = deque()
+        self.bytes = 0
+        self.next_offset = next_offset
+        self.closed_at = None
+        self.waiters = []
+        # how far each subscriber has read
+        self.cursors: Dict[int, int] = {}
+        # readers behind this offset missed dropped events
+        self.dropped_through = 0
+        # offset of a coalesced event -> offset of the first delta merged into it
+        self.merged_from: Dict[int, int] = {}
+
+    def has_events_after(self, offset: int) -> bool:
+        return self.closed_at is not None or (len(self.events) > 0 and self.events[-1][0] > offset)
+
+    # readers are usually close to the end, so the events are scanned backwards
+    def events_after(self, offset: int) -> List[StreamEvent]:
+        if len(self.events) == 0:
+            return []
+        if self.closed_at is not None and offset >= self.events[-1][0]:
+            return [self.events[-1]]
+        events = []
+        for event in reversed(self.events):
+            if event[0] <= offset:
+                break
+            events.append(event)
+        events.reverse()
+        # the reader has seen part of a coalesced event, the rest is marked as a gap
+        first = self.merged_from.get(events[0][0]) if len(events) > 0 else None
+        if first is not None and first <= offset:
+            events[0] = (events[0][0], _gap_item())
+        if offset < self.dropped_through:
+            events = [(self.dropped_through, _gap_item())] + [event for event in events if event[0] > self.dropped_through]
+        return events
+
+    def append(self, offset: int, item: ReturnItem | None) -> None:
+        self.events.append((offset, item))
+        self.bytes += _event_bytes(item)
+
+    def behind(self) -> bool:
+        oldest = self.events[0][0]
+        return any(cursor < oldest for cursor in self.cursors.values())
+
+    # merge runs of text of the oldest half into single events, never across
+    # the position of a subscriber so subscribers do not see gaps
+    def coalesce(self) -> int:
+        half = len(self.events) // 2
+        cursors = set(self.cursors.values())
+        events = deque()
+        merged = 0
+        for index, (offset, item) in enumerate(self.events):
+            previous = events[-1] if len(events) > 0 else None
+            if (index < half and previous is not None and previous[0] not in cursors and
+                    item is not None and previous[1] is not None and
+                    item.type == 'text' and previous[1].type == 'text' and item.role == previous[1].role):
+                events.pop()
+                self.merged_from[offset] = self.merged_from.pop(previous[0], previous[0])
+                events.append((offset, ReturnItem.from_text('text', item.role, previous[1].value + item.value)))
+                merged += 1
+            else:
+                events.append((offset, item))
+        self.events = events
+        self.bytes = sum(_event_bytes(item) for _, item in events)
+        return merged
+
+    def drop_oldest(self) -> None:
+        offset, item = self.events.popleft()
+        self.bytes -= _event_bytes(item)
+        self.merged_from.pop(offset, None)
+        self.dropped_through = offset
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+#
+# In Memory Stream Broker
+#
+# Streams live in this process. Each stream is kept under max_events and
+# max_bytes, what happens when a run produces more depends on the overflow
+# policy:
+#   block    - the run waits (up to block_timeout seconds) for subscribers
+#              that have not read the oldest events, then coalesces
+#   coalesce - text deltas of the oldest half are merged, when that is not
+#              enough the oldest events are dropped
+#   drop     - the oldest events are dropped
+# A reader that missed dropped text gets a gap event in its place
+#
+class InMemoryStreamBroker(StreamBroker):
+
+    def __init__(self, retention: int, max_events: int, max_bytes: int = 1024 * 1024,
+                 overflow_policy: str = 'coalesce', block_timeout: float = 5.0) -> None:
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ImproperlyConfigured(f"Unknown stream overflow policy: {overflow_policy}")
+        self.retention = retention
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.may_block = overflow_policy == 'block'
+        self._streams: Dict[str, _MemoryStream] = {}
+        self._subscribers: Dict[str, int] = {}
+        self._next_subscriber = 0
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0
+
+    def start(self, thread_id: str) -> None:
+        with self._lock:
+            self._purge()
+            previous = self._streams.get(thread_id)
+            next_offset = 1 if previous is None else previous.next_offset
+            self._streams[thread_id] = _MemoryStream(next_offset)
+
+    def publish(self, thread_id: str, item: ReturnItem | None) -> int:
+        stream = self._get_stream(thread_id)
+        with stream.condition:
+            # nothing is added once the run has ended
+            if stream.closed_at is not None:
+                return stream.next_offset - 1
+            offset = stream.next_offset
+            stream.next_offset += 1
+            stream.append(offset, item)
+            if item is None:
+                stream.closed_at = time.monotonic()
+            else:
+                self._bound(thread_id, stream)
+            stream.condition.notify_all()
+            waiters, stream.waiters = stream.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        return offset
+
+    # must be called with the stream's condition held
+    def _bound(self, thread_id: str, stream: _MemoryStream) -> None:
+        if not self._over_limit(stream):
+            return
+        if self.overflow_policy == 'block' and stream.behind():
+            self.blocked += 1
+            if not stream.condition.wait_for(lambda: not stream.behind(), self.block_timeout):
+                LOGGER.info(f"InMemoryStreamBroker: subscribers of thread {thread_id} still behind after {self.block_timeout}s")
+        if self.overflow_policy != 'drop':
+            self.coalesced += stream.coalesce()
+        # trim to a low watermark so the next publishes do not overflow again
+        dropped = 0
+        while self._over_limit(stream, LOW_WATERMARK) and len(stream.events) > 1:
+            stream.drop_oldest()
+            dropped += 1
+        if dropped > 0:
+            self.dropped += dropped
+            LOGGER.info(f"InMemoryStreamBroker: dropped {dropped} events of thread {thread_id}")
+
+    def _over_limit(self, stream: _MemoryStream, fraction: float = 1.0) -> bool:
+        return len(stream.events) > self.max_events * fraction or stream.bytes > self.max_bytes * fraction
+
+    def read(self, thread_id: str, offset: int, timeout: float | None = None, subscriber: int | None = None) -> List[StreamEvent]:
+        stream = self._get_stream(thread_id)
+        with stream.condition:
+            self._move_cursor(stream, subscriber, offset)
+            stream.condition.wait_for(lambda: stream.has_events_after(offset), timeout)
+            return stream.events_after(offset)
+
+    # waits on a future instead of the condition so no thread is parked per subscriber
+    async def aread(self, thread_id: str, offset: int, timeout: float | None = None, subscriber: int | None = None) -> List[StreamEvent]:
+        stream = self._get_stream(thread_id)
+        loop = asyncio.get_running_loop()
+        with stream.condition:
+            self._move_cursor(stream, subscriber, offset)
+            if stream.has_events_after(offset):
+                return stream.events_after(offset)
+            future = loop.create_future()
+            stream.waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with stream.condition:
+            return stream.events_after(offset)
+
+    # must be called with the stream's condition held, wakes a blocked publisher
+    def _move_cursor(self, stream: _MemoryStream, subscriber: int | None, offset: int) -> None:
+        if subscriber is not None and stream.cursors.get(subscriber) != offset:
+            stream.cursors[subscriber] = offset
+            stream.condition.notify_all()
+
+    def subscribe(self, thread_id: str) -> int | None:
+        with self._lock:
+            self._subscribers[thread_id] = self._subscribers.get(thread_id, 0) + 1
+            self._next_subscriber += 1
+            return self._next_subscriber
+
+    def unsubscribe(self, thread_id: str, subscriber: int | None = None) -> None:
+        with self._lock:
+            count = self._subscribers.get(thread_id, 0) - 1
+            if count > 0:
+                self._subscribers[thread_id] = count
+            else:
+                self._subscribers.pop(thread_id, None)
+            stream = self._streams.get(thread_id)
+        if stream is not None and subscriber is not None:
+            with stream.condition:
+                stream.cursors.pop(subscriber, None)
+                stream.condition.notify_all()
+
+    def subscribers(self, thread_id: str) -> int:
+        return self._subscribers.get(thread_id, 0)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            streams = list(self._streams.values())
+        return {
+            'streams': len(streams),
+            'bytes': sum(stream.bytes for stream in streams),
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'blocked': self.blocked,
+        }
+
+    def _get_stream(self, thread_id: str) -> _MemoryStream:
+        stream = self._streams.get(thread_id)
+        if stream is None:
+            raise KeyError(thread_id)
+        return stream
+
+    # must be called with the lock held
+    def _purge(self) -> None:
+        expired_before = time.monotonic() - self.retention
+        expired = [thread_id for thread_id, stream in self._streams.items()
+                   if stream.closed_at is not None and stream.closed_at < expired_before]
+        for thread_id in expired:
+            del self._streams[thread_id]
+
+
+#
+# Redis Stream Broker
+#
+# Keeps each thread's stream in a redis stream so a subscriber can be served
+# by any worker or node. Entry ids are '0-<offset>', the first entry marks
+# the start of the stream. Works with any client that has the redis-py
+# interface (delete, expire, get, incr, decr, pipeline, xadd, xread,
+# xrevrange), the async methods use the redis.asyncio client when one is
+# given so a blocking XREAD waits on the event loop instead of in a thread.
+# Subscribers are counted in a separate key next to the stream. There is no
+# byte limit or overflow policy, the stream is only trimmed (approximately)
+# to max_events and a reader that fell behind the trimmed entries gets a gap
+#
+class RedisStreamBroker(StreamBroker):
+
+    def __init__(self, client, retention: int, max_events: int, prefix: str = 'genscene:stream:', async_client=None) -> None:
+        self.client = client
+        self.async_client = async_client
+        self.retention = retention
+        self.max_events = max_events
+        self.prefix = prefix
+        self._offsets: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def start(self, thread_id: str) -> None:
+        key = self._key(thread_id)
+        start_offset = self._start_offset(self.client.xrevrange(key, count=1))
+        pipeline = self.client.pipeline(transaction=False)
+        self._start_commands(pipeline, thread_id, start_offset)
+        pipeline.execute()
+
+    async def astart(self, thread_id: str) -> None:
+        if self.async_client is None:
+            return await asyncio.to_thread(self.start, thread_id)
+        key = self._key(thread_id)
+        start_offset = self._start_offset(await self.async_client.xrevrange(key, count=1))
+        pipeline = self.async_client.pipeline(transaction=False)
+        self._start_commands(pipeline, thread_id, start_offset)
+        await pipeline.execute()
+
+    def _start_offset(self, entries) -> int:
+        last = self._last_entry(entries)
+        return 1 if last is None else last[0] + 1
+
+    def _start_commands(self, pipeline, thread_id: str, start_offset: int) -> None:
+        key = self._key(thread_id)
+        pipeline.delete(key)
+        pipeline.xadd(key, {'start': '1'}, id=f'0-{start_offset}')
+        pipeline.expire(key, self.retention)
+        with self._lock:
+            self._offsets[thread_id] = start_offset
+
+    # only the process running the run publishes, so the offsets are counted here.
+    # The entry and both expiries go out in one round trip
+    def publish(self, thread_id: str, item: ReturnItem | None) -> int:
+        offset = self._next_offset(thread_id, item)
+        if offset == 0:
+            return 0
+        pipeline = self.client.pipeline(transaction=False)
+        self._publish_commands(pipeline, thread_id, offset, item)
+        pipeline.execute()
+        return offset
+
+    async def apublish(self, thread_id: str, item: ReturnItem | None) -> int:
+        if self.async_client is None:
+            return await asyncio.to_thread(self.publish, thread_id, item)
+        offset = self._next_offset(thread_id, item)
+        if offset == 0:
+            return 0
+        pipeline = self.async_client.pipeline(transaction=False)
+        self._publish_commands(pipeline, thread_id, offset, item)
+        await pipeline.execute()
+        return offset
+
+    def _next_offset(self, thread_id: str, item: ReturnItem | None) -> int:
+        with self._lock:
+            if thread_id not in self._offsets:
+                return 0
+            offset = self._offsets[thread_id] + 1
+            if item is None:
+                del self._offsets[thread_id]
+            else:
+                self._offsets[thread_id] = offset
+            return offset
+
+    def _publish_commands(self, pipeline, thread_id: str, offset: int, item: ReturnItem | None) -> None:
+        key = self._key(thread_id)
+        fields = {'end': '1'} if item is None else {'item': item.model_dump_json()}
+        pipeline.xadd(key, fields, id=f'0-{offset}', maxlen=self.max_events, approximate=True)
+        pipeline.expire(key, self.retention)
+        # the count outlives crashed subscribers only until the run goes quiet
+        pipeline.expire(f"{key}:subscribers", self.retention)
+
+    def read(self, thread_id: str, offset: int, timeout: float | None = None, subscriber: int | None = None) -> List[StreamEvent]:
+        key = self._key(thread_id)
+        end = self._end_event(thread_id, self.client.xrevrange(key, count=1), offset)
+        if end is not None:
+            return end
+        # offset of the first event the reader has not seen
+        expected = offset + 1
+        while True:
+            response = self.client.xread({key: f'0-{offset}'}, block=self._block(timeout))
+            if not response:
+                return []
+            events, offset, expected = self._events(response, offset, expected)
+            if len(events) > 0:
+                return events
+
+    async def aread(self, thread_id: str, offset: int, timeout: float | None = None, subscriber: int | None = None) -> List[StreamEvent]:
+        if self.async_client is None:
+            return await super().aread(thread_id, offset, timeout, subscriber)
+        key = self._key(thread_id)
+        end = self._end_event(thread_id, await self.async_client.xrevrange(key, count=1), offset)
+        if end is not None:
+            return end
+        expected = offset + 1
+        while True:
+            response = await self.async_client.xread({key: f'0-{offset}'}, block=self._block(timeout))
+            if not response:
+                return []
+            events, offset, expected = self._events(response, offset, expected)
+            if len(events) > 0:
+                return events
+
+    # reading past the end of a finished stream returns its end event
+    def _end_event(self, thread_id: str, entries, offset: int) -> List[StreamEvent] | None:
+        last = self._last_entry(entries)
+        if last is None:
+            raise KeyError(thread_id)
+        if 'end' in last[1] and last[0] <= offset:
+            return [(last[0], None)]
+        return None
+
+    def _block(self, timeout: float | None) -> int:
+        return 0 if timeout is None else max(1, int(timeout * 1000))
+
+    # events of an xread response, an empty list when only the start marker was read
+    def _events(self, response, offset: int, expected: int) -> Tuple[List[StreamEvent], int, int]:
+        events = []
+        for _, entries in response:
+            for entry_id, fields in entries:
+                fields = {self._text(name): self._text(value) for name, value in fields.items()}
+                offset = int(self._text(entry_id).split('-')[1])
+                if 'start' in fields:
+                    expected = offset + 1
+                    continue
+                item = None if 'end' in fields else ReturnItem.model_validate_json(fields['item'])
+                events.append((offset, item))
+        # the events in between were trimmed before the reader got to them
+        if len(events) > 0 and events[0][0] > expected:
+            events.insert(0, (events[0][0] - 1, _gap_item()))
+        return events, offset, expected
+
+    def subscribe(self, thread_id: str) -> int | None:
+        key = f"{self._key(thread_id)}:subscribers"
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.incr(key)
+        pipeline.expire(key, self.retention)
+        pipeline.execute()
+        return None
+
+    async def asubscribe(self, thread_id: str) -> int | None:
+        if self.async_client is None:
+            return await asyncio.to_thread(self.subscribe, thread_id)
+        key = f"{self._key(thread_id)}:subscribers"
+        pipeline = self.async_client.pipeline(transaction=False)
+        pipeline.incr(key)
+        pipeline.expire(key, self.retention)
+        await pipeline.execute()
+        return None
+
+    def unsubscribe(self, thread_id: str, subscriber: int | None = None) -> None:
+        key = f"{self._key(thread_id)}:subscribers"
+        if self.client.decr(key) <= 0:
+            self.client.delete(key)
+
+    async def aunsubscribe(self, thread_id: str, subscriber: int | None = None) -> None:
+        if self.async_client is None:
+            return await asyncio.to_thread(self.unsubscribe, thread_id, subscriber)
+        key = f"{self._key(thread_id)}:subscribers"
+        if await self.async_client.decr(key) <= 0:
+            await self.async_client.delete(key)
+
+    def subscribers(self, thread_id: str) -> int:
+        return int(self.client.get(f"{self._key(thread_id)}:subscribers") or 0)
+
+    def _last_entry(self, entries) -> Tuple[int, Dict[str, str]] | None:
+        if not entries:
+            return None
+        entry_id, fields = entries[0]
+        return (int(self._text(entry_id).split('-')[1]),
+                {self._text(name): self._text(value) for name, value in fields.items()})
+
+    def _key(self, thread_id: str) -> str:
+        return f"{self.prefix}{thread_id}"
+
+    def _text(self, value) -> str:
+        return value.decode() if isinstance(value, bytes) else value
+
+
+_stream_broker: StreamBroker | None = None
+_stream_broker_lock = threading.Lock()
+
+def get_stream_broker() -> StreamBroker:
+    global _stream_broker
+    if _stream_broker is None:
+        from django.conf import settings
+        with _stream_broker_lock:
+            if _stream_broker is None:
+                url = settings.STREAM_BROKER_URL
+                if url.startswith('redis://') or url.startswith('rediss://'):
+                    try:
+                        import redis
+                    except ImportError:
+                        raise ImproperlyConfigured("STREAM_BROKER_URL is a redis url but the redis package is not installed")
+                    import redis.asyncio
+                    _stream_broker = RedisStreamBroker(redis.Redis.from_url(url),
+                                                       retention=settings.STREAM_RETENTION,
+                                                       max_events=settings.STREAM_MAX_EVENTS,
+                                                       async_client=redis.asyncio.Redis.from_url(url))
+                elif url.startswith('memory://'):
+                    _stream_broker = InMemoryStreamBroker(retention=settings.STREAM_RETENTION,
+                                                          max_events=settings.STREAM_MAX_EVENTS,
+                                                          max_bytes=settings.STREAM_MAX_BYTES,
+                                                          overflow_policy=settings.STREAM_OVERFLOW_POLICY,
+                                                          block_timeout=settings.STREAM_BLOCK_TIMEOUT)
+                else:
+                    raise ImproperlyConfigured(f"Unknown STREAM_BROKER_URL: {url}")
+                LOGGER.info(f"Using stream broker: {_stream_broker.__class__.__name__}")
+    return _stream_broker
+
+
+# queue like front of the broker for the event handlers
+class StreamPublisher:
+
+    def __init__(self, broker: StreamBroker, thread_id: str) -> None:
+        self.broker = broker
+        self.thread_id = thread_id
+
+    def put(self, item: ReturnItem | None) -> None:
+        self.broker.publish(self.thread_id, item)
+
+
+class AsyncStreamPublisher:
+
+    def __init__(self, broker: StreamBroker, thread_id: str) -> None:
+        self.broker = broker
+        self.thread_id = thread_id
+
+    async def put(self, item: ReturnItem | None) -> None:
+        await self.broker.apublish(self.thread_id, item)
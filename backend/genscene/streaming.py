@@ -0,0 +1,163 @@
+from pydantic import BaseModel, Field
+from django.conf import settings
+from typing import Any, Dict, List, Optional, Tuple
+import time
+import logging
+from .return_message import ReturnItem
+
+LOGGER = logging.getLogger(__name__)
+
+
+#
+# Flush Policy
+#
+# Decides when buffered text deltas are written to the response. A flush
+# happens as soon as any of the limits is reached, images and other non text
+# items always flush whatever text is buffered before them
+#
+class FlushPolicy(BaseModel):
+
+  max_tokens: int = Field(default=32, ge=1)
+  max_bytes: Optional[int] = Field(default=None, ge=1)
+  max_latency_ms: Optional[int] = Field(default=100, ge=0)
+
+  # limits the request does not set keep their defaults
+  @classmethod
+  def from_request(cls, data: Dict[str, Any]) -> 'FlushPolicy':
+    policy = {}
+    if data.get('buffer_size', None) is not None:
+      policy['max_tokens'] = data.get('buffer_size')
+    if data.get('buffer_bytes', None) is not None:
+      policy['max_bytes'] = data.get('buffer_bytes')
+    if data.get('buffer_ms', None) is not None:
+      policy['max_latency_ms'] = data.get('buffer_ms')
+    return FlushPolicy(**policy)
+
+
+# Buffered text carries the offset of the last delta in it, so a client that
+# saw the chunk resumes right after it
+class DeltaCoalescer:
+
+  def __init__(self, policy: FlushPolicy) -> None:
+    self.policy = policy
+    self._buffer: List[str] = []
+    self._bytes = 0
+    self._role = None
+    self._offset = 0
+    self._deadline = None
+
+  # seconds until the buffered text must be flushed, None when nothing is buffered
+  def timeout(self) -> float | None:
+    if self._deadline is None:
+      return None
+    return max(0.0, self._deadline - time.monotonic())
+
+  def add(self, item: ReturnItem, offset: int = 0) -> List[Tuple[int, ReturnItem]]:
+    if item.type != 'text':
+      return self.flush() + [(offset, item)]
+    if self._role is not None and item.role != self._role:
+      return self.flush() + self._buffer_text(item, offset)
+    return self._buffer_text(item, offset)
+
+  def flush(self) -> List[Tuple[int, ReturnItem]]:
+    if len(self._buffer) == 0:
+      return []
+    item = ReturnItem.from_text('text', self._role, ''.join(self._buffer))
+    self._buffer = []
+    self._bytes = 0
+    self._role = None
+    self._deadline = None
+    return [(self._offset, item)]
+
+  def _buffer_text(self, item: ReturnItem, offset: int) -> List[Tuple[int, ReturnItem]]:
+    if len(self._buffer) == 0:
+      self._role = item.role
+      if self.policy.max_latency_ms is not None:
+        self._deadline = time.monotonic() + self.policy.max_latency_ms / 1000
+    self._buffer.append(item.value)
+    self._bytes += len(item.value.encode())
+    self._offset = offset
+
+    if ((len(self._buffer) >= self.policy.max_tokens) or
+        (self.policy.max_bytes is not None and self._bytes >= self.policy.max_bytes) or
+        (self._deadline is not None and time.monotonic() >= self._deadline)):
+      return self.flush()
+    return []
+
+
+SSE_EVENT_NAMES = {
+  'text': 'delta',
+  'image_file': 'image',
+  'tool': 'tool',
+  'gap': 'gap',
+}
+
+# wire format of the chat stream: server sent events with the broker offset as
+# the event id, so a client can reconnect with Last-Event-ID. The end of the
+# run is a done event
+def encode_event(offset: int, item: ReturnItem | None) -> str:
+  if item is None:
+    return f"id: {offset}\nevent: done\ndata: {{}}\n\n"
+  event = SSE_EVENT_NAMES.get(item.type, item.type)
+  return f"id: {offset}\nevent: {event}\ndata: {item.model_dump_json()}\n\n"
+
+
+#
+# Stream Events
+#
+# Subscribes to a thread's stream in the broker after the offset and yields
+# the encoded events until the end of the run. A comment is sent when the
+# stream has been quiet for STREAM_HEARTBEAT seconds, writing it is how a
+# disconnected client is noticed while the run is busy (e.g. in a tool call)
+#
+HEARTBEAT_EVENT = ": keep-alive\n\n"
+
+def stream_events(broker, thread_id: str, offset: int = 0, flush_policy: FlushPolicy = None):
+  coalescer = DeltaCoalescer(flush_policy or FlushPolicy())
+  subscriber = broker.subscribe(thread_id)
+  try:
+    streaming = True
+    while streaming:
+      events = broker.read(thread_id, offset, timeout=_read_timeout(coalescer), subscriber=subscriber)
+      items, offset, streaming = _coalesce_events(coalescer, events, offset)
+      if len(events) == 0 and len(items) == 0:
+        yield HEARTBEAT_EVENT
+      for item_offset, item in items:
+        yield encode_event(item_offset, item)
+  finally:
+    broker.unsubscribe(thread_id, subscriber)
+
+
+async def astream_events(broker, thread_id: str, offset: int = 0, flush_policy: FlushPolicy = None):
+  coalescer = DeltaCoalescer(flush_policy or FlushPolicy())
+  subscriber = await broker.asubscribe(thread_id)
+  try:
+    streaming = True
+    while streaming:
+      events = await broker.aread(thread_id, offset, timeout=_read_timeout(coalescer), subscriber=subscriber)
+      items, offset, streaming = _coalesce_events(coalescer, events, offset)
+      if len(events) == 0 and len(items) == 0:
+        yield HEARTBEAT_EVENT
+      for item_offset, item in items:
+        yield encode_event(item_offset, item)
+  finally:
+    await broker.aunsubscribe(thread_id, subscriber)
+
+
+def _read_timeout(coalescer: DeltaCoalescer) -> float:
+  timeout = coalescer.timeout()
+  if timeout is None:
+    return settings.STREAM_HEARTBEAT
+  return min(timeout, settings.STREAM_HEARTBEAT)
+
+
+# no events means the read timed out and the buffered text is due
+def _coalesce_events(coalescer: DeltaCoalescer, events, offset: int):
+  if len(events) == 0:
+    return coalescer.flush(), offset, True
+  items = []
+  for offset, item in events:
+    if item is None:
+      return items + coalescer.flush() + [(offset, None)], offset, False
+    items += coalescer.add(item, offset)
+  return items, offset, True
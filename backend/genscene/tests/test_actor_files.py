@@ -0,0 +1,83 @@
+import io
+from unittest import mock
+
+import httpx
+from django.test import TestCase
+from openai import NotFoundError
+
+from genscene.actor import Actor
+from genscene.models import File
+
+
+class FilesActor(Actor):
+
+    files = {}
+
+    def get_name(self):
+        return 'files'
+
+    def get_description(self):
+        return 'test actor'
+
+    def get_instructions(self):
+        return 'test instructions'
+
+    def get_tools(self):
+        return []
+
+    def get_code_resource_files(self):
+        return {name: io.BytesIO(value) for name, value in self.files.items()}
+
+
+def not_found():
+    request = httpx.Request('DELETE', 'https://api.openai.com/v1/files/file_1')
+    return NotFoundError('No such File object', response=httpx.Response(404, request=request), body=None)
+
+
+class ToolsResourcesTest(TestCase):
+
+    def setUp(self):
+        self.openai_client = mock.Mock()
+        self.uploads = 0
+
+        def upload(file, purpose, timeout):
+            self.uploads += 1
+            return mock.Mock(id=f'file_{self.uploads}')
+
+        self.openai_client.files.create.side_effect = upload
+        self.actor = FilesActor(openai_client=self.openai_client, openai_model='test')
+        self.actor.files = {'schema': b'v1'}
+        self.actor.get_tools_resources()
+
+    def file_ids(self):
+        return dict(File.objects.filter(actor_name='files').values_list('name', 'file_id'))
+
+    def test_failed_upload_after_the_delete_syncs_again(self):
+        self.actor.files = {'schema': b'v2'}
+        self.openai_client.files.create.side_effect = Exception('upload failed')
+        with self.assertRaises(Exception):
+            self.actor.get_tools_resources()
+        # the old file is gone in openai, so is its row
+        self.assertEqual(self.file_ids(), {})
+
+        self.openai_client.files.create.side_effect = lambda file, purpose, timeout: mock.Mock(id='file_2')
+        self.openai_client.files.delete.reset_mock()
+        self.assertEqual(self.actor.get_tools_resources(), {'code_interpreter': {'file_ids': ['file_2']}})
+        self.openai_client.files.delete.assert_not_called()
+        self.assertEqual(self.file_ids(), {'schema': 'file_2'})
+
+    def test_failed_delete_keeps_the_new_upload(self):
+        self.actor.files = {'schema': b'v2', 'other': b'v1'}
+        self.openai_client.files.delete.side_effect = Exception('delete failed')
+        with self.assertRaises(Exception):
+            self.actor.get_tools_resources()
+        self.assertEqual(self.file_ids(), {'schema': 'file_2', 'other': 'file_3'})
+        self.openai_client.files.delete.side_effect = None
+        self.actor.get_tools_resources()
+        self.assertEqual(self.uploads, 3)
+
+    def test_already_deleted_files_count_as_deleted(self):
+        self.actor.files = {}
+        self.openai_client.files.delete.side_effect = not_found()
+        self.assertEqual(self.actor.get_tools_resources(), {'code_interpreter': {'file_ids': []}})
+        self.assertEqual(self.file_ids(), {})
@@ -0,0 +1,62 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from genscene.actor import Actor
+from genscene.actor_lock import ActorLockManager
+from genscene.assistant_registry import ASSISTANT_REGISTRY
+from genscene.models import Assistant
+
+
+class LockedActor(Actor):
+
+    def get_name(self):
+        return 'locked'
+
+    def get_description(self):
+        return 'test actor'
+
+    def get_instructions(self):
+        return 'test instructions'
+
+    def get_tools(self):
+        return []
+
+
+class ActorLockManagerTest(TestCase):
+
+    def test_nested_writes_take_the_database_lock_once(self):
+        locks = ActorLockManager()
+        with mock.patch.object(locks, '_acquire') as acquire, mock.patch.object(locks, '_release') as release:
+            with locks.write('home'):
+                with locks.write('home'):
+                    release.assert_not_called()
+            acquire.assert_called_once_with('home')
+            release.assert_called_once_with('home')
+
+    def test_release_after_errors(self):
+        locks = ActorLockManager()
+        with mock.patch.object(locks, '_acquire'), mock.patch.object(locks, '_release') as release:
+            with self.assertRaises(ValueError):
+                with locks.write('home'):
+                    raise ValueError()
+            release.assert_called_once_with('home')
+
+
+class ActorSyncTest(TestCase):
+
+    def setUp(self):
+        self.openai_client = mock.Mock()
+        self.actor = LockedActor(openai_client=self.openai_client, openai_model='test')
+        self.addCleanup(ASSISTANT_REGISTRY.invalidate, 'locked')
+
+    def test_failed_create_leaves_no_assistant_row(self):
+        self.openai_client.beta.assistants.create.side_effect = Exception('openai is down')
+        with self.assertRaises(Exception):
+            self.actor.get_assistant_id()
+        self.assertFalse(Assistant.objects.filter(actor_name='locked').exists())
+
+    def test_created_assistant_is_stored(self):
+        self.openai_client.beta.assistants.create.return_value = mock.Mock(id='asst_1')
+        self.assertEqual(self.actor.get_assistant_id(), 'asst_1')
+        self.assertEqual(Assistant.objects.get(actor_name='locked').assistant_id, 'asst_1')
@@ -0,0 +1,40 @@
+from django.test import TestCase
+
+from genscene.assistant_registry import AssistantRegistry
+from genscene.models import Assistant
+
+
+class AssistantRegistryTest(TestCase):
+
+    def setUp(self):
+        Assistant.objects.create(actor_name='home', assistant_id='asst_1', instructions='', description='', hash='h')
+
+    def test_lookup_is_cached_within_the_check_interval(self):
+        registry = AssistantRegistry(check_interval=60)
+        registry.register('home', 'asst_1', 0)
+        Assistant.objects.filter(actor_name='home').update(version=5)
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.lookup('home'), 'asst_1')
+
+    def test_invalidate_in_one_worker_reaches_the_others(self):
+        worker = AssistantRegistry(check_interval=0)
+        other_worker = AssistantRegistry(check_interval=0)
+        worker.register('home', 'asst_1', 0)
+        other_worker.register('home', 'asst_1', 0)
+
+        worker.invalidate('home')
+
+        self.assertIsNone(worker.lookup('home'))
+        self.assertIsNone(other_worker.lookup('home'))
+        self.assertEqual(Assistant.objects.get(actor_name='home').version, 1)
+
+    def test_unchanged_row_keeps_the_entry(self):
+        registry = AssistantRegistry(check_interval=0)
+        registry.register('home', 'asst_1', 0)
+        self.assertEqual(registry.lookup('home'), 'asst_1')
+
+    def test_recreated_assistant_is_a_miss(self):
+        registry = AssistantRegistry(check_interval=0)
+        registry.register('home', 'asst_1', 0)
+        Assistant.objects.filter(actor_name='home').update(assistant_id='asst_2')
+        self.assertIsNone(registry.lookup('home'))
@@ -0,0 +1,65 @@
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+from sqlalchemy import Integer, String
+
+from genscene.actors.database_actor import DatabaseActor
+
+
+def column(name, type):
+    return SimpleNamespace(name=name, type=type)
+
+
+# the tables reflect() would find in the database
+TABLES = {
+    'users': [column('id', Integer()), column('name', String(50))],
+    'orders': [column('id', Integer()), column('user_id', Integer())],
+}
+
+
+class FakeMetaData:
+
+    reflected = []
+
+    def reflect(self, bind, only):
+        FakeMetaData.reflected.append(sorted(only))
+        self.tables = {name: SimpleNamespace(columns=TABLES[name]) for name in only}
+
+
+@mock.patch('genscene.actors.database_actor.MetaData', FakeMetaData)
+class SchemaFingerprintTest(SimpleTestCase):
+
+    def setUp(self):
+        FakeMetaData.reflected = []
+        self.actor = DatabaseActor(openai_client=None, openai_model='test')
+        self.fingerprints = {'users': 'users:2:t1:t1', 'orders': 'orders:2:t1:t1'}
+        patcher = mock.patch.object(self.actor, 'get_table_fingerprints', side_effect=lambda: dict(self.fingerprints))
+        self.get_table_fingerprints = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def schema(self):
+        return json.loads(self.actor.get_code_resource_files()['database schema'].getvalue())
+
+    def test_only_changed_tables_are_reflected(self):
+        self.assertEqual(sorted(self.schema()['tables']), ['orders', 'users'])
+        self.fingerprints['orders'] = 'orders:2:t1:t2'
+        self.schema()
+        self.schema()
+        self.assertEqual(FakeMetaData.reflected, [['orders', 'users'], ['orders']])
+
+    def test_dropped_tables_leave_the_schema(self):
+        self.schema()
+        del self.fingerprints['orders']
+        self.assertEqual(list(self.schema()['tables']), ['users'])
+        self.assertEqual(FakeMetaData.reflected, [['orders', 'users']])
+
+    def test_errors_keep_the_last_schema(self):
+        schema = self.schema()
+        self.get_table_fingerprints.side_effect = Exception('database is down')
+        self.assertEqual(self.schema(), schema)
+
+    def test_errors_before_any_schema_return_no_files(self):
+        self.get_table_fingerprints.side_effect = Exception('database is down')
+        self.assertEqual(self.actor.get_code_resource_files(), {})
@@ -0,0 +1,55 @@
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import SimpleTestCase
+
+from genscene.image_cache import ImageCache
+
+
+class ImageCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+
+    def test_concurrent_misses_fetch_once(self):
+        cache = ImageCache(self.cache_dir.name, memory_bytes=1024, disk_bytes=1024)
+        fetches = []
+        lock = threading.Lock()
+
+        def fetch():
+            with lock:
+                fetches.append(1)
+            time.sleep(0.1)
+            return b'png'
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: cache.get_or_fetch('file_1', fetch), range(8)))
+        self.assertEqual(results, [b'png'] * 8)
+        self.assertEqual(len(fetches), 1)
+
+    def test_failed_fetch_is_retried_by_the_next_caller(self):
+        cache = ImageCache(None, memory_bytes=1024, disk_bytes=0)
+
+        def fail():
+            raise IOError('openai is down')
+
+        with self.assertRaises(IOError):
+            cache.get_or_fetch('file_1', fail)
+        self.assertEqual(cache.get_or_fetch('file_1', lambda: b'png'), b'png')
+
+    def test_disk_tier_survives_a_restart(self):
+        ImageCache(self.cache_dir.name, memory_bytes=1024, disk_bytes=1024).put('file_1', b'png')
+        restarted = ImageCache(self.cache_dir.name, memory_bytes=1024, disk_bytes=1024)
+        self.assertEqual(restarted.get('file_1'), b'png')
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        cache = ImageCache(None, memory_bytes=6, disk_bytes=0)
+        cache.put('file_1', b'aaa')
+        cache.put('file_2', b'bbb')
+        cache.get('file_1')
+        cache.put('file_3', b'ccc')
+        self.assertIsNone(cache.get('file_2'))
+        self.assertEqual(cache.get('file_1'), b'aaa')
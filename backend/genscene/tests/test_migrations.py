@@ -0,0 +1,87 @@
+import json
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+# runs the migrations up to the targets and back to the latest afterwards
+class MigrationTestCase(TransactionTestCase):
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+
+class RemoveDuplicatesMigrationTest(MigrationTestCase):
+
+    before = [('genscene', '0004_message_thread_synced_at')]
+    after = [('genscene', '0005_thread_file_indexes')]
+
+    def test_duplicates_are_removed_before_the_unique_constraints(self):
+        apps = self.migrate(self.before)
+        File = apps.get_model('genscene', 'File')
+        Thread = apps.get_model('genscene', 'Thread')
+        File.objects.create(actor_name='database', name='schema', file_id='file_old', hash='1')
+        File.objects.create(actor_name='database', name='schema', file_id='file_new', hash='2')
+        File.objects.create(actor_name='home', name='schema', file_id='file_home', hash='3')
+        first = Thread.objects.create(thread_id='thread_1', user_id='alice', name='first')
+        Thread.objects.create(thread_id='thread_1', user_id='alice', name='second')
+
+        apps = self.migrate(self.after)
+        File = apps.get_model('genscene', 'File')
+        Thread = apps.get_model('genscene', 'Thread')
+        self.assertEqual(sorted(File.objects.values_list('actor_name', 'file_id')),
+                         [('database', 'file_new'), ('home', 'file_home')])
+        self.assertEqual(list(Thread.objects.values_list('id', 'name')), [(first.id, 'first')])
+
+
+class RecordImagesMigrationTest(MigrationTestCase):
+
+    before = [('genscene', '0006_assistant_version')]
+    after = [('genscene', '0007_messageimage')]
+
+    def test_images_of_stored_messages_are_recorded(self):
+        apps = self.migrate(self.before)
+        Message = apps.get_model('genscene', 'Message')
+        Message.objects.create(message_id='msg_1', thread_id='thread_1', role='assistant', created_at=1, content=json.dumps([
+            {'type': 'text', 'role': 'assistant', 'value': 'a chart'},
+            {'type': 'image_file', 'role': 'assistant', 'value': '/api/images/file_1/?actor=database'},
+        ]))
+        Message.objects.create(message_id='msg_2', thread_id='thread_2', role='assistant', created_at=2, content=json.dumps([
+            {'type': 'image_file', 'role': 'assistant', 'value': '/api/images/file_2/'},
+        ]))
+        Message.objects.create(message_id='msg_3', thread_id='thread_2', role='user', created_at=3, content=json.dumps([
+            {'type': 'text', 'role': 'user', 'value': 'what is /api/images/file_3/ about'},
+        ]))
+
+        apps = self.migrate(self.after)
+        MessageImage = apps.get_model('genscene', 'MessageImage')
+        self.assertEqual(sorted(MessageImage.objects.values_list('file_id', 'thread_id', 'message_id')),
+                         [('file_1', 'thread_1', 'msg_1'), ('file_2', 'thread_2', 'msg_2')])
+
+
+class MoveActorToImagesMigrationTest(MigrationTestCase):
+
+    before = [('genscene', '0007_messageimage')]
+    after = [('genscene', '0008_messageimage_actor')]
+
+    def test_actor_query_moves_to_the_image_rows(self):
+        apps = self.migrate(self.before)
+        Message = apps.get_model('genscene', 'Message')
+        MessageImage = apps.get_model('genscene', 'MessageImage')
+        Message.objects.create(message_id='msg_1', thread_id='thread_1', role='assistant', created_at=1, content=json.dumps([
+            {'type': 'image_file', 'role': 'assistant', 'value': '/api/images/file_1/?actor=database'},
+        ]))
+        MessageImage.objects.create(file_id='file_1', thread_id='thread_1', message_id='msg_1')
+
+        apps = self.migrate(self.after)
+        Message = apps.get_model('genscene', 'Message')
+        MessageImage = apps.get_model('genscene', 'MessageImage')
+        self.assertEqual(json.loads(Message.objects.get(message_id='msg_1').content)[0]['value'], '/api/images/file_1/')
+        self.assertEqual(MessageImage.objects.get(message_id='msg_1').actor, 'database')
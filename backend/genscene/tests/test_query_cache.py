@@ -0,0 +1,38 @@
+from django.test import SimpleTestCase
+
+from genscene.query_cache import QueryCache
+
+
+class NormalizeTest(SimpleTestCase):
+
+    def test_folds_whitespace_and_keywords(self):
+        self.assertEqual(QueryCache.normalize("SELECT  name\n FROM people WHERE id = 1;"),
+                         "select name from people where id = 1")
+
+    def test_keeps_identifiers_and_literals(self):
+        self.assertEqual(QueryCache.normalize("SELECT Name FROM People WHERE city = 'New York'"),
+                         "select Name from People where city = 'New York'")
+        self.assertNotEqual(QueryCache.normalize("SELECT * FROM People"), QueryCache.normalize("SELECT * FROM people"))
+
+    def test_only_single_selects_are_cacheable(self):
+        self.assertTrue(QueryCache.is_cacheable(QueryCache.normalize("SELECT * FROM people")))
+        self.assertFalse(QueryCache.is_cacheable(QueryCache.normalize("SELECT * FROM people FOR UPDATE")))
+        self.assertFalse(QueryCache.is_cacheable(QueryCache.normalize("SELECT 1; DROP TABLE people")))
+        self.assertFalse(QueryCache.is_cacheable(QueryCache.normalize("DELETE FROM people")))
+
+
+class QueryCacheTest(SimpleTestCase):
+
+    def test_stats_count_hits_and_misses(self):
+        cache = QueryCache(ttl=60, max_entries=1)
+        sql = QueryCache.normalize("SELECT * FROM People")
+        self.assertIsNone(cache.get(sql))
+        cache.put(sql, '{}')
+        self.assertEqual(cache.get(sql), '{}')
+        cache.put(QueryCache.normalize("SELECT * FROM orders"), '{}')
+        self.assertEqual(cache.stats(), {'entries': 1, 'hits': 1, 'misses': 1, 'evictions': 1})
+
+    def test_invalidate_ignores_table_name_case(self):
+        cache = QueryCache(ttl=60, max_entries=10)
+        cache.put(QueryCache.normalize("SELECT * FROM People"), '{}')
+        self.assertEqual(cache.invalidate(['people']), 1)
@@ -0,0 +1,202 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from genscene.return_message import ReturnItem
+from genscene.stream_broker import InMemoryStreamBroker, RedisStreamBroker
+
+
+def text(value):
+    return ReturnItem.from_text('text', 'assistant', value)
+
+
+def summary(events):
+    return [(offset, None if item is None else (item.type, item.value)) for offset, item in events]
+
+
+class InMemoryStreamBrokerTest(SimpleTestCase):
+
+    def publish(self, broker, values):
+        broker.start('thread_1')
+        for value in values:
+            broker.publish('thread_1', text(value))
+
+    def test_replay_from_any_offset(self):
+        broker = InMemoryStreamBroker(retention=60, max_events=100)
+        self.publish(broker, ['a', 'b', 'c'])
+        broker.close('thread_1')
+        self.assertEqual(summary(broker.read('thread_1', 1)), [(2, ('text', 'b')), (3, ('text', 'c')), (4, None)])
+        self.assertEqual(summary(broker.read('thread_1', 4)), [(4, None)])
+
+    def test_new_run_keeps_counting_offsets(self):
+        broker = InMemoryStreamBroker(retention=60, max_events=100)
+        self.publish(broker, ['a'])
+        broker.close('thread_1')
+        broker.start('thread_1')
+        self.assertEqual(broker.publish('thread_1', text('b')), 3)
+
+    def test_drop_policy_gives_late_readers_a_gap(self):
+        broker = InMemoryStreamBroker(retention=60, max_events=4, overflow_policy='drop')
+        self.publish(broker, ['a', 'b', 'c', 'd', 'e'])
+        events = broker.read('thread_1', 0)
+        self.assertEqual(events[0][1].type, 'gap')
+        self.assertEqual(events[-1][1].value, 'e')
+        self.assertEqual(broker.stats()['dropped'], 2)
+
+    def test_coalesce_policy_keeps_the_text(self):
+        broker = InMemoryStreamBroker(retention=60, max_events=10, overflow_policy='coalesce')
+        self.publish(broker, list('abcdefghijk'))
+        events = broker.read('thread_1', 0)
+        self.assertLessEqual(len(events), 10)
+        self.assertEqual(''.join(item.value for _, item in events), 'abcdefghijk')
+        self.assertGreater(broker.stats()['coalesced'], 0)
+        self.assertEqual(broker.stats()['dropped'], 0)
+
+    def test_byte_limit(self):
+        broker = InMemoryStreamBroker(retention=60, max_events=100, max_bytes=1000, overflow_policy='drop')
+        self.publish(broker, ['x' * 400, 'y' * 400, 'z' * 400])
+        self.assertLessEqual(broker.stats()['bytes'], 1000)
+        self.assertEqual(broker.read('thread_1', 0)[0][1].type, 'gap')
+
+
+# just enough of redis-py for the broker, trimming to maxlen exactly
+class FakeRedis:
+
+    def __init__(self):
+        self.streams = {}
+        self.values = {}
+        self.round_trips = 0
+
+    def delete(self, key):
+        self.streams.pop(key, None)
+        self.values.pop(key, None)
+
+    def expire(self, key, seconds):
+        pass
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def incr(self, key):
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+    def decr(self, key):
+        self.values[key] = self.values.get(key, 0) - 1
+        return self.values[key]
+
+    def xadd(self, key, fields, id, maxlen=None, approximate=True):
+        entries = self.streams.setdefault(key, [])
+        entries.append((id.encode(), {name.encode(): value.encode() for name, value in fields.items()}))
+        if maxlen is not None:
+            del entries[:-maxlen]
+
+    def xread(self, streams, block=None):
+        response = []
+        for key, last_id in streams.items():
+            last = int(last_id.split('-')[1])
+            entries = [entry for entry in self.streams.get(key, []) if int(entry[0].split(b'-')[1]) > last]
+            if entries:
+                response.append((key.encode(), entries))
+        return response
+
+    def xrevrange(self, key, count=None):
+        return list(reversed(self.streams.get(key, [])))[:count]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+# queues the commands until execute, like a redis-py pipeline
+class FakePipeline:
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        self.redis.round_trips += 1
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+# the redis.asyncio interface over the same fake data
+class AsyncFakeRedis:
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def pipeline(self, transaction=True):
+        pipeline = FakePipeline(self.redis)
+        execute = pipeline.execute
+
+        async def aexecute():
+            return execute()
+        pipeline.__dict__['execute'] = aexecute
+        return pipeline
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class RedisStreamBrokerTest(SimpleTestCase):
+
+    def setUp(self):
+        self.broker = RedisStreamBroker(FakeRedis(), retention=60, max_events=3)
+        self.broker.start('thread_1')
+
+    def test_replay_skips_the_start_marker(self):
+        self.broker.publish('thread_1', text('a'))
+        self.broker.close('thread_1')
+        self.assertEqual(summary(self.broker.read('thread_1', 0)), [(2, ('text', 'a')), (3, None)])
+        self.assertEqual(summary(self.broker.read('thread_1', 3)), [(3, None)])
+
+    def test_readers_behind_the_trimmed_events_get_a_gap(self):
+        for value in ['a', 'b', 'c', 'd', 'e']:
+            self.broker.publish('thread_1', text(value))
+        self.assertEqual(summary(self.broker.read('thread_1', 0)),
+                         [(3, ('gap', '')), (4, ('text', 'c')), (5, ('text', 'd')), (6, ('text', 'e'))])
+        self.assertEqual(summary(self.broker.read('thread_1', 4)), [(5, ('text', 'd')), (6, ('text', 'e'))])
+
+    def test_publish_is_one_round_trip(self):
+        round_trips = self.broker.client.round_trips
+        self.broker.publish('thread_1', text('a'))
+        self.assertEqual(self.broker.client.round_trips, round_trips + 1)
+
+
+# any call on the sync client fails the test
+class NoSyncRedis:
+
+    def __getattr__(self, name):
+        raise AssertionError(f"sync redis call on the event loop: {name}")
+
+
+class AsyncRedisStreamBrokerTest(SimpleTestCase):
+
+    def setUp(self):
+        redis = FakeRedis()
+        self.broker = RedisStreamBroker(NoSyncRedis(), retention=60, max_events=100,
+                                        async_client=AsyncFakeRedis(redis))
+        self.redis = redis
+
+    def test_async_run_never_uses_the_sync_client(self):
+        async def run():
+            await self.broker.astart('thread_1')
+            subscriber = await self.broker.asubscribe('thread_1')
+            await self.broker.apublish('thread_1', text('a'))
+            await self.broker.apublish('thread_1', None)
+            events = await self.broker.aread('thread_1', 0, timeout=1, subscriber=subscriber)
+            await self.broker.aunsubscribe('thread_1', subscriber)
+            return events
+
+        self.assertEqual(summary(asyncio.run(run())), [(2, ('text', 'a')), (3, None)])
+        self.assertEqual(self.redis.values, {})
@@ -0,0 +1,98 @@
+import json
+
+from django.test import SimpleTestCase, override_settings
+
+from genscene.return_message import ReturnItem
+from genscene.stream_broker import InMemoryStreamBroker
+from genscene.streaming import FlushPolicy, DeltaCoalescer, encode_event, stream_events, HEARTBEAT_EVENT
+
+
+def text(value):
+    return ReturnItem.from_text('text', 'assistant', value)
+
+
+def parse_events(chunks):
+    events = []
+    for chunk in chunks:
+        if chunk == HEARTBEAT_EVENT:
+            continue
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+        events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+class FlushPolicyTest(SimpleTestCase):
+
+    def test_defaults_coalesce(self):
+        policy = FlushPolicy.from_request({})
+        self.assertEqual(policy.max_tokens, 32)
+        self.assertEqual(policy.max_latency_ms, 100)
+        self.assertIsNone(policy.max_bytes)
+
+    def test_request_overrides(self):
+        policy = FlushPolicy.from_request({'buffer_size': 10, 'buffer_bytes': 64, 'buffer_ms': 0})
+        self.assertEqual((policy.max_tokens, policy.max_bytes, policy.max_latency_ms), (10, 64, 0))
+
+
+class DeltaCoalescerTest(SimpleTestCase):
+
+    def test_flushes_at_max_tokens_with_the_last_offset(self):
+        coalescer = DeltaCoalescer(FlushPolicy(max_tokens=3, max_latency_ms=None))
+        self.assertEqual(coalescer.add(text('a'), 1), [])
+        self.assertEqual(coalescer.add(text('b'), 2), [])
+        [(offset, item)] = coalescer.add(text('c'), 3)
+        self.assertEqual((offset, item.value), (3, 'abc'))
+
+    def test_flushes_at_max_bytes(self):
+        coalescer = DeltaCoalescer(FlushPolicy(max_tokens=100, max_bytes=4, max_latency_ms=None))
+        self.assertEqual(coalescer.add(text('ab'), 1), [])
+        [(offset, item)] = coalescer.add(text('cd'), 2)
+        self.assertEqual(item.value, 'abcd')
+
+    def test_other_items_flush_buffered_text_first(self):
+        coalescer = DeltaCoalescer(FlushPolicy(max_tokens=100, max_latency_ms=None))
+        coalescer.add(text('a'), 1)
+        image = ReturnItem.from_text('image_file', 'assistant', '/api/images/file_1/')
+        events = coalescer.add(image, 2)
+        self.assertEqual([(offset, item.type) for offset, item in events], [(1, 'text'), (2, 'image_file')])
+
+    def test_timeout_follows_the_latency_limit(self):
+        coalescer = DeltaCoalescer(FlushPolicy(max_tokens=100, max_latency_ms=100))
+        self.assertIsNone(coalescer.timeout())
+        coalescer.add(text('a'), 1)
+        self.assertLessEqual(coalescer.timeout(), 0.1)
+
+
+class EncodeEventTest(SimpleTestCase):
+
+    def test_sse_framing(self):
+        self.assertEqual(encode_event(7, text('hi')),
+                         'id: 7\nevent: delta\ndata: {"type":"text","role":"assistant","value":"hi"}\n\n')
+        self.assertEqual(encode_event(8, None), 'id: 8\nevent: done\ndata: {}\n\n')
+        self.assertIn('event: gap\n', encode_event(9, ReturnItem.from_text('gap', 'assistant', '')))
+
+
+@override_settings(STREAM_HEARTBEAT=1)
+class StreamEventsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.broker = InMemoryStreamBroker(retention=60, max_events=100)
+        self.broker.start('thread_1')
+        for value in ['a', 'b', 'c']:
+            self.broker.publish('thread_1', text(value))
+        self.broker.close('thread_1')
+
+    def test_replays_a_finished_run(self):
+        events = parse_events(stream_events(self.broker, 'thread_1', 0, FlushPolicy(max_tokens=1)))
+        self.assertEqual([(event, data.get('value')) for _, event, data in events],
+                         [('delta', 'a'), ('delta', 'b'), ('delta', 'c'), ('done', None)])
+        self.assertEqual([offset for offset, _, _ in events], sorted(offset for offset, _, _ in events))
+
+    def test_resumes_after_the_last_event_id(self):
+        events = parse_events(stream_events(self.broker, 'thread_1', 0, FlushPolicy(max_tokens=1)))
+        resumed = parse_events(stream_events(self.broker, 'thread_1', events[0][0], FlushPolicy(max_tokens=1)))
+        self.assertEqual(resumed, events[1:])
+
+    def test_unsubscribes_when_done(self):
+        list(stream_events(self.broker, 'thread_1', 0))
+        self.assertEqual(self.broker.subscribers('thread_1'), 0)
@@ -0,0 +1,96 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from openai.types.beta.threads import Message
+
+from genscene.models import Message as StoredMessage, Thread
+from genscene.user_thread import UserThread
+
+
+def openai_message(message_id, created_at, value, role='assistant'):
+    return Message.model_validate({
+        'id': message_id, 'object': 'thread.message', 'created_at': created_at,
+        'thread_id': 'thread_1', 'role': role, 'status': 'completed', 'attachments': [],
+        'content': [{'type': 'text', 'text': {'value': value, 'annotations': []}}],
+    })
+
+
+class FakeMessages:
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.calls = []
+
+    def list(self, thread_id, order, limit, after=None):
+        self.calls.append(after)
+        ids = [message.id for message in self.messages]
+        start = ids.index(after) + 1 if after is not None else 0
+        return self.messages[start:]
+
+
+class SyncMessagesTest(TestCase):
+
+    def setUp(self):
+        self.remote = FakeMessages([
+            openai_message('msg_1', 1, 'earlier question', role='user'),
+            openai_message('msg_2', 2, 'earlier answer'),
+            openai_message('msg_3', 3, 'new question', role='user'),
+        ])
+        client = mock.Mock()
+        client.beta.threads.messages = self.remote
+        patcher = mock.patch('genscene.apps.GensceneConfig.get_client', return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.thread = Thread.objects.create(thread_id='thread_1', user_id='alice', name='')
+        # the message sent through this server is stored before any sync
+        UserThread.store_message(self.remote.messages[2])
+
+    def values(self):
+        return [item.value for item in UserThread('alice', 'thread_1').get_messages().items]
+
+    def test_first_sync_reads_the_whole_thread(self):
+        self.assertEqual(self.values(), ['earlier question', 'earlier answer', 'new question'])
+        self.assertEqual(self.remote.calls, [None])
+        self.assertIsNotNone(Thread.objects.get(thread_id='thread_1').synced_at)
+
+    @override_settings(MESSAGE_STORE_TTL=60)
+    def test_later_syncs_start_after_the_last_local_message(self):
+        UserThread('alice', 'thread_1').sync_messages()
+        self.remote.messages.append(openai_message('msg_4', 4, 'new answer'))
+        Thread.objects.filter(thread_id='thread_1').update(synced_at=timezone.now() - timedelta(seconds=120))
+
+        self.assertEqual(self.values()[-1], 'new answer')
+        self.assertEqual(self.remote.calls, [None, 'msg_3'])
+
+    @override_settings(MESSAGE_STORE_TTL=60)
+    def test_fresh_threads_are_not_synced(self):
+        Thread.objects.filter(thread_id='thread_1').update(synced_at=timezone.now())
+        self.assertEqual(self.values(), ['new question'])
+        self.assertEqual(self.remote.calls, [])
+
+
+class MessagePageTest(TestCase):
+
+    def setUp(self):
+        Thread.objects.create(thread_id='thread_1', user_id='alice', name='', synced_at=timezone.now())
+        for index in range(5):
+            UserThread.store_message(openai_message(f'msg_{index}', index, f'message {index}'))
+        self.user_thread = UserThread('alice', 'thread_1')
+
+    def test_latest_page_then_older_pages(self):
+        page = self.user_thread.get_message_page(limit=2)
+        self.assertEqual([item.value for item in page.messages.items], ['message 3', 'message 4'])
+        self.assertTrue(page.has_more)
+
+        older = self.user_thread.get_message_page(limit=2, before=page.first_id)
+        self.assertEqual([item.value for item in older.messages.items], ['message 1', 'message 2'])
+
+        oldest = self.user_thread.get_message_page(limit=2, before=older.first_id)
+        self.assertEqual([item.value for item in oldest.messages.items], ['message 0'])
+        self.assertFalse(oldest.has_more)
+
+    def test_newer_pages(self):
+        page = self.user_thread.get_message_page(limit=3, after='msg_0')
+        self.assertEqual((page.first_id, page.last_id, page.has_more), ('msg_1', 'msg_3', True))
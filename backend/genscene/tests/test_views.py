@@ -0,0 +1,68 @@
+import json
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from openai.types.beta.threads import Message
+
+from genscene.models import Message as StoredMessage, MessageImage, Thread
+from genscene.return_message import ReturnItem
+from genscene.user_thread import UserThread
+
+PNG = b'\x89PNG\r\n\x1a\n'
+
+
+class ImageViewTest(TestCase):
+
+    def setUp(self):
+        Thread.objects.create(thread_id='thread_1', user_id='alice', name='')
+        UserThread.store_message(Message.model_validate({
+            'id': 'msg_1', 'object': 'thread.message', 'created_at': 1,
+            'thread_id': 'thread_1', 'role': 'assistant', 'status': 'completed', 'attachments': [],
+            'content': [{'type': 'image_file', 'image_file': {'file_id': 'file_1'}}],
+        }), actor='database')
+        self.url = reverse('genscene:images', args=['file_1'])
+        patcher = mock.patch.object(ReturnItem, 'load_image_bytes', return_value=PNG)
+        self.load_image_bytes = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_serves_an_image_of_the_users_messages(self):
+        response = self.client.get(self.url, {'user': 'alice'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, PNG)
+
+    def test_store_message_records_the_image_once(self):
+        UserThread.store_message(Message.model_validate({
+            'id': 'msg_1', 'object': 'thread.message', 'created_at': 1,
+            'thread_id': 'thread_1', 'role': 'assistant', 'status': 'completed', 'attachments': [],
+            'content': [{'type': 'image_file', 'image_file': {'file_id': 'file_1'}}],
+        }))
+        self.assertEqual(list(MessageImage.objects.values_list('file_id', 'thread_id', 'message_id')),
+                         [('file_1', 'thread_1', 'msg_1')])
+        stored = StoredMessage.objects.get(message_id='msg_1')
+        self.assertEqual([item['value'] for item in json.loads(stored.content)], [self.url])
+
+    def test_image_fetch_is_tagged_with_the_stored_actor(self):
+        response = self.client.get(self.url, {'user': 'alice', 'actor': 'spoofed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.load_image_bytes.call_args.kwargs['actor'], 'database')
+
+    def test_unknown_stored_actors_are_not_tagged(self):
+        MessageImage.objects.update(actor='removed')
+        self.client.get(self.url, {'user': 'alice'})
+        self.assertEqual(self.load_image_bytes.call_args.kwargs['actor'], '')
+
+    def test_other_users_and_unknown_files_are_not_found(self):
+        self.assertEqual(self.client.get(self.url, {'user': 'bob'}).status_code, 404)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        other = reverse('genscene:images', args=['file_2'])
+        self.assertEqual(self.client.get(other, {'user': 'alice'}).status_code, 404)
+        self.load_image_bytes.assert_not_called()
+
+    def test_not_modified_only_for_known_files(self):
+        response = self.client.get(self.url, {'user': 'alice'}, HTTP_IF_NONE_MATCH='"file_1"')
+        self.assertEqual(response.status_code, 304)
+        other = reverse('genscene:images', args=['file_2'])
+        response = self.client.get(other, {'user': 'alice'}, HTTP_IF_NONE_MATCH='"file_2"')
+        self.assertEqual(response.status_code, 404)
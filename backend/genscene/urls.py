@@ -1,6 +1,6 @@
 from django.urls import path
 
-from .views import ThreadListView, ThreadDetailView, ActorListView, ChatView, ActorDetailView
+from .views import ThreadListView, ThreadDetailView, ActorListView, ChatView, AsyncChatView, ChatStreamView, ActorDetailView, ImageView
 
 app_name = "actors-api"
 urlpatterns = [
@@ -9,4 +9,7 @@ urlpatterns = [
     path("actors/", ActorListView.as_view(), name='actors'),
     path("actors/<str:name>/", ActorDetailView.as_view(), name='actors'),
     path("chat/", ChatView.as_view(), name='chat'),
+    path("chat/async/", AsyncChatView.as_view(), name='chat-async'),
+    path("chat/stream/<str:thread_id>/", ChatStreamView.as_view(), name='chat-stream'),
+    path("images/<str:file_id>/", ImageView.as_view(), name='images'),
 ]
\ No newline at end of file
@@ -1,14 +1,54 @@
-from typing import List
+from typing import Dict, Iterator, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from django.apps import apps as proj_apps
-from django.db import transaction
+from django.conf import settings
+from django.db import transaction, connections
+from django.db.models import Q
+from django.db.models.functions import Trim
+from django.utils import timezone
+from datetime import timedelta
+import json
 from openai.types.beta.threads import Message
 import base64
 import logging
-from .return_message import ReturnMessage
+import threading
+from .return_message import ReturnMessage, ReturnItem, MessagePage
 
 LOGGER = logging.getLogger(__name__)
 DEFAULT_NAME = "New Thread"
 
+
+#
+# Named Threads
+#
+# Ids of the threads this process has seen named, so naming a thread costs a
+# database write on its first message only. Bounded, the oldest ids are
+# forgotten first (and just cost one more conditional update)
+#
+class NamedThreads:
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self.max_size = max_size
+        self._thread_ids: OrderedDict[str, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, thread_id: str) -> bool:
+        return thread_id in self._thread_ids
+
+    def add(self, thread_id: str) -> None:
+        with self._lock:
+            self._thread_ids[thread_id] = None
+            while len(self._thread_ids) > self.max_size:
+                self._thread_ids.popitem(last=False)
+
+    def discard(self, thread_id: str) -> None:
+        with self._lock:
+            self._thread_ids.pop(thread_id, None)
+
+
+NAMED_THREADS = NamedThreads()
+
 class UserThread:
 
     # if thread_id is none: get the current thread or create one if necessary
@@ -21,6 +61,14 @@ class UserThread:
             
             openai_client = proj_apps.get_app_config('genscene').get_client()
             from .models import Thread
+            # most users already have a current thread, only creating one needs the write lock
+            current_thread_id = Thread.objects.filter(
+                user_id=self.user_id,
+                current=True
+            ).values_list('thread_id', flat=True).first()
+            if current_thread_id is not None:
+                self.thread_id = current_thread_id
+                return
             try:
                 with transaction.atomic():
                     existing_thread = Thread.objects.select_for_update().filter(
@@ -37,6 +85,7 @@ class UserThread:
                             user_id=self.user_id,
                             name=DEFAULT_NAME,
                             current=True,
+                            synced_at=timezone.now(),
                         )
                         LOGGER.info(f"Thread: user[{self.user_id}]: lazy init thread in openai: {thread.id}")
                         self.thread_id = thread.id
@@ -51,10 +100,12 @@ class UserThread:
         from .models import Thread
 
         openai_thread = openai_client.beta.threads.create()
+        # a new openai thread is empty, so there is nothing to sync yet
         new_thread = Thread.objects.create(
             thread_id=openai_thread.id,
             user_id=user_id,
             name=DEFAULT_NAME,
+            synced_at=timezone.now(),
         )
         LOGGER.info(f"Thread: user[{user_id}]: created thread in openai: {openai_thread.id}")
         return new_thread
@@ -73,46 +124,167 @@ class UserThread:
                 openai_client = proj_apps.get_app_config('genscene').get_client()
                 openai_client.beta.threads.delete(self.thread_id)
                 existing_thread.delete()
+                NAMED_THREADS.discard(self.thread_id)
+                from .models import Message as StoredMessage, MessageImage
+                StoredMessage.objects.filter(thread_id=self.thread_id).delete()
+                MessageImage.objects.filter(thread_id=self.thread_id).delete()
                 return True
             else:
                 raise Exception(f"Thread: user[{self.user_id}]: could not delete thread")
         
+    # only unnamed threads get a name, which is a single conditional update. Once
+    # a thread is known to be named this process does not touch the database for it
     def set_name (self, name):
-        # for now - only set if it is not already set
         from .models import Thread
-        with transaction.atomic():
-            thread = Thread.objects.select_for_update().filter(
+        if self.thread_id in NAMED_THREADS:
+            return
+        updated = Thread.objects.filter(
+            thread_id=self.thread_id
+        ).alias(
+            trimmed_name=Trim('name')
+        ).filter(
+            Q(name=DEFAULT_NAME) | Q(trimmed_name="")
+        ).update(name=name)
+        if updated == 0 and not Thread.objects.filter(thread_id=self.thread_id).exists():
+            raise Exception('Thread does not exist')
+        NAMED_THREADS.add(self.thread_id)
+
+
+    # fetch the messages of several threads in parallel with at most max_workers
+    # requests to openai in flight, returns thread_id -> ReturnMessage
+    @staticmethod
+    def get_messages_for_threads (user_id, thread_ids: List[str], max_workers: int = 4) -> Dict[str, ReturnMessage]:
+        if len(thread_ids) == 0:
+            return {}
+
+        def get_messages (thread_id):
+            try:
+                return UserThread(user_id=user_id, thread_id=thread_id).get_messages()
+            finally:
+                # pool threads are not request threads so django does not close their connections
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(thread_ids)))) as executor:
+            return dict(zip(thread_ids, executor.map(get_messages, thread_ids)))
+
+    # save (or replace) the local copy of an openai message
+    @staticmethod
+    def store_message (message: Message, actor: str = ''):
+        from .models import Message as StoredMessage, MessageImage
+        openai_client = proj_apps.get_app_config('genscene').get_client()
+        items = [ReturnItem.from_message_content(message.role, openai_client, item) 
+                 for item in message.content]
+        StoredMessage.objects.update_or_create(
+            message_id=message.id,
+            defaults={
+                'thread_id': message.thread_id,
+                'role': message.role,
+                'content': json.dumps([item.model_dump() for item in items]),
+                'created_at': message.created_at,
+            }
+        )
+        images = [MessageImage(file_id=item.image_file.file_id, thread_id=message.thread_id, message_id=message.id,
+                               actor=actor)
+                  for item in message.content if item.type == 'image_file']
+        if len(images) > 0:
+            MessageImage.objects.bulk_create(images, ignore_conflicts=True)
+
+    # pull any messages newer than the last local one from openai, this is skipped
+    # when the thread was synced less than MESSAGE_STORE_TTL seconds ago. A thread
+    # that was never synced is read in full, its local messages may only be the
+    # ones sent through this server and not the earlier history
+    def sync_messages (self, force=False):
+        from .models import Thread, Message as StoredMessage
+        thread = Thread.objects.filter(thread_id=self.thread_id).first()
+        stale_before = timezone.now() - timedelta(seconds=settings.MESSAGE_STORE_TTL)
+        if (not force and thread is not None and 
+            thread.synced_at is not None and thread.synced_at > stale_before):
+            return
+
+        openai_client = proj_apps.get_app_config('genscene').get_client()
+        params = {'thread_id': self.thread_id, 'order': 'asc', 'limit': 100}
+        if thread is not None and thread.synced_at is not None:
+            last_message = StoredMessage.objects.filter(
                 thread_id=self.thread_id
-            )
-            if thread.exists():
-                existingName = thread.first().name
-                if ((existingName == DEFAULT_NAME) or
-                    (existingName.strip() == "")):
-                    thread.update(name=name)
+            ).order_by('-created_at', '-id').first()
+            if last_message is not None:
+                params['after'] = last_message.message_id
+        count = 0
+        for message in openai_client.beta.threads.messages.list(**params):
+            UserThread.store_message(message)
+            count += 1
+        Thread.objects.filter(thread_id=self.thread_id).update(synced_at=timezone.now())
+        LOGGER.debug(f"Thread: user[{self.user_id}]: synced {count} messages for thread {self.thread_id}")
+
+    def get_messages (self, last_only=False):   
+        from .models import Message as StoredMessage
+        self.sync_messages()
+        messages = StoredMessage.objects.filter(thread_id=self.thread_id)
+
+        # Get all the messages after the last user message
+        if last_only:
+            last_user_message = messages.filter(role="user").order_by('-created_at', '-id').first()
+            if last_user_message is not None:
+                messages = messages.filter(self._newer_than(last_user_message))
+
+        return self._to_return_message(messages.order_by('created_at', 'id'))
+
+    # Page through the thread newest first. With no cursor this is the latest
+    # page, before=<message_id> gives the older messages and after=<message_id>
+    # the newer ones. Pages are only read from the database when iterated
+    def iter_message_pages (self, limit=20, before=None, after=None) -> Iterator[MessagePage]:
+        self.sync_messages()
+        page = self._message_page(limit=limit, before=before, after=after)
+        yield page
+        while page.has_more:
+            if after is not None:
+                page = self._message_page(limit=limit, after=page.last_id)
             else:
-                raise Exception('Thread does not exist')
+                page = self._message_page(limit=limit, before=page.first_id)
+            yield page
 
+    def get_message_page (self, limit=20, before=None, after=None) -> MessagePage:
+        return next(self.iter_message_pages(limit=limit, before=before, after=after))
 
-    def get_messages (self, last_only=False):   
-        config = proj_apps.get_app_config('genscene')
-        openai_client = config.get_client()
-        messages: List[Message] = openai_client.beta.threads.messages.list(
-            thread_id=self.thread_id
+    def _message_page (self, limit, before=None, after=None) -> MessagePage:
+        from .models import Message as StoredMessage
+        messages = StoredMessage.objects.filter(thread_id=self.thread_id)
+        if before is not None:
+            cursor = StoredMessage.objects.get(thread_id=self.thread_id, message_id=before)
+            messages = messages.filter(self._older_than(cursor))
+        if after is not None:
+            cursor = StoredMessage.objects.get(thread_id=self.thread_id, message_id=after)
+            messages = messages.filter(self._newer_than(cursor))
+
+        # read one extra row to know if there is another page
+        if after is not None:
+            rows = list(messages.order_by('created_at', 'id')[:limit + 1])
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        else:
+            rows = list(messages.order_by('-created_at', '-id')[:limit + 1])
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            rows.reverse()
+
+        return MessagePage(
+            messages=self._to_return_message(rows),
+            first_id=rows[0].message_id if len(rows) > 0 else None,
+            last_id=rows[-1].message_id if len(rows) > 0 else None,
+            has_more=has_more,
         )
 
-        # Get all the messages till the last user message
-        message_list: List[Message] = []
-        for message in messages.data:
-            # dont include the original request
-            if (last_only and message.role == "user"):
-                break
-            message_list.append(message)
+    def _older_than (self, message) -> Q:
+        return Q(created_at__lt=message.created_at) | Q(created_at=message.created_at, id__lt=message.id)
 
-        # Reverse the messages to show the last user message first
-        message_list.reverse()
+    def _newer_than (self, message) -> Q:
+        return Q(created_at__gt=message.created_at) | Q(created_at=message.created_at, id__gt=message.id)
 
-        # Print the user or Assistant messages or images
-        return ReturnMessage.from_message_list(openai_client=openai_client, messages=message_list)
+    def _to_return_message (self, messages) -> ReturnMessage:
+        return_messages = ReturnMessage(items=[])
+        for message in messages:
+            return_messages.items.extend(ReturnItem(**item) for item in json.loads(message.content))
+        return return_messages
     
         # response_list = []
         # for message in message_list:
@@ -2,15 +2,22 @@ import json
 import logging
 from typing import Any
 from django.db.models.query import QuerySet
-from django.http import JsonResponse, StreamingHttpResponse
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponse, HttpResponseNotModified
 from django.views import View
 from rest_framework.decorators import api_view
 from rest_framework import generics, views, status, serializers, parsers
 from rest_framework.response import Response
 from django.apps import apps as proj_apps
+from django.conf import settings
+from asgiref.sync import sync_to_async
 from .user_thread import UserThread
 from .actor import Actor
-from .models import Thread, ThreadSerializer, Assistant, AssistantSerializer
+from .streaming import FlushPolicy, stream_events, astream_events
+from .stream_broker import get_stream_broker
+from .metrics import METRICS
+from pydantic import ValidationError
+from .return_message import ReturnItem
+from .models import Thread, ThreadSerializer, ThreadSummarySerializer, MessagePageParamsSerializer, Message, MessageImage, Assistant, AssistantSerializer
 
 
 LOGGER = logging.getLogger(__name__)
@@ -20,11 +27,21 @@ class ThreadListView(generics.ListCreateAPIView):
     model = Thread
     serializer_class = ThreadSerializer
 
+    # ?messages=false only returns the thread metadata (enough for the sidebar),
+    # otherwise the messages of all threads are fetched in parallel
     def list(self, request):
         user_id = request.query_params.get('user', None)
         if (user_id is not None):
-            queryset = Thread.objects.filter(user_id=user_id).order_by('-origin_date')[:10]
-            serializer = ThreadSerializer(queryset, many=True)
+            queryset = list(Thread.objects.filter(user_id=user_id).order_by('-origin_date')[:10])
+            if request.query_params.get('messages', 'true').lower() == 'false':
+                serializer = ThreadSummarySerializer(queryset, many=True)
+            else:
+                messages = UserThread.get_messages_for_threads(
+                    user_id=user_id,
+                    thread_ids=[thread.thread_id for thread in queryset],
+                    max_workers=settings.THREAD_HYDRATION_WORKERS,
+                )
+                serializer = ThreadSerializer(queryset, many=True, context={'messages': messages})
             return Response(serializer.data)
         else:
             raise Response(serializers.ValidationError("No user was provided."))       
@@ -41,12 +58,29 @@ class ThreadDetailView(generics.RetrieveUpdateDestroyAPIView):
     model = Thread
     serializer_class = ThreadSerializer
     
+    # without paging parameters the whole thread is returned, with limit,
+    # before or after only that page of messages plus the cursors around it
     def retrieve(self, request, *args, **kwargs):
         thread_id = kwargs['id']
         thread = Thread.objects.get(thread_id=thread_id)
         user_thread = UserThread(user_id=thread.user_id, thread_id=thread_id)
-        serializer = ThreadSerializer(thread)
-        return Response(serializer.data)
+        if not any(param in request.query_params for param in ['limit', 'before', 'after']):
+            serializer = ThreadSerializer(thread)
+            return Response(serializer.data)
+
+        params = MessagePageParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        try:
+            page = user_thread.get_message_page(**params.validated_data)
+        except Message.DoesNotExist:
+            raise serializers.ValidationError("Unknown message cursor.")
+        serializer = ThreadSerializer(thread, context={'messages': {thread_id: page.messages}})
+        return Response({
+            **serializer.data,
+            'first_id': page.first_id,
+            'last_id': page.last_id,
+            'has_more': page.has_more,
+        })
     
     def delete(self, request, *args, **kwargs):
         thread_id = kwargs['id']
@@ -78,7 +112,7 @@ class ActorListView(generics.ListCreateAPIView):
         config = proj_apps.get_app_config('genscene')
         # need to call this here to sync the state database
         actors = config.get_actors()
-        queryset = Assistant.objects.all()
+        queryset = Assistant.objects.filter(assistant_id__isnull=False)
         serializer = AssistantSerializer(queryset, many=True)
         return Response(serializer.data)
     
@@ -96,12 +130,91 @@ class ActorDetailView(generics.RetrieveAPIView):
         return Response(serializer.data)
 
 
+# Serves the code interpreter images referenced in messages. An openai file id
+# always points at the same bytes so the browser can cache them forever. Only
+# images stored in one of the requesting user's messages are served
+class ImageView (View):
+
+    def get (self, request, file_id, *args, **kwargs):
+        user_id = request.GET.get('user', None)
+        image = self._user_image(user_id, file_id) if user_id is not None else None
+        if image is None:
+            return JsonResponse({"error": "Image not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = f'"{file_id}"'
+        if request.headers.get('If-None-Match', None) == etag:
+            response = HttpResponseNotModified()
+        else:
+            openai_client = proj_apps.get_app_config('genscene').get_client()
+            try:
+                image_bytes = ReturnItem.load_image_bytes(openai_client=openai_client, file_id=file_id,
+                                                          actor=self._actor(image))
+            except Exception as e:
+                LOGGER.error(f"ImageView: could not load image {file_id}: {e}")
+                return JsonResponse({"error": "Image not found."}, status=status.HTTP_404_NOT_FOUND)
+            response = HttpResponse(image_bytes, content_type=self._content_type(image_bytes))
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+    # the images of the stored messages are recorded by UserThread.store_message
+    def _user_image (self, user_id, file_id):
+        return MessageImage.objects.filter(
+            file_id=file_id,
+            thread_id__in=Thread.objects.filter(user_id=user_id).values('thread_id'),
+        ).first()
+
+    # the image_fetch span is only tagged with actors this server knows
+    def _actor (self, image):
+        return image.actor if image.actor in proj_apps.get_app_config('genscene').actors else ''
+
+    def _content_type (self, image_bytes):
+        if image_bytes.startswith(b'\x89PNG'):
+            return 'image/png'
+        if image_bytes.startswith(b'\xff\xd8'):
+            return 'image/jpeg'
+        return 'application/octet-stream'
+
+
+# Prometheus scrape endpoint for the chat pipeline metrics
+class MetricsView (View):
+
+    def get (self, request, *args, **kwargs):
+        return HttpResponse(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class PlainTextParser(parsers.BaseParser):
     media_type = 'text/plain'
     def parse(self, stream, media_type=None, parser_context=None):
         return stream.read()
 
 
+# offset to resume a stream from, sent by SSE clients when they reconnect
+def last_event_id (request, default=None):
+    value = request.headers.get('Last-Event-ID', None)
+    if value is None or value == '':
+        return default
+    return int(value)
+
+
+# subscribe to a thread's stream, None when the thread has no stream to resume
+def resume_stream_response (thread_id, offset, flush_policy, asynchronous=False):
+    broker = get_stream_broker()
+    try:
+        broker.read(thread_id, offset, timeout=0)
+    except KeyError:
+        return None
+    if asynchronous:
+        response_stream = astream_events(broker, thread_id, offset, flush_policy)
+    else:
+        response_stream = stream_events(broker, thread_id, offset, flush_policy)
+    response = StreamingHttpResponse(response_stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    response["thread_id"] = thread_id
+    return response
+
+
 class ChatView (generics.CreateAPIView):
 
     def create (self, request, *args, **kwargs):
@@ -109,13 +222,25 @@ class ChatView (generics.CreateAPIView):
         input = request.data.get('input', '')
         actor_name = request.data.get('actor', None)
         thread_id = request.data.get('thread', None)
-        buffer_size = request.data.get('buffer_size', 1)
+        try:
+            flush_policy = FlushPolicy.from_request(request.data)
+            resume_from = last_event_id(request)
+        except (ValueError, ValidationError) as e:
+            raise serializers.ValidationError(f"Invalid buffer settings: {e}")
         LOGGER.info(f"ChatView.POST for input: {input}, user: {user_id}, actor: {actor_name}, thread_id: {thread_id}")
 
+        # a reconnect replays the run it lost instead of starting a new one
+        if resume_from is not None and thread_id is not None:
+            response = resume_stream_response(thread_id, resume_from, flush_policy)
+            if response is None:
+                return Response({"error": f"No stream for thread {thread_id}"}, status=status.HTTP_404_NOT_FOUND)
+            response["actor"] = actor_name
+            return response
+
         user_thread = UserThread(user_id=user_id, thread_id=thread_id)
         actor: Actor = proj_apps.get_app_config('genscene').get_actor(actor_name)
 
-        response_stream = actor.stream_responses(input=input, user_thread=user_thread, buffer_size=buffer_size)
+        response_stream = actor.stream_responses(input=input, user_thread=user_thread, flush_policy=flush_policy)
         # response = StreamingHttpResponse(response_stream, content_type='text/markdown')
         response = StreamingHttpResponse(response_stream, content_type='text/event-stream')
         response['Cache-Control'] = 'no-cache'
@@ -126,5 +251,64 @@ class ChatView (generics.CreateAPIView):
 
         # response = actor.get_responses(input=input, user_thread=user_thread)
         # return JsonResponse({"messages": response, "thread_id": user_thread.thread_id})
-    
 
+
+# Same contract as ChatView but fully async so it needs to be served by ASGI
+# (conf/asgi.py). The stream is driven by the event loop so a long answer
+# does not hold a worker thread. DRF views are sync only, so this is a plain django view
+class AsyncChatView (View):
+
+    async def post (self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body or b'{}')
+        except json.JSONDecodeError:
+            return JsonResponse({"error": "Body must be JSON."}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_id = data.get('user', None)
+        input = data.get('input', '')
+        actor_name = data.get('actor', None)
+        thread_id = data.get('thread', None)
+        try:
+            flush_policy = FlushPolicy.from_request(data)
+            resume_from = last_event_id(request)
+        except (ValueError, ValidationError) as e:
+            return JsonResponse({"error": f"Invalid buffer settings: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        LOGGER.info(f"AsyncChatView.POST for input: {input}, user: {user_id}, actor: {actor_name}, thread_id: {thread_id}")
+
+        if resume_from is not None and thread_id is not None:
+            response = await sync_to_async(resume_stream_response)(thread_id, resume_from, flush_policy, asynchronous=True)
+            if response is None:
+                return JsonResponse({"error": f"No stream for thread {thread_id}"}, status=status.HTTP_404_NOT_FOUND)
+            response["actor"] = actor_name
+            return response
+
+        user_thread = await sync_to_async(UserThread)(user_id=user_id, thread_id=thread_id)
+        actor: Actor = await sync_to_async(proj_apps.get_app_config('genscene').get_actor)(actor_name)
+
+        response_stream = await actor.astream_responses(input=input, user_thread=user_thread, flush_policy=flush_policy)
+        response = StreamingHttpResponse(response_stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        response["thread_id"] = user_thread.thread_id
+        response["actor"] = actor_name
+        return response
+
+
+# Subscribe to the stream of a thread's latest run after the given offset
+# (Last-Event-ID header or ?offset=), e.g. to resume an answer after a
+# reconnect. Any worker can serve it when the stream broker is shared
+# (STREAM_BROKER_URL). Works with a plain EventSource
+class ChatStreamView (generics.RetrieveAPIView):
+
+    def retrieve (self, request, thread_id, *args, **kwargs):
+        try:
+            offset = last_event_id(request, default=int(request.query_params.get('offset', 0)))
+            flush_policy = FlushPolicy.from_request(request.query_params)
+        except (ValueError, ValidationError) as e:
+            raise serializers.ValidationError(f"Invalid stream parameters: {e}")
+        LOGGER.info(f"ChatStreamView.GET for thread_id: {thread_id}, offset: {offset}")
+
+        response = resume_stream_response(thread_id, offset, flush_policy)
+        if response is None:
+            return Response({"error": f"No stream for thread {thread_id}"}, status=status.HTTP_404_NOT_FOUND)
+        return response
@@ -2,7 +2,7 @@
 import React, { useState, useEffect, useRef } from 'react';
 import logo from './logo.svg';
 import './App.css';
-import Chatbot from './Chatbot';
+import Chatbot, { MESSAGE_PAGE_SIZE } from './Chatbot';
 import Sidebar from './Sidebar';
 import axios from 'axios';
 
@@ -34,7 +34,8 @@ function App() {
 
   const updateThread = async (threadId) => {
     await axios.get(
-        `http://127.0.0.1:8000/api/threads/${threadId}`
+        `http://127.0.0.1:8000/api/threads/${threadId}`,
+        { params: { limit: MESSAGE_PAGE_SIZE } }
     ).then(response => {
         console.log(`App: changed thread: ${response.data.thread_id}`);
         setThread(response.data); 
@@ -46,7 +47,7 @@ function App() {
   const updateThreadList = async () => {
     await axios.get(
         'http://127.0.0.1:8000/api/threads/',
-        { params: { user: user } }
+        { params: { user: user, messages: false } }
     ).then(response => {
         console.log(`App: updated thread list: ${response.data}`);
         setThreadList(response.data); 
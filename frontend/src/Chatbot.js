@@ -5,6 +5,28 @@ import './Chatbot.css'; // Ensure you have a Chatbot.css file with the styles
 
 
 
+// images are sent as a path to the image endpoint of the api
+const API_HOST = 'http://127.0.0.1:8000';
+const IMAGE_PATH = '/api/images/';
+const MAX_RECONNECTS = 3;
+// messages per page when opening a thread and when loading older messages
+export const MESSAGE_PAGE_SIZE = 50;
+
+// one server sent event: "id: ..\nevent: ..\ndata: {json}"
+const parseEvent = (block) => {
+  const event = { id: null, event: 'message', data: {} };
+  block.split('\n').forEach((line) => {
+    const colon = line.indexOf(':');
+    if (colon <= 0) return;
+    const field = line.slice(0, colon);
+    const value = line.slice(colon + 1).trimStart();
+    if (field === 'id') event.id = parseInt(value, 10);
+    else if (field === 'event') event.event = value;
+    else if (field === 'data') event.data = JSON.parse(value);
+  });
+  return event;
+};
+
 // Custom renderer for certain blocks
 const renderer = new marked.Renderer();
 renderer.code = (code, language) => {
@@ -18,7 +40,10 @@ function Chatbot({ user, actor, thread, actorList, onActorChange, onThreadListCh
 
   const [prompt, setPrompt] = useState('');
   const [chat, setChat] = useState([]);
+  // cursor of the oldest loaded message, when the thread has older ones
+  const [olderCursor, setOlderCursor] = useState(null);
   const chatEndRef = useRef(null);
+  const keepScrollRef = useRef(false);
 
 
   const updateChat = (action) => {
@@ -28,6 +53,8 @@ function Chatbot({ user, actor, thread, actorList, onActorChange, onThreadListCh
           return action.messages;
         case 'add':
           return [...currentChat, ...action.messages];
+        case 'prepend':
+          return [...action.messages, ...currentChat];
         case 'update':
           const clonedChat = [...currentChat];
           clonedChat[clonedChat.length - 1] = {...clonedChat[clonedChat.length - 1]}
@@ -44,7 +71,12 @@ function Chatbot({ user, actor, thread, actorList, onActorChange, onThreadListCh
     onActorChange(actorName);
   };   
 
+  // loading older messages keeps the reader where they were
   const scrollToBottom = () => {
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false;
+      return;
+    }
     chatEndRef.current?.scrollIntoView({ behavior: "smooth" });
   };
   useEffect(scrollToBottom, [chat]);
@@ -59,9 +91,28 @@ function Chatbot({ user, actor, thread, actorList, onActorChange, onThreadListCh
       } else {
         updateChat({ type: 'set', messages: [] });
       }
+      setOlderCursor(thread.has_more ? thread.first_id : null);
     }
   }, [thread]);  
 
+  // the thread is opened on its latest page, older pages are fetched before
+  // the first loaded message
+  const loadOlderMessages = async () => {
+    const params = new URLSearchParams({ limit: MESSAGE_PAGE_SIZE, before: olderCursor });
+    try {
+      const response = await fetch(`${API_HOST}/api/threads/${thread.thread_id}/?${params}`);
+      if (!response.ok) {
+        throw new Error('Network response was not ok');
+      }
+      const page = await response.json();
+      keepScrollRef.current = true;
+      updateChat({ type: 'prepend', messages: page.messages !== null ? JSON.parse(page.messages) : [] });
+      setOlderCursor(page.has_more ? page.first_id : null);
+    } catch (error) {
+      console.error('Chat: could not load older messages:', error);
+    }
+  };
+
   const markdownText = (text) => {
     return marked(text, { sanitize: true, renderer: renderer });
   }
@@ -71,9 +122,9 @@ function Chatbot({ user, actor, thread, actorList, onActorChange, onThreadListCh
     const msgType = chatMessage.type;
     //console.log('rendering message:', chatMessage);
     if (typeof msgValue === 'string' || msgValue instanceof String) {
-        if (msgValue.startsWith('data:image/png;base64')) {
+        if (msgValue.startsWith(IMAGE_PATH)) {
             return (
-                <img src={msgValue} alt="image response" />
+                <img src={`${API_HOST}${msgValue}?user=${encodeURIComponent(user)}`} alt="image response" />
             );
         } else {
             if (chatMessage.role === 'user') {
@@ -101,6 +152,75 @@ function Chatbot({ user, actor, thread, actorList, onActorChange, onThreadListCh
   }
 
 
+  const handleEvent = (event) => {
+    switch (event.event) {
+      case 'delta':
+        updateChat({ type: 'update', text: event.data.value });
+        break;
+      case 'image':
+        updateChat({ type: 'add', messages: [
+                      { 'value': event.data.value, 'role': 'assistant', type: 'image_file' },
+                      { 'value': '', 'role': 'assistant', type: 'text' }
+                  ] });
+        break;
+      case 'tool':
+        console.log('Stream: calling tool:', event.data.value);
+        break;
+      case 'gap':
+        // the server dropped part of the answer, the full text is in the thread
+        console.warn('Stream: part of the answer was dropped at event', event.id);
+        updateChat({ type: 'update', text: ' [...] ' });
+        break;
+      default:
+        break;
+    }
+  };
+
+  // read the server sent events of a run, when the connection drops before the
+  // done event the stream is resumed after the last event id that was received
+  const readEvents = async (response, threadId, lastEventId, reconnects) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    try {
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let end = buffer.indexOf('\n\n');
+        while (end >= 0) {
+          const event = parseEvent(buffer.slice(0, end));
+          buffer = buffer.slice(end + 2);
+          end = buffer.indexOf('\n\n');
+          if (event.id !== null) lastEventId = event.id;
+          if (event.event === 'done') {
+            console.log('Stream complete at event', lastEventId);
+            return;
+          }
+          handleEvent(event);
+        }
+      }
+    } catch (error) {
+      console.error('Error reading stream:', error);
+    }
+
+    if (threadId === null || reconnects <= 0) {
+      console.error('Stream: lost at event', lastEventId);
+      return;
+    }
+    try {
+      const resumed = await fetch(`${API_HOST}/api/chat/stream/${threadId}/`, {
+        headers: { 'Last-Event-ID': String(lastEventId) },
+      });
+      if (!resumed.ok) {
+        throw new Error('Could not resume stream');
+      }
+      readEvents(resumed, threadId, lastEventId, reconnects - 1);
+    } catch (error) {
+      console.error('Stream: error:', error);
+    }
+  };
+
   const sendPrompt = async (e) => {
     console.log(`sending prompt: ${prompt}`);
 
@@ -117,8 +237,7 @@ function Chatbot({ user, actor, thread, actorList, onActorChange, onThreadListCh
     }
 
     try {
-      const decoder = new TextDecoder();
-      const response = await fetch('http://127.0.0.1:8000/api/chat/', {
+      const response = await fetch(API_HOST + '/api/chat/', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',  
@@ -129,52 +248,7 @@ function Chatbot({ user, actor, thread, actorList, onActorChange, onThreadListCh
       if (!response.ok) {
         throw new Error('Network response was not ok');
       }
-
-      const reader = response.body.getReader();
-      let streamLength = 0;
-      let imageBuffer = '';
-      const readStream = () => {
-        reader.read().then(({ done, value }) => {
-          
-          if (done) {
-            console.log('Stream complete: ', streamLength, 'bytes');
-            return;
-          }
-          
-          streamLength += value.byteLength;
-          const msgString = decoder.decode(value, { stream: true })
-          if (msgString.startsWith('data:image/png;base64')) {
-            imageBuffer += msgString;
-          } else {
-            //end of the image
-            if (imageBuffer.length > 0) {
-              if (msgString.includes('|')) {
-                const [beforePipe, afterPipe] = msgString.split('|');
-                if (beforePipe.length > 0) {
-                  imageBuffer += beforePipe;
-                }
-                if (afterPipe.length > 0) {
-                  afterPipe = '';
-                }
-                updateChat({ type: 'add', messages: [
-                              { 'value': imageBuffer, 'role': 'assistant', type: 'image' },
-                              { 'value': '', 'role': 'assistant', type: 'text' }
-                          ] });
-                imageBuffer = '';
-              } else {
-                imageBuffer += msgString;
-              }
-            } else {
-              updateChat({ type: 'update', text: msgString });
-            }
-          }
-
-          readStream();
-        }).catch(error => {
-          console.error('Error reading stream:', error);
-        });
-      };
-      readStream();
+      readEvents(response, response.headers.get('thread_id'), 0, MAX_RECONNECTS);
 
     } catch (error) {
       console.error('Stream: error:', error);
@@ -191,6 +265,11 @@ function Chatbot({ user, actor, thread, actorList, onActorChange, onThreadListCh
         <div className="chatbot-container">
 
           <div className="chat-window">
+            {olderCursor !== null && (
+              <Button variant="outline-secondary" size="sm" className="load-older" onClick={loadOlderMessages}>
+                Load older messages
+              </Button>
+            )}
             {renderChat(chat)}
             <div ref={chatEndRef} />
           </div>